@@ -1,6 +1,26 @@
+import time
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+from django.db.backends.signals import connection_created
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
-    verbose_name = 'API'  # Optional but helpful
\ No newline at end of file
+    verbose_name = 'API'  # Optional but helpful
+    
+    def ready(self):
+        from myapp.routers import check_pin_cache
+        checks.register(check_pin_cache, checks.Tags.caches)
+        if settings.SIMULATED_DB_LATENCY_MS:
+            connection_created.connect(_add_simulated_latency, dispatch_uid='simulated_db_latency')
+
+
+def _add_simulated_latency(sender, connection, **kwargs):
+    delay = settings.SIMULATED_DB_LATENCY_MS / 1000
+
+    def slow_execute(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+    connection.execute_wrappers.append(slow_execute)
@@ -0,0 +1,141 @@
+"""
+JWT authentication without a ``User`` query on every request.
+
+Access tokens issued by ``tokens_for`` carry the ``username``, ``is_staff``
+and ``is_superuser`` claims. ``ClaimsJWTAuthentication`` trusts them for
+``JWT_CLAIMS_MAX_AGE`` seconds after the token was issued and returns a
+``TokenUser`` - enough for ``IsAuthenticated`` and ``IsAdminUser`` - so the
+views that only need those (locker reads, fleet stats) make no user query.
+Everything else goes through ``CachedJWTAuthentication``, the default, which
+keeps the user rows it loads in a small per-process cache for
+``JWT_USER_CACHE_TTL`` seconds. Older claims fall back to that cache too.
+
+Deactivating, demoting or deleting a user therefore takes effect everywhere
+within the larger of the two settings (immediately in the process that made
+the change, which evicts its cached copy).
+
+Revoked tokens (logout, rotated refresh tokens) are rejected by both, and by
+``aaccess_token``, without a query; see ``api.services.revocation``.
+"""
+import copy
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .services.revocation import ais_revoked, is_revoked
+
+CLAIMS = ('username', 'is_staff', 'is_superuser')
+USER_CACHE_SIZE = 10_000
+
+# user id claim -> (expires at, User)
+_users = OrderedDict()
+
+
+async def aaccess_token(request, query_param=None):
+    """Validate the request's access token without touching the user table.
+
+    The token comes from ``Authorization: Bearer``, or from ``query_param``
+    when given (``EventSource`` cannot send headers). Returns the token, or None.
+    """
+    header = request.headers.get('Authorization', '')
+    raw = header[7:] if header.startswith('Bearer ') else (request.GET.get(query_param) if query_param else None)
+    if not raw:
+        return None
+    try:
+        token = AccessToken(raw)
+    except TokenError:
+        return None
+    return None if await ais_revoked(token) else token
+
+
+def stamp_claims(token, user):
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def tokens_for(user):
+    """A ``(refresh, access)`` pair for ``user``; only the access token carries claims.
+
+    Refreshing re-reads the user (``ClaimsTokenRefreshSerializer``), so claims
+    are never copied forward from an old refresh token.
+    """
+    refresh = RefreshToken.for_user(user)
+    return refresh, stamp_claims(refresh.access_token, user)
+
+
+def fresh_claims(token):
+    """Whether ``token`` carries claims recent enough to be trusted."""
+    return (
+        all(claim in token for claim in CLAIMS)
+        and time.time() - token.get('iat', 0) < settings.JWT_CLAIMS_MAX_AGE
+    )
+
+
+def forget_user(user_id):
+    """Drop ``user_id`` from this process's user cache (see ``api.signals``)."""
+    _users.pop(str(user_id), None)
+
+
+def _cached_user(user_id):
+    entry = _users.get(user_id)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    # A copy per request: views may modify request.user before saving it.
+    return copy.copy(entry[1])
+
+
+def _remember_user(user_id, user):
+    if settings.JWT_USER_CACHE_TTL <= 0:
+        return
+    _users[user_id] = (time.monotonic() + settings.JWT_USER_CACHE_TTL, user)
+    _users.move_to_end(user_id)
+    while len(_users) > USER_CACHE_SIZE:
+        _users.popitem(last=False)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` with the user lookup served from a short-lived per-process cache."""
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken('Token has been revoked')
+        return token
+
+    def get_user(self, validated_token):
+        user_id = str(validated_token.get(jwt_settings.USER_ID_CLAIM))
+        user = _cached_user(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            _remember_user(user_id, user)
+            user = copy.copy(user)
+        return user
+
+    async def aget_user(self, validated_token):
+        user = _cached_user(str(validated_token.get(jwt_settings.USER_ID_CLAIM)))
+        return user if user is not None else await sync_to_async(self.get_user)(validated_token)
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    """Authenticate from the token's claims while they are fresh; the cached user row otherwise.
+
+    ``request.user`` may be a ``TokenUser``: only for views that need no more
+    than the user's id, name and staff flags.
+    """
+
+    def get_user(self, validated_token):
+        if fresh_claims(validated_token):
+            return jwt_settings.TOKEN_USER_CLASS(validated_token)
+        return super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        if fresh_claims(validated_token):
+            return jwt_settings.TOKEN_USER_CLASS(validated_token)
+        return await super().aget_user(validated_token)
@@ -0,0 +1,23 @@
+from django.db.models import DecimalField, Func
+
+
+class HoursBetween(Func):
+    """Fractional hours from ``start`` to ``end`` (both datetime expressions)."""
+    arity = 2
+    output_field = DecimalField(max_digits=14, decimal_places=6)
+
+    def _compile_args(self, compiler):
+        (start, start_params), (end, end_params) = (compiler.compile(arg) for arg in self.source_expressions)
+        return start, end, start_params, end_params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        start, end, start_params, end_params = self._compile_args(compiler)
+        return f'((julianday({end}) - julianday({start})) * 24.0)', (*end_params, *start_params)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        start, end, start_params, end_params = self._compile_args(compiler)
+        return f'(EXTRACT(EPOCH FROM ({end} - {start})) / 3600.0)', (*end_params, *start_params)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        start, end, start_params, end_params = self._compile_args(compiler)
+        return f'(TIMESTAMPDIFF(MICROSECOND, {start}, {end}) / 3600000000.0)', (*start_params, *end_params)
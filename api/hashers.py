@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# Below this many passwords per process, starting a pool costs more than it saves.
+MIN_PER_WORKER = 50
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with its work factor from ``PASSWORD_HASH_ITERATIONS``.
+
+    ``must_update`` compares a stored hash's count with this one, so when the
+    setting changes Django's ``check_password`` rehashes each user's password
+    on their next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or super().iterations
+
+
+_worker_iterations = None
+
+
+def _init_worker(iterations):
+    global _worker_iterations
+    django.setup()
+    _worker_iterations = iterations
+
+
+def _hash(password, iterations=None):
+    iterations = iterations or _worker_iterations
+    if not iterations:
+        return hashers.make_password(password)
+    hasher = hashers.get_hasher()
+    return hasher.encode(password, hasher.salt(), iterations)
+
+
+def pool_size(count, workers=None):
+    """Processes ``hash_passwords`` uses for ``count`` passwords; 1 means none are started."""
+    return max(1, min(workers or os.cpu_count() or 1, count // MIN_PER_WORKER))
+
+
+def hash_passwords(passwords, workers=None, iterations=None):
+    """Hash ``passwords``, in order, across up to ``workers`` processes (default: one per CPU).
+
+    ``iterations`` overrides the PBKDF2 work factor for these hashes only;
+    the hasher upgrades each one on the user's first successful login.
+    Workers are spawned, not forked: the parent may be a server process
+    with threads and open connections.
+    """
+    if iterations and not isinstance(hashers.get_hasher(), hashers.PBKDF2PasswordHasher):
+        raise ValueError('iterations can only be set when the default password hasher is PBKDF2')
+    workers = pool_size(len(passwords), workers)
+    if workers <= 1:
+        return [_hash(password, iterations) for password in passwords]
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(iterations,),
+    ) as pool:
+        return list(pool.map(_hash, passwords, chunksize=max(1, min(64, len(passwords) // (workers * 4)))))
@@ -0,0 +1,311 @@
+"""
+Scripted HTTP load against a local server, with JSON baselines.
+
+Virtual users replay the traffic the frontend and operators produce - the
+locker list polled every 10 seconds (every page), bursts of reserve and
+release, admin bulk edits and login storms - over keep-alive HTTP/1.1
+connections on one asyncio loop, so no external load tool is needed. Each
+response is recorded under ``<phase> <METHOD> <route>`` with its latency,
+status and the query count the server reports in ``Server-Timing`` (the
+server is run with ``REQUEST_TIMING_SAMPLE_RATE=1``).
+
+A run's summary can be saved as a baseline and a later run compared with
+it; see ``compare``.
+"""
+import asyncio
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from django.core.management.base import CommandError
+
+SERVERS = {
+    'wsgi': ['myapp.wsgi:application', '-k', 'sync'],
+    'asgi': ['myapp.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+# Share of virtual users per scenario in the ``mixed`` phase.
+MIX = {'polling': 0.7, 'reserve_burst': 0.15, 'login_storm': 0.1, 'admin_bulk': 0.05}
+
+
+class LocalServer:
+    """Run a gunicorn server in a subprocess for the duration of a ``with`` block."""
+
+    def __init__(self, kind, port, workers=2, env=None):
+        self.port = port
+        self.command = [
+            sys.executable, '-m', 'gunicorn', *SERVERS[kind],
+            '-w', str(workers), '-b', f'127.0.0.1:{port}',
+            '--log-level', 'warning', '--timeout', '120', '--backlog', '4096',
+        ]
+        self.env = {**os.environ, **(env or {})}
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, env=self.env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                if self.process.poll() is not None:
+                    raise CommandError(f'{self.command[3]} exited during startup')
+                time.sleep(0.2)
+        self.__exit__()
+        raise CommandError(f'{self.command[3]} did not start listening on {self.port}')
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response; returns ``(status, headers, body)``."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+class HTTPConnection:
+    """One keep-alive connection; reconnects when the server closes it."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=(), body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = b'' if body is None else json.dumps(body).encode()
+        lines = [f'{method} {path} HTTP/1.1', 'Host: localhost', 'Accept: application/json', *headers]
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(payload)}']
+        try:
+            self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+            status, headers, content = await read_response(self.reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+@dataclass
+class Context:
+    """Everything the scenarios need to know about the seeded dataset."""
+    host: str
+    port: int
+    user_tokens: list
+    admin_token: str
+    usernames: list
+    password: str
+    locker_ids: list
+    poll_interval: float = 10.0
+    bulk_size: int = 100
+
+
+@dataclass
+class Results:
+    latencies: dict = field(default_factory=lambda: defaultdict(list))
+    queries: dict = field(default_factory=lambda: defaultdict(list))
+    errors: dict = field(default_factory=lambda: defaultdict(int))
+    elapsed: dict = field(default_factory=dict)
+
+    def summary(self):
+        out = {}
+        for key, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            phase = key.split(' ', 1)[0]
+            queries = self.queries.get(key)
+            out[key] = {
+                'requests': len(samples),
+                'rps': round(len(samples) / self.elapsed[phase], 2),
+                'p50_ms': round(_percentile(samples, 0.50), 2),
+                'p95_ms': round(_percentile(samples, 0.95), 2),
+                'p99_ms': round(_percentile(samples, 0.99), 2),
+                'errors': self.errors.get(key, 0),
+                'queries': round(statistics.fmean(queries), 2) if queries else None,
+            }
+        return out
+
+
+def _percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class VirtualUser:
+    def __init__(self, phase, context, results, rng, deadline, token=None):
+        self.phase, self.context, self.results, self.rng = phase, context, results, rng
+        self.deadline = deadline
+        self.headers = [f'Authorization: Bearer {token}'] if token else []
+        self.http = HTTPConnection(context.host, context.port)
+
+    @property
+    def running(self):
+        return time.monotonic() < self.deadline
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(max(min(seconds, self.deadline - time.monotonic()), 0))
+
+    async def call(self, route, method, path, body=None, ok=(200,)):
+        """Make one request, record it under ``route`` and return ``(status, json)``."""
+        key = f'{self.phase} {method} {route}'
+        started = time.perf_counter()
+        try:
+            status, headers, content = await self.http.request(method, path, self.headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.results.errors[key] += 1
+            return None, None
+        self.results.latencies[key].append((time.perf_counter() - started) * 1000)
+        match = QUERY_COUNT.search(headers.get('server-timing', ''))
+        if match:
+            self.results.queries[key].append(int(match.group(1)))
+        if status not in ok:
+            self.results.errors[key] += 1
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+
+async def polling(vu):
+    """The locker page: fetch every page of ``/api/lockers/``, then wait ``poll_interval``."""
+    # Spread the first polls over the interval, as real clients would be.
+    await vu.sleep(vu.rng.random() * vu.context.poll_interval)
+    while vu.running:
+        started = time.monotonic()
+        path = '/api/lockers/'
+        while path and vu.running:
+            status, data = await vu.call('/api/lockers/', 'GET', path)
+            if status != 200:
+                break
+            next_url = data.get('next')
+            path = urlsplit(next_url)._replace(scheme='', netloc='').geturl() if next_url else None
+        await vu.sleep(vu.context.poll_interval - (time.monotonic() - started))
+
+
+async def reserve_burst(vu):
+    """Find an available locker, reserve it and release it again, back to back."""
+    while vu.running:
+        status, data = await vu.call('/api/lockers/available/', 'GET', '/api/lockers/available/?page_size=50')
+        lockers = (data or {}).get('results') or []
+        if status != 200 or not lockers:
+            await vu.sleep(0.1)
+            continue
+        locker_id = vu.rng.choice(lockers)['id']
+        status, data = await vu.call(
+            '/api/lockers/{id}/reserve/', 'POST', f'/api/lockers/{locker_id}/reserve/',
+            {'duration': 1}, ok=(200, 409),
+        )
+        if status == 200:
+            await vu.call(
+                '/api/reservations/{id}/release/', 'PUT', f'/api/reservations/{data["reservation_id"]}/release/',
+            )
+
+
+async def admin_bulk(vu):
+    """Reprice a batch of lockers, then read the fleet stats."""
+    prices = ['1.50', '2.00', '2.50', '3.00', '4.00']
+    while vu.running:
+        batch = vu.rng.sample(vu.context.locker_ids, min(vu.context.bulk_size, len(vu.context.locker_ids)))
+        await vu.call(
+            '/api/admin/lockers/bulk/', 'PATCH', '/api/admin/lockers/bulk/',
+            [{'id': locker_id, 'price_per_hour': vu.rng.choice(prices)} for locker_id in batch], ok=(200, 207),
+        )
+        await vu.call('/api/admin/lockers/stats/', 'GET', '/api/admin/lockers/stats/')
+
+
+async def login_storm(vu):
+    """Log in over and over with the synthetic users' password."""
+    while vu.running:
+        await vu.call('/api/auth/login/', 'POST', '/api/auth/login/', {
+            'username': vu.rng.choice(vu.context.usernames), 'password': vu.context.password,
+        })
+
+
+# scenario: (coroutine, who it runs as)
+SCENARIOS = {
+    'polling': (polling, 'user'),
+    'reserve_burst': (reserve_burst, 'user'),
+    'admin_bulk': (admin_bulk, 'admin'),
+    'login_storm': (login_storm, None),
+}
+PHASES = [*SCENARIOS, 'mixed']
+
+
+def _allocate(phase, vus):
+    if phase != 'mixed':
+        return {phase: vus}
+    return {name: max(1, round(vus * share)) for name, share in MIX.items()}
+
+
+async def run_phase(phase, vus, duration, context, results, rng):
+    deadline = time.monotonic() + duration
+    users = []
+    for scenario, count in _allocate(phase, vus).items():
+        work, role = SCENARIOS[scenario]
+        for _ in range(count):
+            if role == 'admin':
+                token = context.admin_token
+            else:
+                token = rng.choice(context.user_tokens) if role == 'user' else None
+            users.append((work, VirtualUser(phase, context, results, rng, deadline, token)))
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(work(vu) for work, vu in users))
+    finally:
+        for _, vu in users:
+            vu.http.close()
+    results.elapsed[phase] = time.monotonic() - started
+
+
+def compare(current, baseline, tolerance):
+    """Compare two summaries; returns ``(rows, regressions)``.
+
+    An endpoint regresses when its p95 grows, or its throughput drops, by
+    more than ``tolerance`` (a fraction; p95 changes under 2 ms are noise),
+    when it makes more queries per request, or when it starts failing.
+    """
+    rows, regressions = [], []
+    for key, now in current.items():
+        before = baseline.get(key)
+        if before is None:
+            rows.append((key, now, None, ['new']))
+            continue
+        flags = []
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance) and now['p95_ms'] - before['p95_ms'] > 2:
+            flags.append('p95')
+        if now['rps'] < before['rps'] * (1 - tolerance):
+            flags.append('rps')
+        if now['queries'] is not None and before['queries'] is not None and now['queries'] > before['queries'] + 0.5:
+            flags.append('queries')
+        if now['errors'] / max(now['requests'], 1) > before['errors'] / max(before['requests'], 1) + 0.01:
+            flags.append('errors')
+        rows.append((key, now, before, flags))
+        if flags:
+            regressions.append((key, flags))
+    return rows, regressions
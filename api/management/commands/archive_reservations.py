@@ -0,0 +1,48 @@
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp.sharding import shard_databases
+
+from api.services.archive import BATCH_SIZE, MAX_BATCHES, archive, default_cutoff
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Move old completed and cancelled reservations to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float,
+                            help='Archive reservations that ended this long ago (default RESERVATION_ARCHIVE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Reservations moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=MAX_BATCHES,
+                            help='Stop after this many batches; rerun to continue')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--database', help='Default: every shard, or the primary without sharding')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['max_batches'] < 1:
+            raise CommandError('--batch-size and --max-batches must be positive')
+        if options['older_than_days'] is None:
+            cutoff = default_cutoff()
+        elif options['older_than_days'] < 0:
+            raise CommandError('--older-than-days must not be negative')
+        else:
+            cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+
+        databases = [options['database']] if options['database'] else shard_databases()
+        for using in databases:
+            metrics = archive(
+                cutoff, batch_size=options['batch_size'], max_batches=options['max_batches'],
+                pause=options['pause'], using=using,
+            )
+            line = ' '.join(f'{key}={value}' for key, value in metrics.items())
+            if len(databases) > 1:
+                line = f'database={using} {line}'
+            logger.info(f'Reservation archive: {line}')
+            self.stdout.write(line)
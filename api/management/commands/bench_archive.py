@@ -0,0 +1,119 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import ArchivedReservation, Locker, Reservation
+from api.services.archive import BATCH_SIZE, archive, default_cutoff
+from api.services.reservations import LIVE_STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Seed two years of reservation history and time hot-table queries before and after archival'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=500_000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--lockers', type=int, default=500)
+        parser.add_argument('--probes', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = [
+            User.objects.get_or_create(username=f'bench_archive_{i}')[0] for i in range(options['users'])
+        ]
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'BH{i:06d}', location='bench-archive') for i in range(options['lockers'])],
+            ignore_conflicts=True, batch_size=1000,
+        )
+        locker_ids = list(Locker.objects.filter(location='bench-archive').values_list('id', flat=True))
+        self._seed_history(users, locker_ids, options['reservations'], rng)
+
+        probes = {
+            # ReservationViewSet.list for a regular user (unpaginated).
+            'user list': lambda: list(
+                Reservation.objects.select_related('locker').filter(user=rng.choice(users))
+            ),
+            # First page of the admin listing, newest first.
+            'admin page': lambda: list(Reservation.objects.select_related('locker')[:100]),
+            'user live': lambda: Reservation.objects.filter(
+                user=rng.choice(users), status__in=LIVE_STATUSES
+            ).exists(),
+            'history page': lambda: list(
+                ArchivedReservation.objects.select_related('locker').filter(user=rng.choice(users))[:100]
+            ),
+        }
+        try:
+            before = {name: self._time(options['probes'], probe) for name, probe in probes.items()}
+            hot_before = Reservation.objects.count()
+            metrics = archive(default_cutoff(), batch_size=options['batch_size'], max_batches=10 ** 9)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            after = {name: self._time(options['probes'], probe) for name, probe in probes.items()}
+
+            self.stdout.write(
+                f'hot rows: {hot_before} -> {Reservation.objects.count()}; archived {metrics["archived"]} '
+                f'in {metrics["batches"]} batches, {metrics["elapsed_ms"] / 1000:.1f}s '
+                f'({metrics["archived"] / max(metrics["elapsed_ms"] / 1000, 1e-9):,.0f} rows/s)'
+            )
+            self.stdout.write(f'{"query":<14} {"before p50/p99 ms":>20} {"after p50/p99 ms":>20}')
+            for name in probes:
+                self.stdout.write(
+                    f'{name:<14} {before[name][0]:>9.2f} /{before[name][1]:>8.2f} '
+                    f'{after[name][0]:>9.2f} /{after[name][1]:>8.2f}'
+                )
+        finally:
+            if not options['keep']:
+                Reservation.objects.filter(user__in=users).delete()
+                ArchivedReservation.objects.filter(user__in=users).delete()
+                Locker.objects.filter(location='bench-archive').delete()
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _seed_history(self, users, locker_ids, count, rng):
+        # Two years of finished reservations (so most are past the archive
+        # age) plus a handful of live ones per user.
+        existing = Reservation.objects.filter(user__in=users).count()
+        now = timezone.now()
+        ops = connection.ops
+        table = ops.quote_name(Reservation._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} (user_id, locker_id, start_time, end_time, total_price, status, created_at, updated_at) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)'
+        )
+        statuses = ('completed', 'completed', 'completed', 'cancelled')
+        started = time.perf_counter()
+        remaining = count - existing
+        with transaction.atomic(), connection.cursor() as cursor:
+            while remaining > 0:
+                rows = []
+                for _ in range(min(remaining, 50_000)):
+                    live = rng.random() < 0.01
+                    start = now - timedelta(minutes=rng.randint(0 if live else 60, 60 * 24 * 365 * 2))
+                    end = (now if live else start) + timedelta(minutes=rng.randint(30, 600))
+                    rows.append((
+                        rng.choice(users).pk, rng.choice(locker_ids),
+                        ops.adapt_datetimefield_value(start), ops.adapt_datetimefield_value(end),
+                        None if live else '5.00', 'active' if live else rng.choice(statuses),
+                        ops.adapt_datetimefield_value(start), ops.adapt_datetimefield_value(start if live else end),
+                    ))
+                cursor.executemany(sql, rows)
+                remaining -= len(rows)
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'seeded {count - existing} reservations in {time.perf_counter() - started:.1f}s')
+
+    def _time(self, runs, probe):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            probe()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
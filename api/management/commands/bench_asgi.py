@@ -0,0 +1,111 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.authentication import tokens_for
+from api.loadtest import SERVERS, LocalServer, read_response
+from api.models import Locker
+
+
+class Command(BaseCommand):
+    help = 'Load the locker list under gunicorn WSGI and ASGI workers with simulated DB latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per server')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--db-latency-ms', type=float, default=20)
+        parser.add_argument('--path', default='/api/lockers/?page_size=20')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['NAME'] == ':memory:':
+            raise CommandError('The servers need a database they can share with this process')
+        user, _ = User.objects.get_or_create(username='bench_asgi')
+        token = str(tokens_for(user)[1])
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'BA{i:04d}', location='bench-asgi') for i in range(100)],
+            ignore_conflicts=True,
+        )
+
+        self.stdout.write(
+            f'{options["concurrency"]} connections, {options["workers"]} workers, '
+            f'{options["db_latency_ms"]:g} ms per query, {options["duration"]:g}s each'
+        )
+        self.stdout.write(f'{"server":<6} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>7}')
+        try:
+            for name in options['servers']:
+                with self._server(name, options):
+                    stats = asyncio.run(self._load(token, options))
+                self.stdout.write(
+                    f'{name:<6} {stats["rps"]:>9.1f} {stats["p50"]:>9.1f} {stats["p99"]:>9.1f} {stats["errors"]:>7}'
+                )
+        finally:
+            Locker.objects.filter(location='bench-asgi').delete()
+            user.delete()
+
+    def _server(self, name, options):
+        env = {
+            'DEBUG': 'True',  # plain HTTP: no SSL redirect
+            'SIMULATED_DB_LATENCY_MS': str(options['db_latency_ms']),
+            'ASYNC_READ_VIEWS': 'True' if name == 'asgi' else 'False',
+            'REQUEST_TIMING_SAMPLE_RATE': '0',
+            'REQUEST_TIMING_SLOW_MS': '1e9',
+        }
+        return LocalServer(name, options['port'], options['workers'], env)
+
+    async def _load(self, token, options):
+        parts = urlsplit(options['path'])
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], [0]
+        counter = [0]
+
+        async def client():
+            reader = writer = None
+            while time.monotonic() < deadline:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', options['port'])
+                counter[0] += 1
+                # A unique parameter per request keeps the locker cache out of the measurement.
+                query = f'{parts.query}&_={counter[0]}' if parts.query else f'_={counter[0]}'
+                request = (
+                    f'GET {parts.path}?{query} HTTP/1.1\r\nHost: localhost\r\n'
+                    f'Authorization: Bearer {token}\r\nAccept: application/json\r\n\r\n'
+                )
+                started = time.perf_counter()
+                try:
+                    writer.write(request.encode())
+                    status, headers, _ = await read_response(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    errors[0] += 1
+                    writer.close()
+                    writer = None
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+                if status != 200:
+                    errors[0] += 1
+                if headers.get('connection', '').lower() == 'close':
+                    writer.close()
+                    writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.monotonic()
+        await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        if not latencies:
+            raise CommandError('No responses received')
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'errors': errors[0],
+        }
+
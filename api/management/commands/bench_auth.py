@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from api.authentication import CachedJWTAuthentication, tokens_for
+from api.models import Locker
+from api.views.locker_views import LockerViewSet
+
+MODES = {
+    # What every request did before: one user lookup each.
+    'jwt': {'authentication_classes': [JWTAuthentication], 'claims_actions': ()},
+    'cached user': {'authentication_classes': [CachedJWTAuthentication], 'claims_actions': ()},
+    'claims': {},
+}
+
+
+class Command(BaseCommand):
+    help = 'Count queries per request on the locker list under each JWT authentication mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench_auth')
+        _, access = tokens_for(user)
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'BU{i:04d}', location='bench-auth') for i in range(50)],
+            ignore_conflicts=True,
+        )
+        factory = RequestFactory()
+        try:
+            self.stdout.write(f'{"mode":<12} {"queries/req":>12} {"user queries":>13} {"p50 ms":>8} {"p99 ms":>8}')
+            for name, initkwargs in MODES.items():
+                view = LockerViewSet.as_view({'get': 'list'}, **initkwargs)
+                samples, queries, user_queries = [], 0, 0
+                for _ in range(options['requests']):
+                    request = factory.get('/api/lockers/', HTTP_AUTHORIZATION=f'Bearer {access}', SERVER_NAME='localhost')
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = view(request)
+                        response.render()
+                        samples.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.status_code
+                    queries += len(captured)
+                    user_queries += sum(1 for query in captured if 'auth_user' in query['sql'])
+                samples.sort()
+                self.stdout.write(
+                    f'{name:<12} {queries / len(samples):>12.2f} {user_queries / len(samples):>13.2f} '
+                    f'{statistics.median(samples):>8.2f} {samples[int(len(samples) * 0.99)]:>8.2f}'
+                )
+        finally:
+            Locker.objects.filter(location='bench-auth').delete()
+            user.delete()
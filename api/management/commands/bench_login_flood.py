@@ -0,0 +1,143 @@
+import asyncio
+import random
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.authentication import tokens_for
+from api.loadtest import SERVERS, Context, LocalServer, Results, VirtualUser
+from api.models import Locker
+
+PREFIX = 'floodbench'
+PASSWORD = 'floodbench123'
+# Login protection switched off: no buckets to run dry, a slot per request.
+UNPROTECTED = {
+    'LOGIN_IP_RATE': '1e9', 'LOGIN_IP_BURST': '1000000000',
+    'LOGIN_USERNAME_RATE': '1e9', 'LOGIN_USERNAME_BURST': '1000000000',
+    'PASSWORD_HASH_SLOTS': '10000',
+}
+PHASES = ('quiet', 'flood-one-ip', 'flood-many-ips')
+
+
+async def poll(vu, think):
+    """A signed-in user on the locker page, reloading it every ``think`` seconds."""
+    while vu.running:
+        await vu.call('/api/lockers/', 'GET', '/api/lockers/?page_size=20')
+        await vu.sleep(think)
+
+
+async def flood(vu, rotate_ip):
+    """Credential stuffing: log in back to back, ignoring Retry-After."""
+    while vu.running:
+        if rotate_ip:
+            vu.headers = [f'X-Forwarded-For: 10.{vu.rng.randrange(256)}.{vu.rng.randrange(256)}.{vu.rng.randrange(256)}']
+        await vu.call('/api/auth/login/', 'POST', '/api/auth/login/', {
+            'username': vu.rng.choice(vu.context.usernames), 'password': vu.context.password,
+        })  # refusals (429, 503) count as errors
+
+
+class Command(BaseCommand):
+    help = 'Measure locker-list latency on a live server while logins flood it, with and without login protection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=sorted(SERVERS), default='asgi')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--port', type=int, default=8767)
+        parser.add_argument('--pollers', type=int, default=10)
+        parser.add_argument('--think', type=float, default=0.25, help='Seconds between a poller\'s requests')
+        parser.add_argument('--attackers', type=int, default=16, help='Concurrent login requests in a flood')
+        parser.add_argument('--duration', type=float, default=15, help='Seconds per phase')
+        parser.add_argument('--hash-slots', type=int, default=settings.PASSWORD_HASH_SLOTS)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['NAME'] == ':memory:':
+            raise CommandError('The server needs a database it can share with this process')
+        rng = random.Random(options['seed'])
+        try:
+            context = self._seed(options)
+            base = {
+                'DEBUG': 'True',  # plain HTTP: no SSL redirect
+                'ASYNC_READ_VIEWS': 'True' if options['server'] == 'asgi' else 'False',
+                'REQUEST_TIMING_SLOW_MS': '1e9',
+                'PASSWORD_HASH_LOCK_DIR': tempfile.mkdtemp(prefix='hash-slots-'),
+            }
+            runs = {
+                'unprotected': {**base, **UNPROTECTED},
+                'protected': {**base, 'PASSWORD_HASH_SLOTS': str(options['hash_slots'])},
+            }
+            rows = []
+            for name, env in runs.items():
+                self.stdout.write(f'{name}: {options["server"]} x{options["workers"]}')
+                with LocalServer(options['server'], options['port'], options['workers'], env):
+                    # Let the workers import and connect before anything is timed.
+                    asyncio.run(self._phase('warmup', {**options, 'duration': 2}, context, Results(), rng))
+                    for phase in PHASES:
+                        if phase == 'quiet' and rows:
+                            continue  # the same with or without protection
+                        results = Results()
+                        asyncio.run(self._phase(phase, options, context, results, rng))
+                        rows.append((phase if phase == 'quiet' else f'{phase}, {name}', results.summary()))
+            self._table(rows)
+        finally:
+            User.objects.filter(username__startswith=f'{PREFIX}_').delete()
+            Locker.objects.filter(location=PREFIX).delete()
+
+    def _seed(self, options):
+        User.objects.filter(username__startswith=f'{PREFIX}_').delete()
+        # One hash shared by every user, as in generate_data.
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            [User(username=f'{PREFIX}_{i}', password=password) for i in range(200)]
+        )
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'FB{i:04d}', location=PREFIX) for i in range(100)], ignore_conflicts=True,
+        )
+        return Context(
+            host='127.0.0.1', port=options['port'],
+            user_tokens=[str(tokens_for(user)[1]) for user in users[:options['pollers']]],
+            admin_token='', usernames=[user.username for user in users], password=PASSWORD, locker_ids=[],
+        )
+
+    async def _phase(self, phase, options, context, results, rng):
+        deadline = time.monotonic() + options['duration']
+        work = []
+        for i in range(options['pollers']):
+            vu = VirtualUser(phase, context, results, rng, deadline, context.user_tokens[i % len(context.user_tokens)])
+            work.append((vu, poll(vu, options['think'])))
+        if phase != 'quiet':
+            for _ in range(options['attackers']):
+                vu = VirtualUser(phase, context, results, rng, deadline)
+                work.append((vu, flood(vu, rotate_ip=phase == 'flood-many-ips')))
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(coroutine for _, coroutine in work))
+        finally:
+            for vu, _ in work:
+                vu.http.close()
+        results.elapsed[phase] = time.monotonic() - started
+
+    def _table(self, rows):
+        width = max(len(label) for label, _ in rows)
+        self.stdout.write(
+            f'{"phase":<{width}} {"list req/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}'
+            f' {"logins/s":>9} {"refused/s":>9}'
+        )
+        for label, summary in rows:
+            phase = label.split(',')[0]
+            lockers = summary.get(f'{phase} GET /api/lockers/')
+            login = summary.get(f'{phase} POST /api/auth/login/')
+            if lockers is None:
+                raise CommandError(f'{label}: no locker list responses')
+            line = (
+                f'{label:<{width}} {lockers["rps"]:>10.1f} {lockers["p50_ms"]:>8.1f} {lockers["p95_ms"]:>8.1f} '
+                f'{lockers["p99_ms"]:>8.1f} {lockers["errors"]:>6}'
+            )
+            if login is not None:
+                refused = login['errors'] / login['requests'] * login['rps']
+                line += f' {login["rps"] - refused:>9.1f} {refused:>9.1f}'
+            self.stdout.write(line)
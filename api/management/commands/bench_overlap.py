@@ -0,0 +1,101 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Locker, Reservation
+from api.services.reservations import free_lockers, overlapping
+
+
+class Command(BaseCommand):
+    help = 'Seed historical reservations and time booking overlap checks and availability queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=1_000_000)
+        parser.add_argument('--lockers', type=int, default=1000)
+        parser.add_argument('--locations', type=int, default=10)
+        parser.add_argument('--probes', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user, _ = User.objects.get_or_create(username='bench_overlap')
+        lockers = self._seed_lockers(options['lockers'], options['locations'])
+        self._seed_history(user, lockers, options['reservations'], rng)
+
+        try:
+            now = timezone.now()
+            check_ms = self._time(options['probes'], lambda: overlapping(
+                rng.choice(lockers).pk, now + timedelta(hours=rng.randint(1, 48)),
+                now + timedelta(hours=rng.randint(49, 96)),
+            ).exists())
+            free_ms = self._time(max(options['probes'] // 10, 1), lambda: list(free_lockers(
+                now + timedelta(hours=1), now + timedelta(hours=3),
+                location=f'bench-{rng.randrange(options["locations"])}',
+            ).values_list('id', flat=True)))
+
+            self.stdout.write(f'reservations:          {options["reservations"]}')
+            self.stdout.write(f'overlap check p50/p99: {check_ms[0]:.3f} / {check_ms[1]:.3f} ms')
+            self.stdout.write(f'free lockers  p50/p99: {free_ms[0]:.3f} / {free_ms[1]:.3f} ms')
+            self.stdout.write('overlap plan:')
+            self.stdout.write(overlapping(lockers[0].pk, now, now + timedelta(hours=1)).explain())
+            self.stdout.write('free lockers plan:')
+            self.stdout.write(free_lockers(now, now + timedelta(hours=1), location='bench-0').explain())
+        finally:
+            if not options['keep']:
+                Reservation.objects.filter(user=user).delete()
+                Locker.objects.filter(location__startswith='bench-').delete()
+                user.delete()
+
+    def _seed_lockers(self, count, locations):
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'BO{i:06d}', location=f'bench-{i % locations}') for i in range(count)],
+            ignore_conflicts=True, batch_size=1000,
+        )
+        return list(Locker.objects.filter(location__startswith='bench-'))
+
+    def _seed_history(self, user, lockers, count, rng):
+        # Plain executemany: building a million model instances would take
+        # longer than the queries being measured.
+        existing = Reservation.objects.filter(user=user).count()
+        now = timezone.now()
+        ops = connection.ops
+        table = ops.quote_name(Reservation._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} (user_id, locker_id, start_time, end_time, status, created_at, updated_at) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s)'
+        )
+        locker_ids = [locker.pk for locker in lockers]
+        statuses = ('completed', 'completed', 'completed', 'cancelled')
+        started = time.perf_counter()
+        remaining = count - existing
+        with transaction.atomic(), connection.cursor() as cursor:
+            while remaining > 0:
+                rows = []
+                for _ in range(min(remaining, 50_000)):
+                    start = now - timedelta(minutes=rng.randint(60, 60 * 24 * 365 * 2))
+                    end = start + timedelta(minutes=rng.randint(30, 600))
+                    rows.append((
+                        user.pk, rng.choice(locker_ids),
+                        ops.adapt_datetimefield_value(start), ops.adapt_datetimefield_value(end),
+                        rng.choice(statuses), ops.adapt_datetimefield_value(start),
+                        ops.adapt_datetimefield_value(end),
+                    ))
+                cursor.executemany(sql, rows)
+                remaining -= len(rows)
+        self.stdout.write(f'seeded history in {time.perf_counter() - started:.1f}s')
+
+    def _time(self, runs, probe):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            probe()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import Locker, Reservation
+from api.services.reservations import reserve_locker
+
+
+def legacy_reserve(user, locker_id):
+    """The read / check / save sequence the views used before the engine."""
+    locker = Locker.objects.get(pk=locker_id)
+    if locker.status != 'available':
+        return False
+    locker.status = 'occupied'
+    locker.save()
+    Reservation.objects.create(user=user, locker=locker)
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Hammer one locker from many threads and report throughput and double bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--rounds', type=int, default=50)
+        parser.add_argument('--legacy', action='store_true',
+                            help='Benchmark the old read/check/save path instead of the engine')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        rounds = options['rounds']
+        attempt = self._legacy_attempt if options['legacy'] else self._engine_attempt
+
+        users = [
+            User.objects.get_or_create(username=f'bench_reserve_{i}')[0]
+            for i in range(threads)
+        ]
+        locker, _ = Locker.objects.get_or_create(
+            locker_number='BENCH-RSV', defaults={'location': 'bench'}
+        )
+
+        double_booked = 0
+        errors = 0
+        attempts = 0
+        elapsed = 0.0
+
+        for _ in range(rounds):
+            Reservation.objects.filter(locker=locker).delete()
+            Locker.objects.filter(pk=locker.pk).update(status='available')
+
+            barrier = threading.Barrier(threads)
+            outcomes = []
+            lock = threading.Lock()
+
+            def worker(user):
+                barrier.wait()
+                try:
+                    won = attempt(user, locker.pk)
+                except Exception:
+                    won = None
+                finally:
+                    connection.close()
+                with lock:
+                    outcomes.append(won)
+
+            pool = [threading.Thread(target=worker, args=(u,)) for u in users]
+            started = time.perf_counter()
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            elapsed += time.perf_counter() - started
+
+            attempts += len(outcomes)
+            errors += outcomes.count(None)
+            active = Reservation.objects.filter(locker=locker, status='active').count()
+            if active > 1:
+                double_booked += 1
+
+        Reservation.objects.filter(locker=locker).delete()
+        locker.delete()
+        User.objects.filter(username__startswith='bench_reserve_').delete()
+
+        mode = 'legacy' if options['legacy'] else 'engine'
+        self.stdout.write(f'mode:              {mode}')
+        self.stdout.write(f'threads x rounds:  {threads} x {rounds}')
+        self.stdout.write(f'attempts/sec:      {attempts / elapsed:.1f}' if elapsed else 'attempts/sec: n/a')
+        self.stdout.write(f'errors:            {errors}')
+        self.stdout.write(f'double-booked:     {double_booked} of {rounds} rounds')
+
+    def _engine_attempt(self, user, locker_id):
+        return reserve_locker(user, locker_id).ok
+
+    def _legacy_attempt(self, user, locker_id):
+        return legacy_reserve(user, locker_id)
@@ -0,0 +1,111 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import RevokedToken
+from api.services.revocation import Revocations
+
+JTI_PREFIX = 'bench'
+
+
+class Command(BaseCommand):
+    help = 'Seed revoked tokens and time the per-request revocation check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked', type=int, default=1_000_000)
+        parser.add_argument('--probes', type=int, default=200_000)
+        parser.add_argument('--days', type=int, default=7, help='Spread of the revoked tokens\' expiry')
+        parser.add_argument('--seed', type=int, default=3)
+
+    # No periodic syncs during the timing loops: the seeded rows all count as
+    # just revoked and would be read again.
+    @override_settings(TOKEN_REVOCATION_SYNC_SECONDS=10 ** 9)
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        try:
+            empty = Revocations()
+            empty.sync(force=True)
+            jtis = self._seed(options['revoked'], options['days'], now, rng)
+            loaded = Revocations()
+            started = time.perf_counter()
+            count = loaded.sync(force=True)
+            self.stdout.write(
+                f'loaded {count:,} revocations in {time.perf_counter() - started:.1f}s; '
+                f'Bloom filters {loaded.memory() / 2 ** 20:.1f} MiB'
+            )
+
+            # Tokens as clients present them: expiring within the next day.
+            exp = int((now + timedelta(hours=12)).timestamp())
+            probes = [f'{rng.getrandbits(128):032x}' for _ in range(options['probes'])]
+            revoked = [(jti, int(expires.timestamp())) for jti, expires in rng.sample(jtis, min(1000, len(jtis)))]
+
+            base = self._time(empty, [(jti, exp) for jti in probes])
+            clean = self._time(loaded, [(jti, exp) for jti in probes])
+            with connection.execute_wrapper(_counting):
+                _counting.queries = 0
+                for jti in probes:
+                    loaded.is_revoked(jti, exp)
+                false_positives = _counting.queries
+            for jti, expires in revoked:
+                assert loaded.is_revoked(jti, expires)
+            hit = self._time(loaded, revoked * (len(probes) // len(revoked)))
+
+            decode = AccessToken()
+            raw = str(decode)
+            started = time.perf_counter()
+            for _ in range(10_000):
+                AccessToken(raw)
+            decode_us = (time.perf_counter() - started) / 10_000 * 1e6
+
+            self.stdout.write(f'{"check":<28} {"us/check":>9}')
+            self.stdout.write(f'{"no revocations":<28} {base:>9.2f}')
+            self.stdout.write(f'{f"{count:,} revoked, not revoked":<28} {clean:>9.2f}')
+            self.stdout.write(f'{f"{count:,} revoked, revoked":<28} {hit:>9.2f}')
+            self.stdout.write(
+                f'false positives: {false_positives} of {len(probes):,} '
+                f'({false_positives / len(probes):.4%}), one query each, then remembered'
+            )
+            self.stdout.write(f'for scale, decoding and verifying the access token: {decode_us:.1f} us')
+        finally:
+            RevokedToken.objects.filter(jti__startswith=JTI_PREFIX).delete()
+
+    def _seed(self, count, days, now, rng):
+        RevokedToken.objects.filter(jti__startswith=JTI_PREFIX).delete()
+        seeded = []
+        ops = connection.ops
+        table = ops.quote_name(RevokedToken._meta.db_table)
+        sql = f'INSERT INTO {table} (jti, expires_at, revoked_at) VALUES (%s, %s, %s)'
+        revoked_at = ops.adapt_datetimefield_value(now)
+        rows = []
+        started = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            for _ in range(count):
+                expires = now + timedelta(seconds=rng.randint(60, days * 86400))
+                jti = f'{JTI_PREFIX}{rng.getrandbits(128):032x}'
+                seeded.append((jti, expires))
+                rows.append((jti, ops.adapt_datetimefield_value(expires), revoked_at))
+                if len(rows) == 50_000:
+                    cursor.executemany(sql, rows)
+                    rows = []
+            if rows:
+                cursor.executemany(sql, rows)
+        self.stdout.write(f'seeded {len(seeded):,} revoked tokens in {time.perf_counter() - started:.1f}s')
+        return seeded
+
+    def _time(self, revocations, checks):
+        started = time.perf_counter()
+        for jti, exp in checks:
+            revocations.is_revoked(jti, exp)
+        return (time.perf_counter() - started) / len(checks) * 1e6
+
+
+def _counting(execute, sql, params, many, context):
+    _counting.queries += 1
+    return execute(sql, params, many, context)
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Locker
+from api.renderers import FastJSONRenderer
+from api.serializers import LockerRowSerializer, LockerSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare LockerSerializer with the values_list fast path and JSONRenderer with FastJSONRenderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs per measurement')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded lockers in place')
+
+    def handle(self, *args, **options):
+        largest = max(options['sizes'])
+        Locker.objects.bulk_create(
+            [Locker(locker_number=f'BS{i:07d}', location=f'bench-{i % 10}') for i in range(largest)],
+            ignore_conflicts=True, batch_size=2000,
+        )
+        base = Locker.objects.filter(locker_number__startswith='BS').order_by('locker_number')
+
+        try:
+            self.stdout.write(f'{"rows":>8} {"serializer":>14} {"fast path":>14} {"x":>6} '
+                              f'{"JSONRenderer":>14} {"FastJSON":>14} {"x":>6}   (rows/sec)')
+            for size in options['sizes']:
+                queryset = base[:size]
+                rows = LockerRowSerializer()
+                drf_s, drf_data = self._best(options['repeat'], lambda: LockerSerializer(list(queryset), many=True).data)
+                fast_s, fast_data = self._best(
+                    options['repeat'], lambda: rows.to_representation(rows.queryset(queryset))
+                )
+                if [dict(item) for item in drf_data] != fast_data:
+                    raise CommandError(f'fast path output differs from LockerSerializer at {size} rows')
+
+                json_s, json_bytes = self._best(options['repeat'], lambda: JSONRenderer().render(fast_data))
+                orjson_s, orjson_bytes = self._best(options['repeat'], lambda: FastJSONRenderer().render(fast_data))
+                if json_bytes != orjson_bytes:
+                    raise CommandError(f'FastJSONRenderer output differs from JSONRenderer at {size} rows')
+
+                self.stdout.write(
+                    f'{size:>8} {size / drf_s:>14,.0f} {size / fast_s:>14,.0f} {drf_s / fast_s:>5.1f}x '
+                    f'{size / json_s:>14,.0f} {size / orjson_s:>14,.0f} {json_s / orjson_s:>5.1f}x'
+                )
+        finally:
+            if not options['keep']:
+                base.delete()
+
+    def _best(self, runs, work):
+        best, result = None, None
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = work()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
@@ -0,0 +1,115 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.models import Locker
+from api.services.reservations import release_reservation, reserve_locker
+
+
+class Command(BaseCommand):
+    help = 'Measure reserve/release throughput against 1, 2, 4... SQLite shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per shard count')
+        parser.add_argument('--db-latency-ms', type=float, default=2,
+                            help='Delay added to every query, as a network round trip would')
+        parser.add_argument('--run', action='store_true',
+                            help='Internal: migrate, seed and load the databases this process was started with')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(self._run(options)))
+            return
+        self.stdout.write(
+            f'{options["threads"]} threads, {options["db_latency_ms"]:g} ms per query, {options["duration"]:g}s each'
+        )
+        self.stdout.write(f'{"shards":>6} {"cycles/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"errors":>7}')
+        for count in options['shards']:
+            stats = self._measure(count, options)
+            self.stdout.write(
+                f'{count:>6} {stats["rate"]:>9.1f} {stats["p50"]:>9.1f} {stats["p95"]:>9.1f} {stats["errors"]:>7}'
+            )
+
+    def _measure(self, count, options):
+        """Run the load in a fresh process: the shards are read from its settings."""
+        with tempfile.TemporaryDirectory() as directory:
+            shards = [f'sqlite:///{directory}/shard_{n}.sqlite3' for n in range(1, count + 1)]
+            env = {
+                **os.environ,
+                'DATABASE_URL': f'sqlite:///{directory}/primary.sqlite3',
+                'DATABASE_SHARD_URLS': ','.join(shards),
+                'SHARD_LOCATIONS': json.dumps({f'bench-shard-{n}': f'shard_{n}' for n in range(1, count + 1)}),
+                'SIMULATED_DB_LATENCY_MS': str(options['db_latency_ms']),
+            }
+            command = [
+                sys.executable, sys.argv[0], 'bench_shards', '--run',
+                '--threads', str(options['threads']), '--duration', str(options['duration']),
+            ]
+            process = subprocess.run(command, env=env, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f'The {count}-shard run failed:\n{process.stderr}')
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def _run(self, options):
+        shards = settings.DATABASE_SHARDS
+        for alias in ['default', *shards]:
+            call_command('migrate', database=alias, verbosity=0)
+        threads = options['threads']
+        users = User.objects.bulk_create([User(username=f'bench_shards_{i}') for i in range(threads)])
+        # One locker per thread, dealt round the shards, so threads only
+        # contend for a shard's write lock, never for a locker.
+        lockers = [
+            Locker.objects.create(locker_number=f'BS{i:04d}', location=f'bench-shard-{i % len(shards) + 1}')
+            for i in range(threads)
+        ]
+
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def worker(user, locker):
+            mine = []
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    result = reserve_locker(user, locker.pk)
+                    if result.ok and release_reservation(result.reservation):
+                        mine.append((time.perf_counter() - started) * 1000)
+                    else:
+                        with lock:
+                            errors[0] += 1
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(mine)
+
+        pool = [threading.Thread(target=worker, args=pair) for pair in zip(users, lockers)]
+        started = time.monotonic()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.monotonic() - started
+
+        if not latencies:
+            raise CommandError('No reservation completed')
+        latencies.sort()
+        return {
+            'rate': len(latencies) / elapsed,
+            'p50': statistics.median(latencies),
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'errors': errors[0],
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from api.models import Locker
+from api.services.broker import broker
+from api.services.versioning import LOCKERS, get_version
+
+
+class Command(BaseCommand):
+    help = 'Hold many idle stream subscribers on one event loop and measure delivery latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--events', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=0.05,
+                            help='Seconds between locker writes')
+
+    def handle(self, *args, **options):
+        locker, _ = Locker.objects.get_or_create(
+            locker_number='BENCH-STREAM', defaults={'location': 'bench'}
+        )
+        try:
+            asyncio.run(self._run(locker.pk, options))
+        finally:
+            locker.delete()
+
+    async def _run(self, locker_id, options):
+        connections = options['connections']
+        await broker.start()
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        written = {}
+        received = []
+        done = asyncio.Event()
+
+        async def subscriber(version):
+            while not done.is_set():
+                changes, current, _ = await broker.wait(version, 5)
+                if current > version:
+                    received.append((current, time.perf_counter()))
+                version = current
+
+        tasks = [asyncio.create_task(subscriber(broker.version)) for _ in range(connections)]
+        await asyncio.sleep(0.1)
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        def write(i):
+            status = 'occupied' if i % 2 else 'available'
+            Locker.objects.filter(pk=locker_id).update(status=status)
+            return get_version(LOCKERS)[0]
+
+        for i in range(options['events']):
+            started = time.perf_counter()
+            version = await sync_to_async(write)(i)
+            written[version] = started
+            await asyncio.sleep(options['interval'])
+
+        await asyncio.sleep(broker.poll_interval)
+        done.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        latencies = sorted(
+            (at - written[version]) * 1000
+            for version, at in received if version in written
+        )
+        expected = connections * len(written)
+        self.stdout.write(f'connections held:    {connections}')
+        self.stdout.write(f'memory per conn:     {held / connections / 1024:.2f} KiB')
+        self.stdout.write(f'deliveries:          {len(latencies)} / {expected}')
+        if latencies:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f'latency p50:         {statistics.median(latencies):.1f} ms')
+            self.stdout.write(f'latency p99:         {p99:.1f} ms')
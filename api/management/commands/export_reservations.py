@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from api.services.export import CHUNK_SIZE, FORMATS, STATUSES, export_queryset, iter_export, parse_filters
+
+
+class Command(BaseCommand):
+    help = 'Stream reservation history to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--from', dest='from', help='Earliest start_time (ISO date or datetime, inclusive)')
+        parser.add_argument('--to', help='Latest start_time (ISO date inclusive, or datetime exclusive)')
+        parser.add_argument('--status', help=f'Comma-separated statuses ({", ".join(STATUSES)})')
+        parser.add_argument('--output', '-o', default='-', help='File to write; - for stdout')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched per round trip')
+        parser.add_argument('--database', help='Default: every shard, or the primary without sharding')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        try:
+            filters = parse_filters(options)
+        except ValidationError as e:
+            raise CommandError('; '.join(f'--{name}: {message}' for name, message in e.detail.items()))
+
+        queryset = export_queryset(**filters, using=options['database'])
+        out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            written = 0
+            for chunk in iter_export(queryset, options['export_format'], options['chunk_size']):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if options['output'] != '-':
+            self.stdout.write(f'Wrote {written:,} bytes to {options["output"]}')
@@ -0,0 +1,293 @@
+import bisect
+import csv
+import io
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from api.models import ArchivedReservation, Locker, Reservation
+from api.services.stats import reconcile
+from api.utils import parse_window_time
+
+BATCH_SIZE = 50_000
+DAY = 86400
+COLUMNS = ['user_id', 'locker_id', 'start_time', 'end_time', 'total_price', 'status', 'created_at', 'updated_at']
+# Relative weight of a reservation starting in each hour of the day (UTC).
+HOURLY_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 12, 12, 10, 10, 12, 12, 10, 10, 11, 13, 12, 9, 7, 5, 3, 2]
+PRICES = [Decimal('1.50'), Decimal('2.00'), Decimal('2.50'), Decimal('3.00'), Decimal('4.00')]
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic dataset of users, lockers and reservation history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--lockers', type=int, default=2_000)
+        parser.add_argument('--locations', type=int, default=20)
+        parser.add_argument('--reservations', type=int, default=1_000_000,
+                            help='Target count; starts that collide on one locker are dropped')
+        parser.add_argument('--days', type=int, default=365, help='Length of the reservation history')
+        parser.add_argument('--occupancy', type=float, default=0.3,
+                            help='Fraction of lockers with an active reservation right now')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--anchor', help='ISO datetime treated as "now" (default: the current time); '
+                                             'the same seed and anchor give the same rows')
+        parser.add_argument('--prefix', default='synth', help='Username and locker number prefix')
+        parser.add_argument('--password', default='synthetic123',
+                            help='Password shared by every generated user')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete a previous dataset with the same prefix first')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['lockers'], options['locations']) < 1 or options['reservations'] < 0:
+            raise CommandError('--users, --lockers and --locations must be positive')
+        if not 0 <= options['occupancy'] <= 1:
+            raise CommandError('--occupancy must be between 0 and 1')
+        try:
+            now = parse_window_time(options['anchor']) or timezone.now()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.using = options['database']
+        self.prefix = options['prefix']
+        rng = random.Random(options['seed'])
+
+        if options['clear']:
+            self._clear()
+        elif User.objects.using(self.using).filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'A "{self.prefix}" dataset already exists; pass --clear to replace it')
+
+        started = time.perf_counter()
+        user_ids = self._users(options['users'], options['password'])
+        self._report('users', len(user_ids), started)
+
+        step = time.perf_counter()
+        lockers = self._lockers(options['lockers'], options['locations'], options['occupancy'], rng)
+        self._report('lockers', len(lockers), step)
+
+        step = time.perf_counter()
+        rows = self._reservations(
+            user_ids, lockers, options['reservations'], timedelta(days=options['days']), now, rng,
+        )
+        written = self._write(rows, options['batch_size'], options['reservations'])
+        self._report('reservations', written, step)
+
+        # The locker writes above keep the (location, status) counters in
+        # step; check them against the table so a dataset never starts drifted.
+        drift = reconcile(using=self.using)
+        if drift:
+            self.stdout.write(f'repaired {len(drift)} locker counter(s)')
+        self.stdout.write(f'done in {time.perf_counter() - started:.1f}s')
+
+    def _report(self, what, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{what:<13} {count:>10,} in {elapsed:6.1f}s ({count / max(elapsed, 1e-9):>10,.0f}/s)')
+
+    def _clear(self):
+        users = User.objects.using(self.using).filter(username__startswith=f'{self.prefix}_')
+        lockers = Locker.objects.using(self.using).filter(locker_number__startswith=self._locker_prefix())
+        for model in (Reservation, ArchivedReservation):
+            model.objects.using(self.using).filter(user__in=users).delete()
+        lockers.delete()
+        users.delete()
+
+    def _locker_prefix(self):
+        return self.prefix.upper()[:8]
+
+    def _users(self, count, password):
+        # Hashing once and sharing the result keeps the run to a single
+        # (deliberately slow) password hash; every user can still log in.
+        hashed = make_password(password)
+        width = len(str(count))
+        User.objects.using(self.using).bulk_create(
+            [
+                User(username=f'{self.prefix}_{i:0{width}d}', email=f'{self.prefix}_{i}@example.com',
+                     password=hashed, first_name='Synthetic', last_name=f'User {i}')
+                for i in range(count)
+            ],
+            batch_size=5000,
+        )
+        return list(
+            User.objects.using(self.using).filter(username__startswith=f'{self.prefix}_')
+            .order_by('username').values_list('pk', flat=True)
+        )
+
+    def _lockers(self, count, locations, occupancy, rng):
+        prefix = self._locker_prefix()
+        width = len(str(count))
+        occupied = set(rng.sample(range(count), round(count * occupancy)))
+        lockers = []
+        for i in range(count):
+            if i in occupied:
+                status = 'occupied'
+            else:
+                status = 'maintenance' if rng.random() < 0.02 else 'available'
+            lockers.append(Locker(
+                locker_number=f'{prefix}{i:0{width}d}', location=f'{self.prefix}-location-{i % locations:02d}',
+                price_per_hour=rng.choice(PRICES), status=status,
+            ))
+        Locker.objects.using(self.using).bulk_create(lockers, batch_size=5000)
+        return list(
+            Locker.objects.using(self.using).filter(locker_number__startswith=prefix)
+            .order_by('locker_number').values_list('pk', 'price_per_hour', 'status')
+        )
+
+    def _reservations(self, user_ids, lockers, count, span, now, rng):
+        """Yield reservation rows, locker by locker, in ``COLUMNS`` order.
+
+        Each locker's history is a non-overlapping sequence of past
+        reservations (start hour weighted towards the day, log-normal
+        durations, busier users more likely), followed by an active
+        reservation if the locker is occupied and sometimes a future booking.
+        Times are whole epoch seconds and prices strings; ``_write`` turns
+        them into column values.
+        """
+        # Zipf-like popularity: a few users make most reservations.
+        cum_users = list(_cumulative(1 / (rank + 1) ** 0.8 for rank in range(len(user_ids))))
+        cum_hours = list(_cumulative(HOURLY_WEIGHTS))
+        user_total, hour_total = cum_users[-1], cum_hours[-1]
+        random, gauss, bisect_right = rng.random, rng.gauss, bisect.bisect_right
+        duration_mu = math.log(2 * 3600)  # median two hours
+
+        now = int(now.timestamp())
+        days = max(span.days, 1)
+        # Midnight at the start of the history window.
+        begin = (now - days * DAY) // DAY * DAY
+
+        live = sum(1 for _, _, status in lockers if status == 'occupied')
+        per_locker, extra = divmod(max(count - live, 0), len(lockers))
+
+        for index, (locker_id, price, status) in enumerate(lockers):
+            cents = int(price * 100)
+            starts = sorted(
+                begin + int(random() * days) * DAY
+                + bisect_right(cum_hours, random() * hour_total) * 3600 + int(random() * 3600)
+                for _ in range(per_locker + (index < extra))
+            )
+            # History stops where the current reservation (if any) begins.
+            live_start = now - rng.randint(5, 240) * 60 if status == 'occupied' else now
+            starts.append(live_start)
+            for start, following in zip(starts, starts[1:]):
+                end = min(start + min(int(math.exp(gauss(duration_mu, 0.8))), DAY), following - 60)
+                if end <= start or end > live_start:
+                    continue
+                user = user_ids[bisect_right(cum_users, random() * user_total)]
+                booked = random() < 0.3
+                created = start - int(3600 + random() * 71 * 3600) if booked else start
+                if booked and random() < 0.15:
+                    yield (user, locker_id, start, end, None, 'cancelled', created)
+                else:
+                    billed = (cents * (end - start) + 1800) // 3600
+                    yield (user, locker_id, start, end, f'{billed // 100}.{billed % 100:02d}', 'completed', created)
+
+            user = user_ids[bisect_right(cum_users, random() * user_total)]
+            if status == 'occupied':
+                end = None if random() < 0.2 else now + rng.randint(30, 480) * 60
+                yield (user, locker_id, live_start, end, None, 'active', live_start)
+            elif status == 'available' and random() < 0.1:
+                start = now + rng.randint(1, 72) * 3600
+                yield (user, locker_id, start, start + rng.randint(1, 8) * 3600, None, 'scheduled', now)
+
+    def _write(self, rows, batch_size, expected):
+        connection = connections[self.using]
+        write = self._copy if connection.vendor == 'postgresql' else self._insert
+        timestamp = _timestamp_text(connection)
+        written = 0
+        with transaction.atomic(using=self.using), connection.cursor() as cursor:
+            with self._bulk_load(connection, cursor, expected):
+                batch = []
+                for user, locker, start, end, price, status, created in rows:
+                    # Completed rows last changed when they were released.
+                    updated = end if status == 'completed' else created
+                    batch.append((
+                        user, locker, timestamp(start), None if end is None else timestamp(end),
+                        price, status, timestamp(created), timestamp(updated),
+                    ))
+                    if len(batch) == batch_size:
+                        written += write(cursor, batch)
+                        batch = []
+                if batch:
+                    written += write(cursor, batch)
+        return written
+
+    @contextmanager
+    def _bulk_load(self, connection, cursor, expected):
+        """On SQLite, drop the secondary reservation indexes for the load and rebuild them after.
+
+        One sort per index at the end is much cheaper than a million random
+        b-tree inserts into each. Skipped when the table already holds more
+        rows than are being added, where the rebuild would cost more.
+        """
+        table = Reservation._meta.db_table
+        existing = Reservation.objects.using(self.using).count()
+        if connection.vendor != 'sqlite' or existing > expected:
+            yield
+            return
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            [table],
+        )
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        yield
+        for _, sql in indexes:
+            cursor.execute(sql)
+
+    def _insert(self, cursor, batch):
+        ops = connections[self.using].ops
+        table = ops.quote_name(Reservation._meta.db_table)
+        cursor.executemany(
+            f'INSERT INTO {table} ({", ".join(ops.quote_name(c) for c in COLUMNS)}) '
+            f'VALUES ({", ".join(["%s"] * len(COLUMNS))})',
+            batch,
+        )
+        return len(batch)
+
+    def _copy(self, cursor, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = connections[self.using].ops.quote_name(Reservation._meta.db_table)
+        cursor.copy_expert(f'COPY {table} ({", ".join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)', buffer)
+        return len(batch)
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def _timestamp_text(connection):
+    """A function formatting epoch seconds as the backend's datetime column text.
+
+    Built from cached day and time-of-day strings: going through datetime
+    objects and ``adapt_datetimefield_value`` costs more than the inserts.
+    """
+    if connection.vendor != 'postgresql' and connection.timezone_name != 'UTC':
+        adapt = connection.ops.adapt_datetimefield_value
+        return lambda seconds: adapt(datetime.fromtimestamp(seconds, dt_timezone.utc))
+
+    suffix = '+00' if connection.vendor == 'postgresql' else ''
+    times = [f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}{suffix}' for s in range(DAY)]
+    days = {}
+
+    def text(seconds):
+        day, second = divmod(seconds, DAY)
+        date = days.get(day)
+        if date is None:
+            date = days[day] = datetime.fromtimestamp(day * DAY, dt_timezone.utc).strftime('%Y-%m-%d ')
+        return date + times[second]
+    return text
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.user_import import BATCH_SIZE, FORMATS, import_users, read_rows
+
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = 'Create users from a CSV or NDJSON file (username, email, password, first_name, last_name)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='import_format', choices=sorted(FORMATS),
+                            help='Defaults to the file extension')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes hashing passwords')
+        parser.add_argument('--iterations', type=int, default=settings.USER_IMPORT_ITERATIONS,
+                            help='PBKDF2 iterations for the imported hashes; each is brought up to '
+                                 'PASSWORD_HASH_ITERATIONS at the user\'s first login')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Users per INSERT transaction')
+        parser.add_argument('--report', metavar='PATH', help='Write every row\'s result as NDJSON')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        fmt = options['import_format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f'Cannot tell the format of {options["path"]}; pass --format')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                results = import_users(
+                    read_rows(f, fmt), workers=options['workers'], iterations=options['iterations'],
+                    batch_size=options['batch_size'], using=options['database'],
+                )
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        errors = [result for result in results if result['status'] == 'error']
+        for result in errors[:SHOWN_ERRORS]:
+            self.stderr.write(f'line {result["line"]}: {json.dumps(result["errors"])}')
+        if len(errors) > SHOWN_ERRORS:
+            self.stderr.write(f'... and {len(errors) - SHOWN_ERRORS} more')
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                for result in results:
+                    f.write(json.dumps(result) + '\n')
+        self.stdout.write(
+            f'created={len(results) - len(errors)} failed={len(errors)} in {elapsed:.1f}s'
+        )
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import random
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.authentication import tokens_for
+from api.loadtest import PHASES, SERVERS, Context, LocalServer, Results, compare, run_phase
+from api.models import Locker
+
+PREFIX = 'loadtest'
+PASSWORD = 'loadtest123'
+# Not ``loadtest_``: generate_data treats that prefix as its own users.
+ADMIN_USERNAME = 'loadtest-admin'
+
+
+class Command(BaseCommand):
+    help = 'Replay frontend traffic (polling, reserve bursts, admin bulk edits, logins) against a server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=PHASES, default=PHASES,
+                            help='Phases to run, one after the other')
+        parser.add_argument('--vus', type=int, default=50, help='Virtual users per phase')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds per phase')
+        parser.add_argument('--poll-interval', type=float, default=10)
+        parser.add_argument('--server', choices=sorted(SERVERS), default='asgi',
+                            help='Start this gunicorn server for the run')
+        parser.add_argument('--url', help='Load an already running server instead (e.g. http://127.0.0.1:8000); '
+                                          'it must share this database')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--users', type=int, default=2_000, help='Dataset size, when it is generated')
+        parser.add_argument('--lockers', type=int, default=500)
+        parser.add_argument('--reservations', type=int, default=50_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the summary as JSON')
+        parser.add_argument('--compare', metavar='PATH', help='Compare with a saved baseline; fails on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 growth / throughput drop as a fraction')
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['NAME'] == ':memory:':
+            raise CommandError('The server needs a database it can share with this process')
+        baseline = self._load_baseline(options['compare']) if options['compare'] else None
+        context = self._context(options)
+        rng = random.Random(options['seed'])
+        results = Results()
+
+        if options['url']:
+            self._run(options, context, results, rng)
+        else:
+            env = {
+                'DEBUG': 'True',  # plain HTTP: no SSL redirect
+                'ASYNC_READ_VIEWS': 'True' if options['server'] == 'asgi' else 'False',
+                # Every response reports its query count in Server-Timing.
+                'REQUEST_TIMING_SAMPLE_RATE': '1',
+                'REQUEST_TIMING_SLOW_MS': '1e9',
+                'REQUEST_TIMING_DUPLICATE_THRESHOLD': '1000000',
+            }
+            with LocalServer(options['server'], options['port'], options['workers'], env):
+                self._run(options, context, results, rng)
+
+        summary = results.summary()
+        if not summary:
+            raise CommandError('No responses received')
+        self._table(summary)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'options': self._run_options(options), 'results': summary}, f, indent=2, sort_keys=True)
+            self.stdout.write(f'baseline written to {options["save_baseline"]}')
+        if baseline is not None:
+            self._compare(summary, baseline, options)
+
+    def _load_baseline(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read baseline {path}: {e}')
+
+    def _run_options(self, options):
+        return {key: options[key] for key in ('server', 'url', 'workers', 'vus', 'duration', 'poll_interval')}
+
+    def _context(self, options):
+        if not User.objects.filter(username__startswith=f'{PREFIX}_').exists():
+            call_command(
+                'generate_data', prefix=PREFIX, password=PASSWORD, users=options['users'],
+                lockers=options['lockers'], locations=5, reservations=options['reservations'],
+                days=90, seed=options['seed'], stdout=self.stdout,
+            )
+        admin, created = User.objects.get_or_create(username=ADMIN_USERNAME, defaults={'is_staff': True})
+        if not created and not admin.is_staff:
+            admin.is_staff = True
+            admin.save(update_fields=['is_staff'])
+
+        users = list(User.objects.filter(username__startswith=f'{PREFIX}_').order_by('pk')[:200])
+        if options['url']:
+            parts = urlsplit(options['url'])
+            host, port = parts.hostname, parts.port or 80
+        else:
+            host, port = '127.0.0.1', options['port']
+        return Context(
+            host=host, port=port,
+            user_tokens=[str(tokens_for(user)[1]) for user in users],
+            admin_token=str(tokens_for(admin)[1]),
+            usernames=[user.username for user in users],
+            password=PASSWORD,
+            locker_ids=list(
+                Locker.objects.filter(locker_number__startswith=PREFIX.upper()).values_list('pk', flat=True)
+            ),
+            poll_interval=options['poll_interval'],
+        )
+
+    def _run(self, options, context, results, rng):
+        target = options['url'] or f'{options["server"]} x{options["workers"]}'
+        for phase in options['scenarios']:
+            self.stdout.write(f'{phase}: {options["vus"]} users for {options["duration"]:g}s against {target}')
+            asyncio.run(run_phase(phase, options['vus'], options['duration'], context, results, rng))
+
+    def _table(self, summary):
+        width = max(len(key) for key in summary)
+        self.stdout.write(
+            f'{"endpoint":<{width}} {"requests":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"p99 ms":>8} {"errors":>6} {"queries":>7}'
+        )
+        for key, row in summary.items():
+            queries = '-' if row['queries'] is None else f'{row["queries"]:.1f}'
+            self.stdout.write(
+                f'{key:<{width}} {row["requests"]:>8} {row["rps"]:>8.1f} {row["p50_ms"]:>8.1f} '
+                f'{row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {row["errors"]:>6} {queries:>7}'
+            )
+
+    def _compare(self, summary, baseline, options):
+        if baseline.get('options') != self._run_options(options):
+            self.stderr.write(f'baseline was recorded with {baseline.get("options")}; results may not be comparable')
+        rows, regressions = compare(summary, baseline.get('results', {}), options['tolerance'])
+        width = max(len(key) for key, *_ in rows)
+        self.stdout.write(f'{"endpoint":<{width}} {"p95 ms":>17} {"req/s":>17} {"queries":>11}  flags')
+        for key, now, before, flags in rows:
+            if before is None:
+                self.stdout.write(f'{key:<{width}} {"":>17} {"":>17} {"":>11}  new')
+                continue
+            queries = f'{_fmt(before["queries"])}->{_fmt(now["queries"])}'
+            self.stdout.write(
+                f'{key:<{width}} {before["p95_ms"]:>7.1f} ->{now["p95_ms"]:>7.1f} '
+                f'{before["rps"]:>7.1f} ->{now["rps"]:>7.1f} {queries:>11}  {",".join(flags)}'
+            )
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} regression(s): '
+                + '; '.join(f'{key} ({", ".join(flags)})' for key, flags in regressions)
+            )
+        self.stdout.write('no regressions')
+
+
+def _fmt(queries):
+    return '-' if queries is None else f'{queries:g}'
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.services.revocation import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete revocation records for tokens that have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'deleted={prune_expired(using=options["database"])}')
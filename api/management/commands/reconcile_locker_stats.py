@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.stats import reconcile
+from myapp.sharding import shard_databases
+
+
+class Command(BaseCommand):
+    help = 'Check the (location, status) locker counters against a full aggregate and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift; exit with an error if any is found')
+        parser.add_argument('--database', help='Default: every shard, or the primary without sharding')
+
+    def handle(self, *args, **options):
+        databases = [options['database']] if options['database'] else shard_databases()
+        drift = []
+        for using in databases:
+            # Each shard counts the lockers of its own locations.
+            found = reconcile(repair=not options['check'], using=using)
+            for location, status, counted, actual in found:
+                self.stdout.write(f'{location} / {status}: counter={counted} actual={actual}')
+            drift += found
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Locker counters match the lockers table'))
+        elif options['check']:
+            raise CommandError(f'{len(drift)} counter(s) drifted')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drift)} counter(s)'))
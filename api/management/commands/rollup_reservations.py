@@ -0,0 +1,56 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from myapp.sharding import gather, shard_databases
+
+from api.services.rollups import BATCH_SIZE, MAX_BATCHES, rebuild, roll_up
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Fold new and changed reservations into the hourly and daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Changed reservations per transaction')
+        parser.add_argument('--max-batches', type=int, default=MAX_BATCHES,
+                            help='Batches per pass')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Seconds between passes; 0 runs a single pass')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Empty the rollups first and recount every reservation')
+        parser.add_argument('--database', help='Default: every shard, or the primary without sharding')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['max_batches'] < 1:
+            raise CommandError('--batch-size and --max-batches must be positive')
+
+        databases = [options['database']] if options['database'] else shard_databases()
+        if options['rebuild']:
+            for using in databases:
+                rebuild(using=using)
+        while True:
+            close_old_connections()
+            passes = gather(lambda using: roll_up(
+                batch_size=options['batch_size'], max_batches=options['max_batches'], using=using,
+            ), databases)
+            for using, metrics in zip(databases, passes):
+                line = ' '.join(f'{key}={value}' for key, value in metrics.items())
+                if len(databases) > 1:
+                    line = f'database={using} {line}'
+                logger.info(f'Reservation rollup: {line}')
+                self.stdout.write(line)
+
+            backlog = any(metrics['backlog'] for metrics in passes)
+            if not options['interval'] and not (options['rebuild'] and backlog):
+                return
+            # A pass that hit its batch limit goes again straight away.
+            if not backlog:
+                try:
+                    time.sleep(options['interval'])
+                except KeyboardInterrupt:
+                    return
@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy a SQLite primary over its SQLite replicas, once or every --interval seconds (local replica setups)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep copying; this is then the replication lag')
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        replicas = [connections[alias].settings_dict for alias in settings.DATABASE_REPLICAS]
+        if not replicas:
+            raise CommandError('No replicas configured (DATABASE_REPLICA_URLS)')
+        if any(db['ENGINE'] != 'django.db.backends.sqlite3' for db in [primary, *replicas]):
+            raise CommandError('Only SQLite primaries and replicas can be copied; use the database\'s own replication')
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(primary['NAME'], timeout=20)
+            try:
+                for replica in replicas:
+                    target = sqlite3.connect(replica['NAME'], timeout=20)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write(
+                f'copied {primary["NAME"]} to {len(replicas)} replica(s) in {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
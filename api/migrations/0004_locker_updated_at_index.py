@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_change_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locker',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counts(apps, schema_editor):
+    Locker = apps.get_model('api', 'Locker')
+    LockerStatusCount = apps.get_model('api', 'LockerStatusCount')
+    db = schema_editor.connection.alias
+    rows = (
+        Locker.objects.using(db).order_by()
+        .values_list('location', 'status').annotate(n=Count('id'))
+    )
+    LockerStatusCount.objects.using(db).bulk_create(
+        LockerStatusCount(location=location, status=status, count=n)
+        for location, status, n in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_locker_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LockerStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('available', 'Available'), ('occupied', 'Occupied'), ('maintenance', 'Maintenance')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'locker_status_counts',
+                'unique_together': {('location', 'status')},
+            },
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_reservation_sweep_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='locker',
+            index=models.Index(fields=['status', 'locker_number'], name='locker_status_number'),
+        ),
+        migrations.AddIndex(
+            model_name='locker',
+            index=models.Index(fields=['location', 'status'], name='locker_location_status'),
+        ),
+        migrations.AddIndex(
+            model_name='locker',
+            index=models.Index(condition=models.Q(('status', 'available')), fields=['locker_number'], name='locker_available_number'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', '-created_at'], name='reservation_user_recent'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_reservation_user_no_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('location', models.CharField(max_length=100)),
+                ('reservations', models.IntegerField(default=0)),
+                ('occupied_seconds', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'rollup_locations',
+            },
+        ),
+        migrations.CreateModel(
+            name='LockerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('location', models.CharField(max_length=100)),
+                ('reservations', models.IntegerField(default=0)),
+                ('occupied_seconds', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'rollup_lockers',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupOpenReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('locker_id', models.BigIntegerField()),
+                ('location', models.CharField(max_length=100)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('total_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('active', 'Active'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('counted_until', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'rollup_open_reservations',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('through', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'rollup_watermarks',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='archivedreservation',
+            index=models.Index(fields=['updated_at', 'id'], name='archive_changes'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['updated_at', 'id'], name='reservation_changes'),
+        ),
+        migrations.AddIndex(
+            model_name='locationrollup',
+            index=models.Index(fields=['period', 'bucket'], name='rollup_location_period'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='locationrollup',
+            unique_together={('period', 'location', 'bucket')},
+        ),
+        migrations.AddField(
+            model_name='lockerrollup',
+            name='locker',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='api.locker'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lockerrollup',
+            unique_together={('period', 'locker', 'bucket')},
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_reservation_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedreservation',
+            index=models.Index(fields=['start_time'], name='archive_start'),
+        ),
+    ]
@@ -1,5 +1,74 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .signals import lockers_changed
+
+# Fields whose changes move a locker between (location, status) buckets.
+BUCKET_FIELDS = ('location', 'status')
+
+def bucket_deltas(before, after):
+    """Net count change per ``(location, status)`` given old and new buckets."""
+    deltas = Counter(after)
+    deltas.subtract(before)
+    return {key: n for key, n in deltas.items() if n}
+
+class LockerQuerySet(models.QuerySet):
+    """Announces bulk writes that bypass ``post_save``/``post_delete``."""
+
+    def update(self, **kwargs):
+        # ``auto_now`` only applies to ``save()``; stamp bulk writes too so
+        # change feeds keyed on ``updated_at`` see them.
+        kwargs.setdefault('updated_at', timezone.now())
+        with transaction.atomic(using=self.db, savepoint=False):
+            moves_buckets = any(field in kwargs for field in BUCKET_FIELDS)
+            if moves_buckets:
+                # Lock the rows first so the bucket counts we derive below
+                # describe exactly the rows the UPDATE touches.
+                before = list(self.select_for_update().values_list('pk', *BUCKET_FIELDS))
+            rows = super().update(**kwargs)
+            if rows:
+                deltas = self._bucket_deltas(before, kwargs) if moves_buckets else None
+                lockers_changed.send(
+                    sender=self.model, using=self.db, instances=None,
+                    fields=set(kwargs), deltas=deltas,
+                )
+        return rows
+
+    def create(self, **kwargs):
+        # Without an explicit database, let the router place the new row by
+        # its location (myapp.sharding) rather than by the bare model.
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if objs:
+                lockers_changed.send(
+                    sender=self.model, using=self.db, instances=objs, fields=None,
+                    deltas=bucket_deltas([], [obj.bucket for obj in objs]),
+                )
+        return objs
+
+    def _bucket_deltas(self, before, kwargs):
+        if not any(hasattr(kwargs.get(field), 'resolve_expression') for field in BUCKET_FIELDS):
+            after = [
+                (kwargs.get('location', location), kwargs.get('status', status))
+                for _, location, status in before
+            ]
+        else:
+            # Expressions (e.g. the CASE built by bulk_update) have to be
+            # read back to learn where each row ended up.
+            pks = [pk for pk, _, _ in before]
+            base = self.model._base_manager.using(self.db)
+            after = []
+            for i in range(0, len(pks), 500):
+                after += base.filter(pk__in=pks[i:i + 500]).values_list(*BUCKET_FIELDS)
+        return bucket_deltas([(location, status) for _, location, status in before], after)
 
 class Locker(models.Model):
     STATUS_CHOICES = [
@@ -13,33 +82,241 @@ class Locker(models.Model):
     price_per_hour = models.DecimalField(max_digits=10, decimal_places=2, default=2.50)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available')
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = LockerQuerySet.as_manager()
     
     class Meta:
         db_table = 'lockers'
         ordering = ['locker_number']
+        indexes = [
+            # Status-filtered listings in locker_number (cursor) order.
+            models.Index(fields=['status', 'locker_number'], name='locker_status_number'),
+            # Per-location status breakdowns and counter reconciliation.
+            models.Index(fields=['location', 'status'], name='locker_location_status'),
+            # The public "available" listing; a small index on backends with
+            # partial index support, skipped elsewhere.
+            models.Index(
+                fields=['locker_number'], condition=models.Q(status='available'),
+                name='locker_available_number',
+            ),
+        ]
     
     def __str__(self):
         return f"Locker {self.locker_number}"
+    
+    @property
+    def bucket(self):
+        return (self.location, self.status)
+    
+    def save(self, *args, **kwargs):
+        # Keep the row and the derived counters (see api.signals) in one transaction.
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Locker, instance=self)):
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Locker, instance=self)):
+            return super().delete(*args, **kwargs)
+
+class ReservationQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # As for lockers: stamp bulk writes, so the rollups (api.services.rollups)
+        # pick up releases and sweeps as changes.
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
 
 class Reservation(models.Model):
     STATUS_CHOICES = [
+        ('scheduled', 'Scheduled'),
         ('active', 'Active'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations')
+    # No database constraint: with location sharding the user is on another database.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations', db_constraint=False)
     locker = models.ForeignKey(Locker, on_delete=models.CASCADE, related_name='reservations')
-    start_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = ReservationQuerySet.as_manager()
     
     class Meta:
         db_table = 'reservations'
         ordering = ['-created_at']
+        indexes = [
+            # Overlap checks: one locker's live bookings, range-scanned by start.
+            # Also serves (locker, status) lookups as its leading columns.
+            models.Index(fields=['locker', 'status', 'start_time'], name='reservation_locker_window'),
+            # A user's reservations, newest first.
+            models.Index(fields=['user', '-created_at'], name='reservation_user_recent'),
+            # Sweeper: overdue and due-to-start reservations, oldest first.
+            models.Index(fields=['status', 'end_time'], name='reservation_status_end'),
+            models.Index(fields=['status', 'start_time'], name='reservation_status_start'),
+            # Rollups: changes since the watermark, in order.
+            models.Index(fields=['updated_at', 'id'], name='reservation_changes'),
+        ]
+    
+    def __str__(self):
+        return f"Reservation {self.id} - {self.user.username}"
+
+class ArchivedReservation(models.Model):
+    """A finished reservation moved out of ``reservations`` (see ``api.services.archive``).
+
+    Keeps the original primary key, so ids stay unique across both tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_reservations',
+                             db_constraint=False)
+    locker = models.ForeignKey(Locker, on_delete=models.CASCADE, related_name='archived_reservations')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    # Copied from the live row, so archiving is not a change to roll up.
+    updated_at = models.DateTimeField(default=timezone.now)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'reservations_archive'
+        ordering = ['-created_at']
+        indexes = [
+            # History API: a user's archived reservations, newest first.
+            models.Index(fields=['user', '-created_at'], name='archive_user_recent'),
+            models.Index(fields=['-created_at'], name='archive_recent'),
+            # Exports: the reservations started in a range.
+            models.Index(fields=['start_time'], name='archive_start'),
+            models.Index(fields=['updated_at', 'id'], name='archive_changes'),
+        ]
+
+    def __str__(self):
+        return f"Archived reservation {self.id}"
+
+class RevokedToken(models.Model):
+    """A revoked JWT, by ``jti``, kept until the token expires (see ``api.services.revocation``)."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'revoked_tokens'
+
+    def __str__(self):
+        return f"Revoked token {self.jti}"
+
+class ChangeCounter(models.Model):
+    """Monotonic version number bumped on every write to a tracked table."""
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'change_counters'
+    
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class LockerStatusCount(models.Model):
+    """Number of lockers per (location, status), maintained on every transition."""
+    location = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=Locker.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'locker_status_counts'
+        unique_together = ['location', 'status']
     
     def __str__(self):
-        return f"Reservation {self.id} - {self.user.username}"
\ No newline at end of file
+        return f"{self.location} / {self.status}: {self.count}"
+
+
+class LockerRollup(models.Model):
+    """Reservation activity of one locker in one hour or day (see ``api.services.rollups``).
+
+    ``reservations`` started in the bucket, ``occupied_seconds`` of it were
+    covered by a reservation and ``revenue`` is the ``total_price`` of those
+    completed in it. Buckets start on the hour or at midnight, UTC.
+    """
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    locker = models.ForeignKey(Locker, on_delete=models.CASCADE, related_name='rollups')
+    location = models.CharField(max_length=100)
+    reservations = models.IntegerField(default=0)
+    occupied_seconds = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'rollup_lockers'
+        # One locker's buckets, range-scanned by time.
+        unique_together = ['period', 'locker', 'bucket']
+
+    def __str__(self):
+        return f"Locker {self.locker_id} {self.period} {self.bucket:%Y-%m-%d %H:%M}"
+
+class LocationRollup(models.Model):
+    """``LockerRollup`` summed over the lockers of a location."""
+    period = models.CharField(max_length=4, choices=LockerRollup.PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    location = models.CharField(max_length=100)
+    reservations = models.IntegerField(default=0)
+    occupied_seconds = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'rollup_locations'
+        unique_together = ['period', 'location', 'bucket']
+        indexes = [
+            # Fleet-wide ranges: every location's buckets in a window.
+            models.Index(fields=['period', 'bucket'], name='rollup_location_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.location} {self.period} {self.bucket:%Y-%m-%d %H:%M}"
+
+class RollupOpenReservation(models.Model):
+    """An unfinished reservation as it was last rolled up, counted up to ``counted_until``.
+
+    Each pass takes this contribution back out before adding the
+    reservation's current one, and extends occupancy for the rest.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    locker_id = models.BigIntegerField()
+    location = models.CharField(max_length=100)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES)
+    counted_until = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'rollup_open_reservations'
+
+    def __str__(self):
+        return f"Open reservation {self.id} to {self.counted_until}"
+
+class RollupWatermark(models.Model):
+    """How far the rollups have read the reservation changes of one database.
+
+    ``changed_at``/``last_id`` is the last ``(updated_at, id)`` processed;
+    ``through`` is the time up to which the rollups are complete.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    changed_at = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    through = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'rollup_watermarks'
+
+    def __str__(self):
+        return f"{self.name} through {self.through}"
\ No newline at end of file
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class LockerCursorPagination(CursorPagination):
+    """Keyset pagination on ``locker_number``.
+
+    Each page is a ``locker_number > <last seen>`` range scan over the unique
+    index, so page 1000 costs the same as page 1. Filters in the query string
+    are carried into the ``next``/``previous`` links unchanged.
+    """
+    ordering = 'locker_number'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class ReservationHistoryPagination(CursorPagination):
+    """Keyset pagination over archived reservations, newest first."""
+    ordering = '-created_at'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,33 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` with the encoding done by orjson.
+
+    Output has the same shape as ``JSONRenderer``'s (compact, UTF-8,
+    U+2028/U+2029 escaped) and decodes to the same values, but it is not
+    byte-identical: floats in exponent form are spelled ``1e16`` rather than
+    ``1e+16``, and NaN and infinities are written as ``null`` where
+    ``JSONRenderer`` refuses them. Datetimes, decimals and other non-JSON
+    types are handed to DRF's encoder, so they keep DRF's format.
+    Indented output (``Accept: application/json; indent=4`` and the browsable
+    API) is left to the parent renderer.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None \
+                or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            # Whatever orjson refuses (e.g. integers beyond 64 bits).
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -1,6 +1,16 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from rest_framework.settings import ISO_8601, api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Locker
+from myapp.sharding import shard_for_location, sharded
+from .authentication import CachedJWTAuthentication, stamp_claims
+from .models import ArchivedReservation, Locker, Reservation
+from .services.revocation import is_revoked, revoke
 
 class UserSerializer(serializers.ModelSerializer):
     is_admin = serializers.SerializerMethodField()
@@ -14,11 +24,13 @@ class UserSerializer(serializers.ModelSerializer):
         return obj.is_staff or obj.is_superuser
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
-    password = serializers.CharField(write_only=True)
+    # The rules register_user applies.
+    password = serializers.CharField(write_only=True, min_length=6)
     
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'first_name', 'last_name']
+        extra_kwargs = {'email': {'required': True, 'allow_blank': False}}
     
     def create(self, validated_data):
         user = User.objects.create_user(
@@ -30,8 +42,149 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         )
         return user
 
-class LockerSerializer(serializers.ModelSerializer):
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresh, then stamp the user's current claims into the new access token.
+
+    Revoked refresh tokens are refused, and a rotated one is revoked (the
+    ``BLACKLIST_AFTER_ROTATION`` behaviour, without the token_blacklist app).
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_revoked(refresh):
+            raise InvalidToken('Token has been revoked')
+        data = super().validate(attrs)
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            revoke(refresh)
+        access = AccessToken(data['access'])
+        data['access'] = str(stamp_claims(access, CachedJWTAuthentication().get_user(access)))
+        return data
+
+def requested_fields(request):
+    """Parse ``?fields=a,b`` into a set of names, or None when absent."""
+    raw = request.query_params.get('fields') if request is not None else None
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+class SparseFieldsMixin:
+    """Drop fields the client did not ask for via ``?fields=`` on GET requests."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        wanted = requested_fields(request)
+        if wanted:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+class ShardedUniqueValidator(UniqueValidator):
+    """``UniqueValidator`` checked on every shard: a unique index only covers its own shard."""
+
+    def filter_queryset(self, value, queryset, field_name):
+        return super().filter_queryset(value, sharded(queryset), field_name)
+
+class LockerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Locker
         fields = ['id', 'locker_number', 'location', 'price_per_hour', 'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+        extra_kwargs = {'locker_number': {'validators': [ShardedUniqueValidator(
+            Locker.objects.all(), message='locker with this locker number already exists.',
+        )]}}
+
+    def validate_location(self, value):
+        if self.instance is not None and settings.DATABASE_SHARDS \
+                and shard_for_location(value) != self.instance._state.db:
+            raise serializers.ValidationError('Cannot move a locker to a location on another shard.')
+        return value
+
+def _row_converter(field):
+    """A cheap stand-in for ``field.to_representation`` on a non-null value.
+
+    ``None`` means the value is already its own representation. Values the
+    shortcut cannot vouch for go through the field itself, so the output
+    always matches ``LockerSerializer``.
+    """
+    exact = field.to_representation
+    kind = type(field)
+
+    if kind in (serializers.IntegerField, serializers.CharField, serializers.ChoiceField):
+        return None
+
+    if kind is serializers.DecimalField and field.decimal_places is not None and not field.localize \
+            and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        places = -field.decimal_places
+
+        def decimal_value(value):
+            # Already at the field's scale (as the DB returns it): quantizing is a no-op.
+            if value.as_tuple().exponent == places:
+                return f'{value:f}'
+            return exact(value)
+        return decimal_value
+
+    if kind is serializers.DateTimeField and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+        tz = getattr(field, 'timezone', None) or field.default_timezone()
+
+        def datetime_value(value):
+            if tz is None or value.tzinfo is None:
+                return exact(value)
+            text = value.astimezone(tz).isoformat()
+            return text[:-6] + 'Z' if text.endswith('+00:00') else text
+        return datetime_value
+
+    return exact
+
+
+class LockerRowSerializer:
+    """``LockerSerializer`` output built straight from ``values_list`` rows.
+
+    Skips model instantiation and DRF's per-field attribute lookup; each
+    column gets a precompiled converter (see ``_row_converter``). Rows are
+    named tuples, so keyset pagination can read ``locker_number`` off them.
+    """
+
+    def __init__(self, fields=None):
+        declared = LockerSerializer().fields
+        self.field_names = [name for name in declared if fields is None or name in fields]
+        self._converters = [_row_converter(declared[name]) for name in self.field_names]
+        self._sources = [declared[name].source for name in self.field_names]
+        if 'locker_number' not in self._sources:
+            # Trailing column for the pagination cursor; not emitted.
+            self._sources.append('locker_number')
+
+    def queryset(self, queryset):
+        return queryset.values_list(*self._sources, named=True)
+
+    def to_representation(self, rows):
+        names = self.field_names
+        pairs = list(enumerate(self._converters))
+        out = []
+        for row in rows:
+            item = {}
+            for i, convert in pairs:
+                value = row[i]
+                item[names[i]] = value if convert is None or value is None else convert(value)
+            out.append(item)
+        return out
+
+
+class ReservationSerializer(serializers.ModelSerializer):
+    locker_number = serializers.CharField(source='locker.locker_number', read_only=True)
+
+    class Meta:
+        model = Reservation
+        fields = ['id', 'user', 'locker', 'locker_number', 'start_time', 'end_time', 'total_price', 'status', 'created_at']
+        # ``create`` reads the locker from the request itself.
+        read_only_fields = ['id', 'user', 'locker', 'start_time', 'end_time', 'total_price', 'status', 'created_at']
+
+
+class ArchivedReservationSerializer(serializers.ModelSerializer):
+    locker_number = serializers.CharField(source='locker.locker_number', read_only=True)
+
+    class Meta:
+        model = ArchivedReservation
+        fields = ReservationSerializer.Meta.fields + ['archived_at']
+        read_only_fields = fields
@@ -0,0 +1 @@
+"""Domain services shared by the API views and management commands."""
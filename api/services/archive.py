@@ -0,0 +1,104 @@
+"""
+Hot/cold archival of finished reservations.
+
+Completed and cancelled reservations whose ``end_time`` is older than the
+cutoff are moved from ``reservations`` to ``reservations_archive``, one
+status at a time and oldest first along the ``(status, end_time)`` index. Each batch is its own short
+transaction - the rows are locked with ``SKIP LOCKED`` where supported,
+copied with one ``INSERT ... SELECT`` and deleted by primary key - so a run can be
+stopped at any point and the next one carries on where it left off; there
+is no progress marker to lose. Archived rows keep their ids and are read
+through ``ReservationViewSet.history``.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from ..models import ArchivedReservation, Reservation
+
+BATCH_SIZE = 1000
+MAX_BATCHES = 100
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+FIELDS = [field.name for field in ArchivedReservation._meta.concrete_fields if field.name != 'archived_at']
+
+
+def default_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=settings.RESERVATION_ARCHIVE_DAYS)
+
+
+def archivable(cutoff, using=None):
+    return Reservation.objects.using(using).filter(status__in=ARCHIVED_STATUSES, end_time__lt=cutoff)
+
+
+def _locked_batch(cutoff, batch_size, using):
+    # One status at a time: each is a range scan in end_time order on the
+    # index, where ``status IN (...)`` would sort every match first.
+    pks = []
+    for status in ARCHIVED_STATUSES:
+        pks += (
+            Reservation.objects.using(using).filter(status=status, end_time__lt=cutoff)
+            .select_for_update(skip_locked=True).order_by('end_time')
+            .values_list('pk', flat=True)[:batch_size - len(pks)]
+        )
+        if len(pks) == batch_size:
+            break
+    return pks
+
+
+def _copy_to_archive(pks, archived_at, using):
+    """``INSERT ... SELECT`` the rows into the archive; no values pass through Python."""
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    ops, quote = connection.ops, connection.ops.quote_name
+    archive_meta, hot_meta = ArchivedReservation._meta, Reservation._meta
+    columns = [archive_meta.get_field(name).column for name in FIELDS]
+    sources = [hot_meta.get_field(name).column for name in FIELDS]
+    # A row already archived (and restored by hand) is not copied twice.
+    sql = (
+        f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {quote(archive_meta.db_table)} '
+        f'({", ".join(quote(c) for c in columns)}, {quote(archive_meta.get_field("archived_at").column)}) '
+        f'SELECT {", ".join(quote(c) for c in sources)}, %s FROM {quote(hot_meta.db_table)} '
+        f'WHERE {quote(hot_meta.pk.column)} IN ({", ".join(["%s"] * len(pks))}) '
+        f'{ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [ops.adapt_datetimefield_value(archived_at), *pks])
+
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE, using=None):
+    """Move up to ``batch_size`` finished reservations. Returns the number moved."""
+    with transaction.atomic(using=using):
+        pks = _locked_batch(cutoff, batch_size, using)
+        if not pks:
+            return 0
+        _copy_to_archive(pks, timezone.now(), using)
+        Reservation.objects.using(using).filter(pk__in=pks).delete()
+    return len(pks)
+
+
+def archive(cutoff=None, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES, pause=0, using=None):
+    """Archive in batches until nothing is left or ``max_batches`` ran; returns metrics.
+
+    ``pause`` seconds between batches leave room for other writers (and
+    replication) on a busy database.
+    """
+    cutoff = cutoff or default_cutoff()
+    started = time.perf_counter()
+    metrics = {'archived': 0, 'batches': 0, 'backlog': False, 'cutoff': cutoff.isoformat()}
+
+    for batch in range(max_batches):
+        if batch and pause:
+            time.sleep(pause)
+        archived = archive_batch(cutoff, batch_size, using=using)
+        metrics['archived'] += archived
+        metrics['batches'] += 1
+        if archived < batch_size:
+            break
+    else:
+        metrics['backlog'] = archivable(cutoff, using).exists()
+
+    metrics['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return metrics
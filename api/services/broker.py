@@ -0,0 +1,193 @@
+"""
+In-process fan-out of locker status changes.
+
+One ``LockerEventBroker`` lives in each worker process. A single pump task
+per event loop turns ``ChangeCounter`` bumps into status deltas and appends
+them to a bounded history; every idle subscriber waits on one shared
+``asyncio.Event``, so publishing costs the same for ten connections as for
+ten thousand.
+
+Writes made in this process wake the pump immediately (``wake()`` runs on
+commit). Writes made by other workers are picked up on the next poll of the
+counter row, so cross-process delivery is bounded by ``poll_interval``.
+Deletions are only seen by the process that performed them; other workers'
+clients catch up on their next full refetch.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils import timezone
+
+from myapp.sharding import sharded
+
+from ..models import Locker
+from .versioning import LOCKERS, get_version
+
+# Transactions stamp ``updated_at`` before they commit, so rows can become
+# visible slightly "in the past". Each scan looks back this far and skips
+# rows it has already delivered.
+COMMIT_LAG = timedelta(seconds=2)
+
+
+class LockerEventBroker:
+    def __init__(self, history=2048, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.version = 0
+        self._floor = 0
+        self._history = deque()
+        self._history_size = history
+        self._lock = threading.Lock()
+        self._deleted = []
+        self._delivered = {}
+        self._watermark = None
+        self._loops = {}
+
+    # -- publishing -----------------------------------------------------
+
+    def publish(self, version, changes):
+        """Record ``changes`` at ``version`` and wake every subscriber."""
+        with self._lock:
+            if version <= self.version:
+                return
+            self.version = version
+            if changes:
+                self._history.append((version, changes))
+                if len(self._history) > self._history_size:
+                    self._floor = self._history.popleft()[0]
+        self._each_loop(self._notify)
+
+    def note_deleted(self, locker_id):
+        with self._lock:
+            self._deleted.append({'id': locker_id, 'status': 'deleted', 'updated_at': None})
+
+    def wake(self):
+        """Ask every pump to poll now instead of waiting for its interval."""
+        self._each_loop(lambda state: state['poke'].set())
+
+    def _each_loop(self, callback):
+        with self._lock:
+            loops = list(self._loops.items())
+        for loop, state in loops:
+            try:
+                loop.call_soon_threadsafe(callback, state)
+            except RuntimeError:
+                # The loop has been closed (e.g. a finished ``asyncio.run``).
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    @staticmethod
+    def _notify(state):
+        changed, state['changed'] = state['changed'], asyncio.Event()
+        changed.set()
+
+    # -- reading --------------------------------------------------------
+
+    def since(self, version):
+        """Return ``(changes, current_version, reset)`` for a client cursor.
+
+        ``reset`` is true when the cursor predates the retained history, in
+        which case the client should refetch the full locker list.
+        """
+        with self._lock:
+            current = self.version
+            if version >= current:
+                return [], current, False
+            if version < self._floor:
+                return [], current, True
+            changes = []
+            for event_version, event_changes in self._history:
+                if event_version > version:
+                    changes.extend(event_changes)
+        return changes, current, False
+
+    async def start(self):
+        """Make sure this event loop has a pump and the broker is primed."""
+        return await self._loop_state()
+
+    async def wait(self, version, timeout):
+        """Wait until the broker moves past ``version`` or ``timeout`` expires."""
+        state = await self._loop_state()
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = state['changed']
+            remaining = deadline - time.monotonic()
+            if self.version > version or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.since(version)
+
+    # -- pump -----------------------------------------------------------
+
+    async def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            if not self.version:
+                version, updated_at = await sync_to_async(get_version)(LOCKERS)
+                with self._lock:
+                    if not self.version:
+                        self.version = self._floor = version
+                        self._watermark = updated_at or timezone.now()
+            state = self._loops.get(loop)
+        if state is None:
+            state = {'changed': asyncio.Event(), 'poke': asyncio.Event()}
+            with self._lock:
+                self._loops[loop] = state
+            # In an empty context: the pump outlives the request that starts
+            # it and must not keep its database routing or timing sample.
+            state['task'] = contextvars.Context().run(loop.create_task, self._pump(state))
+        return state
+
+    async def _pump(self, state):
+        while True:
+            try:
+                await asyncio.wait_for(state['poke'].wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            state['poke'].clear()
+            try:
+                # The pump outlives the request that started it, so it must
+                # not borrow that request's thread-sensitive executor.
+                await sync_to_async(self._poll, thread_sensitive=False)()
+            except Exception:
+                # The database may be briefly unavailable; retry next tick.
+                continue
+
+    def _poll(self):
+        close_old_connections()
+        version, _ = get_version(LOCKERS)
+        if version <= self.version:
+            return
+
+        rows = (
+            sharded(Locker.objects.filter(updated_at__gte=self._watermark - COMMIT_LAG))
+            .order_by('updated_at')
+            .values_list('id', 'status', 'updated_at')
+        )
+        changes = []
+        for pk, status, updated_at in rows:
+            if self._delivered.get(pk) == updated_at:
+                continue
+            self._delivered[pk] = updated_at
+            self._watermark = max(self._watermark, updated_at)
+            changes.append({'id': pk, 'status': status, 'updated_at': updated_at.isoformat()})
+
+        horizon = self._watermark - COMMIT_LAG
+        self._delivered = {pk: at for pk, at in self._delivered.items() if at >= horizon}
+
+        with self._lock:
+            changes.extend(self._deleted)
+            self._deleted = []
+        self.publish(version, changes)
+
+
+broker = LockerEventBroker()
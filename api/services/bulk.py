@@ -0,0 +1,239 @@
+"""
+Bulk locker administration.
+
+Each batch is validated item by item with ``LockerSerializer``'s list child
+(the per-row validation ``LockerSerializer(many=True)`` performs), except
+that ``locker_number`` uniqueness is checked with one ``IN`` query per chunk
+instead of one query per row. Valid rows are written with
+``bulk_create``/``bulk_update`` in a single transaction and every item gets
+its own result entry, so one bad row does not sink the batch.
+
+Under location sharding (``myapp.sharding``) the batch is split by shard
+and each shard's part is written in a transaction of its own; a locker
+cannot be moved to a location on another shard.
+"""
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueValidator
+
+from myapp.sharding import shard_for_location, sharded
+
+from ..models import Locker
+from ..serializers import LockerSerializer
+
+BATCH_SIZE = 500
+# Change sets shared by at least this many rows are written as one UPDATE.
+GROUP_UPDATE_MIN = 20
+DUPLICATE_NUMBER = 'locker with this locker number already exists.'
+OTHER_SHARD = 'Cannot move a locker to a location on another shard.'
+INVALID_ID = 'A valid integer is required.'
+STATUSES = {value for value, _ in Locker.STATUS_CHOICES}
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _batch_validator(partial=False):
+    """A ``LockerSerializer`` child with the per-row unique lookup removed."""
+    serializer = LockerSerializer(many=True, partial=partial).child
+    field = serializer.fields['locker_number']
+    field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+    return serializer
+
+
+def _by_database(ids):
+    """``{alias: [id, ...]}``: the ids grouped by the database holding them."""
+    groups = {}
+    for pk in ids:
+        groups.setdefault(router.db_for_write(Locker, pk=pk), []).append(pk)
+    return groups
+
+
+def _error(index, errors, **extra):
+    return {'index': index, 'status': 'error', 'errors': errors, **extra}
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _existing_numbers(numbers):
+    """``{locker_number: id}`` for numbers already in the table (on any shard)."""
+    existing = {}
+    for chunk in _chunks(set(numbers)):
+        existing.update(sharded(Locker.objects.filter(locker_number__in=chunk)).values_list('locker_number', 'id'))
+    return existing
+
+
+def _require_list(items):
+    if not isinstance(items, list):
+        raise ValidationError({'error': 'Expected a list of lockers'})
+
+
+def bulk_create_lockers(items):
+    _require_list(items)
+    validator = _batch_validator()
+    results = [None] * len(items)
+
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, validator.run_validation(item)))
+        except ValidationError as e:
+            results[index] = _error(index, e.detail)
+
+    existing = _existing_numbers(data['locker_number'] for _, data in valid)
+    pending = []
+    for index, data in valid:
+        number = data['locker_number']
+        if number in existing:
+            results[index] = _error(index, {'locker_number': [DUPLICATE_NUMBER]})
+            continue
+        existing[number] = None
+        pending.append((index, Locker(**data)))
+
+    by_database = {}
+    for _, locker in pending:
+        by_database.setdefault(router.db_for_write(Locker, instance=locker), []).append(locker)
+    for using, lockers in by_database.items():
+        with transaction.atomic(using=using):
+            Locker.objects.using(using).bulk_create(lockers, batch_size=BATCH_SIZE)
+
+    for index, locker in pending:
+        results[index] = {'index': index, 'status': 'created', 'id': locker.pk}
+    return results
+
+
+def bulk_update_lockers(items):
+    _require_list(items)
+    validator = _batch_validator(partial=True)
+    results = [None] * len(items)
+
+    ids = [item.get('id') for item in items if isinstance(item, dict)]
+    instances = {}
+    for using, pks in _by_database(i for i in ids if _is_id(i)).items():
+        for chunk in _chunks(pks):
+            instances.update(Locker.objects.using(using).in_bulk(chunk))
+
+    valid = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        locker_id = item.get('id') if isinstance(item, dict) else None
+        if locker_id is not None and not _is_id(locker_id):
+            results[index] = _error(index, {'id': [INVALID_ID]}, id=locker_id)
+            continue
+        if locker_id not in instances:
+            results[index] = _error(index, {'id': ['Locker not found']}, id=locker_id)
+            continue
+        if locker_id in seen_ids:
+            results[index] = _error(index, {'id': ['Locker appears more than once in the batch']}, id=locker_id)
+            continue
+        try:
+            data = validator.run_validation({k: v for k, v in item.items() if k != 'id'})
+        except ValidationError as e:
+            results[index] = _error(index, e.detail, id=locker_id)
+            continue
+        if 'location' in data and settings.DATABASE_SHARDS \
+                and shard_for_location(data['location']) != instances[locker_id]._state.db:
+            results[index] = _error(index, {'location': [OTHER_SHARD]}, id=locker_id)
+            continue
+        seen_ids.add(locker_id)
+        valid.append((index, locker_id, data))
+
+    renamed = {data['locker_number']: locker_id for _, locker_id, data in valid if 'locker_number' in data}
+    taken = _existing_numbers(renamed)
+    claimed = {}
+    by_database = {}
+    for index, locker_id, data in valid:
+        number = data.get('locker_number')
+        if number is not None:
+            owner = claimed.get(number, taken.get(number, locker_id))
+            if owner != locker_id:
+                results[index] = _error(index, {'locker_number': [DUPLICATE_NUMBER]}, id=locker_id)
+                continue
+            claimed[number] = locker_id
+        by_database.setdefault(instances[locker_id]._state.db, []).append((index, locker_id, data))
+
+    # Bulk edits usually apply the same values to many lockers (a new price
+    # for a bank, a location rename). Rows sharing a change set are written
+    # with one ``UPDATE ... WHERE id IN (...)`` per chunk; only the
+    # heterogeneous remainder pays for ``bulk_update``'s per-row CASE. Every
+    # row writes only the fields its own item changed, so a status set by a
+    # concurrent reservation or the sweeper is never written back stale.
+    now = timezone.now()
+    for using, changed in by_database.items():
+        lockers = Locker.objects.using(using)
+        with transaction.atomic(using=using):
+            current = {}
+            for chunk in _chunks(locker_id for _, locker_id, _ in changed):
+                current.update(lockers.select_for_update().in_bulk(chunk))
+
+            groups = {}
+            for index, locker_id, data in changed:
+                if locker_id not in current:
+                    results[index] = _error(index, {'id': ['Locker not found']}, id=locker_id)
+                    continue
+                groups.setdefault(tuple(sorted(data.items())), []).append(locker_id)
+                results[index] = {'index': index, 'status': 'updated', 'id': locker_id}
+
+            remainder = {}
+            for change_set, pks in groups.items():
+                if len(pks) < GROUP_UPDATE_MIN:
+                    remainder.setdefault(tuple(name for name, _ in change_set), []).extend(
+                        (pk, change_set) for pk in pks
+                    )
+                    continue
+                for chunk in _chunks(pks):
+                    lockers.filter(pk__in=chunk).update(updated_at=now, **dict(change_set))
+            for fields, rows in remainder.items():
+                for pk, change_set in rows:
+                    for name, value in change_set:
+                        setattr(current[pk], name, value)
+                    current[pk].updated_at = now
+                lockers.bulk_update(
+                    [current[pk] for pk, _ in rows], [*fields, 'updated_at'], batch_size=BATCH_SIZE
+                )
+    return results
+
+
+def bulk_transition_status(ids, status, from_status=None):
+    """Move ``ids`` to ``status``; with ``from_status`` only lockers currently in it."""
+    if not isinstance(ids, list) or not all(_is_id(i) for i in ids):
+        raise ValidationError({'ids': 'Expected a list of locker ids'})
+    for name, value in (('status', status), ('from_status', from_status)):
+        if value is not None and value not in STATUSES:
+            raise ValidationError({name: f'"{value}" is not a valid choice.'})
+    if status is None:
+        raise ValidationError({'status': 'This field is required.'})
+
+    current, moved = {}, set()
+    for using, pks in _by_database(set(ids)).items():
+        lockers = Locker.objects.using(using)
+        with transaction.atomic(using=using):
+            found = {}
+            for chunk in _chunks(pks):
+                found.update(lockers.select_for_update().filter(pk__in=chunk).values_list('pk', 'status'))
+
+            eligible = [
+                pk for pk, state in found.items()
+                if state != status and (from_status is None or state == from_status)
+            ]
+            for chunk in _chunks(eligible):
+                lockers.filter(pk__in=chunk).update(status=status)
+        current.update(found)
+        moved.update(eligible)
+
+    results = []
+    for locker_id in ids:
+        if locker_id not in current:
+            results.append({'id': locker_id, 'status': 'not_found'})
+        elif locker_id in moved:
+            results.append({'id': locker_id, 'status': 'updated', 'from': current[locker_id]})
+        else:
+            results.append({'id': locker_id, 'status': 'skipped', 'current': current[locker_id]})
+    return results
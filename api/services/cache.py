@@ -0,0 +1,109 @@
+"""
+Read-through cache for serialized locker payloads.
+
+Entries are keyed on the locker change version (``api.services.versioning``)
+that every locker write path bumps, so a write makes every older entry
+unreachable without deleting anything and a cached payload is never older
+than the version it is filed under. Reservation writes reach the cache the
+same way: claiming, releasing and sweeping all move a locker between
+statuses, which bumps the version.
+
+On a miss only one caller per key recomputes the payload; the others wait
+briefly for it to appear (``add`` on a short-lived lock key, so this works
+across processes with a shared backend) and recompute themselves only if
+the winner is slow.
+"""
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from myapp.metrics import CACHE_REQUESTS
+
+LOCK_TIMEOUT = 5
+WAIT_SECONDS = 0.5
+POLL_SECONDS = 0.01
+_MISSING = object()
+
+
+def _cache():
+    return caches[getattr(settings, 'LOCKER_CACHE_ALIAS', 'default')]
+
+
+def payload_key(namespace, version, *parts):
+    digest = hashlib.sha1('\x00'.join(str(p) for p in parts).encode()).hexdigest()
+    return f'{namespace}:v{version}:{digest}'
+
+
+def read_through(key, compute, timeout=None, namespace='lockers'):
+    """Return the cached value for ``key``, computing and storing it on a miss.
+
+    ``compute`` returns ``(value, cacheable)``; uncacheable results (errors)
+    are returned but not stored.
+    """
+    cache = _cache()
+    if timeout is None:
+        timeout = getattr(settings, 'LOCKER_CACHE_TIMEOUT', 300)
+
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        CACHE_REQUESTS.labels(namespace, 'hit').inc()
+        return value
+
+    lock = f'{key}:lock'
+    locked = cache.add(lock, 1, LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(POLL_SECONDS)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                CACHE_REQUESTS.labels(namespace, 'hit').inc()
+                return value
+
+    CACHE_REQUESTS.labels(namespace, 'miss').inc()
+    try:
+        value, cacheable = compute()
+        if cacheable:
+            cache.set(key, value, timeout)
+    finally:
+        # Only the holder releases the lock: a waiter that gave up must not
+        # free it for a second recompute while the holder is still running.
+        if locked:
+            cache.delete(lock)
+    return value
+
+
+async def aread_through(key, compute, timeout=None, namespace='lockers'):
+    """``read_through`` for async views; ``compute`` is a coroutine function."""
+    cache = _cache()
+    if timeout is None:
+        timeout = getattr(settings, 'LOCKER_CACHE_TIMEOUT', 300)
+
+    value = await cache.aget(key, _MISSING)
+    if value is not _MISSING:
+        CACHE_REQUESTS.labels(namespace, 'hit').inc()
+        return value
+
+    lock = f'{key}:lock'
+    locked = await cache.aadd(lock, 1, LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_SECONDS)
+            value = await cache.aget(key, _MISSING)
+            if value is not _MISSING:
+                CACHE_REQUESTS.labels(namespace, 'hit').inc()
+                return value
+
+    CACHE_REQUESTS.labels(namespace, 'miss').inc()
+    try:
+        value, cacheable = await compute()
+        if cacheable:
+            await cache.aset(key, value, timeout)
+    finally:
+        if locked:
+            await cache.adelete(lock)
+    return value
@@ -0,0 +1,227 @@
+"""
+Streaming export of reservation history.
+
+Rows are read as ``values_list`` tuples joined to their user and locker in
+the same query, in primary-key order, through ``QuerySet.iterator`` with a
+fixed ``chunk_size``: PostgreSQL streams them from a server-side cursor,
+SQLite and MySQL fetch them chunk by chunk.
+Encoded output is flushed every ``FLUSH_ROWS`` rows, so memory use depends
+on the chunk size and not on how many rows the export covers.
+
+Under location sharding every shard is streamed at once, each on its own
+thread, and the rows merged in primary-key order. Users live on the primary
+there, so shard rows carry ``user_id`` in place of the user columns and each
+flushed batch looks its users up with one query.
+
+Reservations moved to ``reservations_archive`` (``api.services.archive``)
+keep their ids, so when the range reaches rows that were archived, the
+archive is read alongside the live table and the two streams are merged by
+primary key.
+
+CSV cells holding user-supplied text that a spreadsheet would read as a
+formula (leading ``=``, ``+``, ``-``, ``@``, tab or carriage return) are
+prefixed with ``'``. NDJSON is written unchanged.
+"""
+import csv
+import heapq
+import io
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+from operator import itemgetter
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from myapp.sharding import sharded
+
+from ..models import ArchivedReservation, Reservation
+from .archive import ARCHIVED_STATUSES
+from ..utils import parse_window_time
+
+CHUNK_SIZE = 2000
+FLUSH_ROWS = 500
+STATUSES = [value for value, _ in Reservation.STATUS_CHOICES]
+
+# (column, lookup) in output order.
+COLUMNS = [
+    ('id', 'id'),
+    ('status', 'status'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('email', 'user__email'),
+    ('locker_id', 'locker_id'),
+    ('locker_number', 'locker__locker_number'),
+    ('location', 'locker__location'),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('total_price', 'total_price'),
+    ('created_at', 'created_at'),
+]
+HEADER = [name for name, _ in COLUMNS]
+# csv writes None as '' and DB decimals at their own scale; only datetimes need formatting.
+_DATETIMES = [i for i, (name, _) in enumerate(COLUMNS) if name.endswith(('_time', '_at'))]
+# Shard rows: the user columns repeat user_id until ``_with_users`` fills them in.
+_SHARD_LOOKUPS = ['user_id' if lookup.startswith('user__') else lookup for _, lookup in COLUMNS]
+_USER_ID, _USERNAME, _EMAIL = (HEADER.index(name) for name in ('user_id', 'username', 'email'))
+# Free-text columns, and the leading characters that make a spreadsheet evaluate a cell.
+_TEXT = [HEADER.index(name) for name in ('username', 'email', 'locker_number', 'location')]
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_bound(value, name, end=False):
+    """Parse a ``from``/``to`` filter: an ISO datetime, or a date covering the whole day."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        if end:
+            day += timedelta(days=1)
+        return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    try:
+        return parse_window_time(value)
+    except ValueError:
+        raise ValidationError({name: f'Expected an ISO-8601 date or datetime, got {value!r}'})
+
+
+def parse_filters(params):
+    """Validate ``from``, ``to`` (on ``start_time``) and comma-separated ``status`` filters."""
+    filters = {
+        'start': parse_bound(params.get('from'), 'from'),
+        'end': parse_bound(params.get('to'), 'to', end=True),
+        'statuses': [s for s in (params.get('status') or '').split(',') if s],
+    }
+    unknown = sorted(set(filters['statuses']) - set(STATUSES))
+    if unknown:
+        raise ValidationError({'status': f'Unknown status {", ".join(unknown)}; expected one of {", ".join(STATUSES)}'})
+    if filters['start'] and filters['end'] and filters['start'] >= filters['end']:
+        raise ValidationError({'to': 'Must be after from'})
+    return filters
+
+
+class _Merged:
+    """Several ``pk``-ordered exports read back as one, in ``pk`` order."""
+
+    def __init__(self, querysets):
+        self.querysets = querysets
+
+    def iterator(self, chunk_size=CHUNK_SIZE):
+        return heapq.merge(*(queryset.iterator(chunk_size=chunk_size) for queryset in self.querysets),
+                           key=itemgetter(0))
+
+
+def _rows(model, start, end, statuses, using):
+    queryset = model.objects.using(using)
+    if start:
+        queryset = queryset.filter(start_time__gte=start)
+    if end:
+        queryset = queryset.filter(start_time__lt=end)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if settings.DATABASE_SHARDS:
+        return sharded(queryset).order_by('pk').values_list(*_SHARD_LOOKUPS)
+    return queryset.order_by('pk').values_list(*(lookup for _, lookup in COLUMNS))
+
+
+def export_queryset(start=None, end=None, statuses=None, using=None):
+    """Reservation rows (in ``COLUMNS`` order) with ``start_time`` in ``[start, end)``, archived ones included.
+
+    The archive is only read when it holds a matching row; the probe is a
+    seek on its ``start_time`` index.
+    """
+    live = _rows(Reservation, start, end, statuses, using)
+    if statuses and not set(statuses) & set(ARCHIVED_STATUSES):
+        return live
+    archived = _rows(ArchivedReservation, start, end, statuses, using)
+    if not archived.exists():
+        return live
+    return _Merged([live, archived])
+
+
+def _with_users(rows):
+    """Shard rows with their username and email read from the primary."""
+    users = {
+        pk: (username, email) for pk, username, email
+        in User.objects.filter(pk__in={row[_USER_ID] for row in rows}).values_list('pk', 'username', 'email')
+    }
+    out = []
+    for row in rows:
+        row = list(row)
+        row[_USERNAME], row[_EMAIL] = users.get(row[_USER_ID], (None, None))
+        out.append(row)
+    return out
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, Decimal):
+        return f'{value:f}'
+    if hasattr(value, 'isoformat'):
+        text = value.astimezone(dt_timezone.utc).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return value
+
+
+def _csv_header():
+    return (','.join(HEADER) + '\r\n').encode()
+
+
+def _csv_rows(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        row = list(row)
+        for i in _DATETIMES:
+            if row[i] is not None:
+                row[i] = _text(row[i])
+        for i in _TEXT:
+            if row[i] and row[i].startswith(FORMULA_PREFIXES):
+                row[i] = "'" + row[i]
+        writer.writerow(row)
+    return buffer.getvalue().encode()
+
+
+def _ndjson_rows(rows):
+    return b''.join(
+        orjson.dumps(dict(zip(HEADER, row)), default=_text, option=orjson.OPT_UTC_Z) + b'\n' for row in rows
+    )
+
+
+# format: (content type, header encoder or None, row encoder)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', _csv_header, _csv_rows),
+    'ndjson': ('application/x-ndjson', None, _ndjson_rows),
+}
+
+
+def iter_export(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """Encoded export of ``queryset`` (from ``export_queryset``) as a byte-string iterator."""
+    _, header, encode = FORMATS[fmt]
+    if header:
+        yield header()
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while batch := list(islice(rows, FLUSH_ROWS)):
+        if settings.DATABASE_SHARDS:
+            batch = _with_users(batch)
+        yield encode(batch)
+
+
+async def aiter_export(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """``iter_export`` as an async iterator, for responses streamed under ASGI.
+
+    Each chunk is produced in the request's sync thread, so the cursor stays
+    on one connection. (``aiterator`` cannot be used: ``values_list``
+    querysets run their query on the event loop.)
+    """
+    chunks = iter_export(queryset, fmt, chunk_size)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
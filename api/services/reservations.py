@@ -0,0 +1,239 @@
+"""
+Reservation engine.
+
+A locker is claimed with a single conditional UPDATE
+(``status='available'`` -> ``'occupied'``) and the matching ``Reservation``
+row is inserted in the same transaction. Exactly one concurrent caller can
+win the UPDATE; every other caller sees zero affected rows and gets a
+conflict result instead of a double booking.
+
+Where the backend supports ``UPDATE ... RETURNING`` (PostgreSQL, SQLite
+3.35+) the claim also returns the locker's location, so the status counters
+can be adjusted without reading the row first.
+
+Future bookings are ``scheduled`` reservations over a ``[start, end)``
+window. Overlap is decided by one EXISTS probe on the
+``(locker, status, start_time)`` index while the locker row is locked, so
+concurrent bookers of the same locker are serialized and never double-book.
+
+Every query runs on the database that holds the locker: its shard under
+location sharding (``myapp.sharding``), where its reservations live too.
+"""
+import sqlite3
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import DateTimeField, Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from myapp.metrics import RESERVATIONS
+from myapp.sharding import sharded
+
+from ..db_functions import HoursBetween
+from ..models import Locker, Reservation
+from ..signals import lockers_changed
+
+RESERVED = 'reserved'
+CONFLICT = 'conflict'
+NOT_FOUND = 'not_found'
+
+# Reservation statuses that hold a locker for their window.
+LIVE_STATUSES = ('scheduled', 'active')
+
+
+class _Conflict(Exception):
+    """Raised inside a transaction to roll back a claim that lost."""
+
+
+class ReservationResult:
+    """Outcome of a reservation attempt."""
+
+    def __init__(self, outcome, reservation=None):
+        self.outcome = outcome
+        self.reservation = reservation
+
+    @property
+    def ok(self):
+        return self.outcome == RESERVED
+
+    def __repr__(self):
+        return f"<ReservationResult {self.outcome}>"
+
+
+def _result(kind, outcome, reservation=None):
+    RESERVATIONS.labels(kind, outcome).inc()
+    return ReservationResult(outcome, reservation)
+
+
+def reserve_locker(user, locker_id, duration_hours=None):
+    """Atomically claim ``locker_id`` for ``user``.
+
+    The winner gets a ``RESERVED`` result carrying the new reservation.
+    Losers get ``CONFLICT`` (locker exists but is not available) or
+    ``NOT_FOUND``; the existence check only runs on that losing path.
+    """
+    try:
+        locker_id = int(locker_id)
+    except (TypeError, ValueError):
+        return _result('walk_up', NOT_FOUND)
+
+    now = timezone.now()
+    end_time = None
+    if duration_hours:
+        end_time = now + timedelta(hours=duration_hours)
+
+    using = router.db_for_write(Locker, pk=locker_id)
+    try:
+        with transaction.atomic(using=using):
+            claimed = transition_locker(locker_id, 'available', 'occupied', now, using=using)
+            if not claimed:
+                if Locker.objects.using(using).filter(pk=locker_id).exists():
+                    return _result('walk_up', CONFLICT)
+                return _result('walk_up', NOT_FOUND)
+
+            # The claim holds the locker row, so no booking can slip in
+            # between this probe and the insert.
+            if overlapping(locker_id, now, end_time, using=using).exists():
+                raise _Conflict
+
+            reservation = Reservation.objects.using(using).create(
+                user=user, locker_id=locker_id, start_time=now, end_time=end_time
+            )
+    except _Conflict:
+        return _result('walk_up', CONFLICT)
+    return _result('walk_up', RESERVED, reservation)
+
+
+def book_locker(user, locker_id, start, end):
+    """Book ``locker_id`` for the future window ``[start, end)``.
+
+    The locker row is locked for the duration of the overlap probe and the
+    insert. The locker's status is left alone until the window opens.
+    """
+    try:
+        locker_id = int(locker_id)
+    except (TypeError, ValueError):
+        return _result('booking', NOT_FOUND)
+
+    using = router.db_for_write(Locker, pk=locker_id)
+    with transaction.atomic(using=using):
+        status = (
+            Locker.objects.using(using).select_for_update().filter(pk=locker_id)
+            .values_list('status', flat=True).first()
+        )
+        if status is None:
+            return _result('booking', NOT_FOUND)
+        if status == 'maintenance' or overlapping(locker_id, start, end, using=using).exists():
+            return _result('booking', CONFLICT)
+
+        reservation = Reservation.objects.using(using).create(
+            user=user, locker_id=locker_id, start_time=start, end_time=end, status='scheduled'
+        )
+    return _result('booking', RESERVED, reservation)
+
+
+def overlapping(locker_id, start, end, using=None):
+    """Live reservations of ``locker_id`` that intersect ``[start, end)``.
+
+    ``end=None`` means open-ended, as does a stored ``end_time`` of NULL.
+    """
+    queryset = Reservation.objects.using(using).filter(locker_id=locker_id, status__in=LIVE_STATUSES).order_by()
+    if end is not None:
+        queryset = queryset.filter(start_time__lt=end)
+    return queryset.filter(Q(end_time__isnull=True) | Q(end_time__gt=start))
+
+
+def free_lockers(start, end, location=None):
+    """Lockers with no live reservation intersecting ``[start, end)``, as one query."""
+    busy = Reservation.objects.filter(
+        locker=OuterRef('pk'), status__in=LIVE_STATUSES, start_time__lt=end,
+    ).filter(Q(end_time__isnull=True) | Q(end_time__gt=start))
+
+    # Each shard's lockers are checked against its own reservations.
+    queryset = sharded(Locker.objects.exclude(status='maintenance'))
+    if location:
+        queryset = queryset.filter(location=location)
+    return queryset.filter(~Exists(busy))
+
+
+def billed_price(end=None):
+    """SQL expression for a reservation's ``total_price``.
+
+    The locker's hourly rate times the hours from ``start_time`` to ``end``
+    (the stored ``end_time`` by default), rounded to cents. It is evaluated
+    by the database, so a whole batch is billed by a single UPDATE.
+    """
+    if end is None:
+        end = F('end_time')
+    elif not hasattr(end, 'resolve_expression'):
+        end = Value(end, output_field=DateTimeField())
+    rate = Subquery(Locker.objects.filter(pk=OuterRef('locker_id')).values('price_per_hour')[:1])
+    return Round(rate * HoursBetween(F('start_time'), end), 2)
+
+
+def release_reservation(reservation):
+    """Complete an active reservation and free its locker.
+
+    Both transitions are conditional, so releasing twice (or racing an
+    admin status change) is a no-op rather than resurrecting the locker.
+    A booking that has not started yet is cancelled instead.
+    The released reservation is billed up to now.
+    Returns ``True`` if this call performed the release.
+    """
+    using = router.db_for_write(Reservation, instance=reservation)
+    if reservation.status == 'scheduled':
+        if not Reservation.objects.using(using).filter(pk=reservation.pk, status='scheduled').update(status='cancelled'):
+            return False
+        reservation.status = 'cancelled'
+        return True
+
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        released = Reservation.objects.using(using).filter(pk=reservation.pk, status='active').update(
+            status='completed', end_time=now, total_price=billed_price(now)
+        )
+        if not released:
+            return False
+        transition_locker(reservation.locker_id, 'occupied', 'available', now, using=using)
+    reservation.refresh_from_db(fields=['status', 'end_time', 'total_price'])
+    return True
+
+
+def _supports_update_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)
+
+
+def transition_locker(locker_id, from_status, to_status, now, using=None):
+    """Move one locker from ``from_status`` to ``to_status`` if it is still there.
+
+    Returns ``True`` when this call made the transition. Must run inside a
+    transaction so the change signal's side effects commit with it.
+    """
+    using = using or router.db_for_write(Locker, pk=locker_id)
+    connection = connections[using]
+    if not _supports_update_returning(connection):
+        return bool(
+            Locker.objects.using(using).filter(pk=locker_id, status=from_status)
+            .update(status=to_status, updated_at=now)
+        )
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {quote(Locker._meta.db_table)} SET {quote("status")} = %s, {quote("updated_at")} = %s '
+            f'WHERE {quote("id")} = %s AND {quote("status")} = %s RETURNING {quote("location")}',
+            [to_status, connection.ops.adapt_datetimefield_value(now), locker_id, from_status],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return False
+
+    location = row[0]
+    lockers_changed.send(
+        sender=Locker, using=using, instances=None, fields={'status', 'updated_at'},
+        deltas={(location, from_status): -1, (location, to_status): 1},
+    )
+    return True
@@ -0,0 +1,235 @@
+"""
+Revoked JWTs, checked on every request without a query.
+
+Revocations are stored in ``RevokedToken`` (one row per ``jti``, kept until
+the token would have expired anyway) and mirrored in each process by
+``Revocations``: Bloom filters bucketed by the day the token expires, plus
+small exact sets. A token whose ``jti`` misses the filters - almost every
+token - is accepted after a few hash probes. A hit is confirmed against the
+table once and the answer remembered, so a false positive costs one query
+per token per process, not one per request.
+
+Each process pulls rows revoked since its last look at most every
+``TOKEN_REVOCATION_SYNC_SECONDS``; a revocation made in the process itself
+applies immediately. Buckets whose day has passed are dropped whole (a
+Bloom filter cannot forget single entries), and each process's first sync
+of the day deletes the rows of expired tokens (``prune_expired``), so
+neither the table nor the filters it fills grow without bound.
+"""
+import hashlib
+import math
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from ..models import RevokedToken
+
+# Expected revocations per expiry day, and the false-positive rate each
+# filter is sized for; a full filter is followed by one twice the size.
+CAPACITY = 100_000
+ERROR_RATE = 0.001
+# Rows revoked this close to the last sync are read again: ids and
+# timestamps from concurrent transactions do not commit in order.
+SYNC_OVERLAP = timedelta(seconds=60)
+DAY = 86400
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        # One blake2b digest (at most 64 bytes) supplies every probe.
+        self.hashes = min(16, max(1, round(self.bits / capacity * math.log(2))))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+        self._unpack = struct.Struct(f'<{self.hashes}I').unpack
+
+    def _probes(self, key):
+        return self._unpack(hashlib.blake2b(key.encode(), digest_size=4 * self.hashes).digest())
+
+    def add(self, key):
+        array, bits = self.array, self.bits
+        for probe in self._probes(key):
+            probe %= bits
+            array[probe >> 3] |= 1 << (probe & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        array, bits = self.array, self.bits
+        for probe in self._probes(key):
+            probe %= bits
+            if not array[probe >> 3] & (1 << (probe & 7)):
+                return False
+        return True
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class Revocations:
+    """This process's view of ``RevokedToken``."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._buckets = {}  # expiry day -> [BloomFilter, ...]
+        self._revoked = {}  # jti -> expiry day, confirmed against the table
+        self._clear = {}  # jti -> expiry day, confirmed false positives
+        self._synced_at = None
+        self._next_sync = 0
+        self._pruned_day = None
+
+    def add(self, jti, exp):
+        """Record ``jti`` (expiring at epoch ``exp``) as revoked in this process."""
+        day = int(exp) // DAY
+        with self._lock:
+            self._clear.pop(jti, None)
+            filters = self._buckets.setdefault(day, [])
+            # Already present (or a false positive, which the table settles):
+            # re-adding would only fill the filter up. Syncs re-read rows.
+            if any(jti in bloom for bloom in filters):
+                return
+            if not filters or filters[-1].full:
+                filters.append(BloomFilter(self.capacity * 2 ** len(filters)))
+            filters[-1].add(jti)
+
+    def is_revoked(self, jti, exp):
+        if self._sync_due():
+            self.sync()
+        revoked = self._check(jti, exp)
+        return self._confirm(jti, exp) if revoked is None else revoked
+
+    async def ais_revoked(self, jti, exp):
+        """``is_revoked`` for async callers; only a sync or a confirmation leaves the loop."""
+        if self._sync_due():
+            await sync_to_async(self.sync)()
+        revoked = self._check(jti, exp)
+        return await sync_to_async(self._confirm)(jti, exp) if revoked is None else revoked
+
+    def _check(self, jti, exp):
+        """False or True from memory alone; None when the table has to decide."""
+        for bloom in self._buckets.get(int(exp) // DAY, ()):
+            if jti in bloom:
+                break
+        else:
+            return False
+        if jti in self._revoked:
+            return True
+        if jti in self._clear:
+            return False
+        return None
+
+    def _confirm(self, jti, exp):
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        (self._revoked if revoked else self._clear)[jti] = int(exp) // DAY
+        return revoked
+
+    def _sync_due(self):
+        return time.monotonic() >= self._next_sync
+
+    def sync(self, force=False):
+        """Load revocations made since the last sync (by other processes too)."""
+        if not force and not self._sync_due():
+            return 0
+        self._next_sync = time.monotonic() + settings.TOKEN_REVOCATION_SYNC_SECONDS
+        now = timezone.now()
+        self._expire(now)
+        today = int(now.timestamp()) // DAY
+        if self._pruned_day != today:
+            self._pruned_day = today
+            prune_expired(now)
+        rows = RevokedToken.objects.filter(expires_at__gt=now)
+        if self._synced_at is None:
+            loaded = self._load(rows, now)
+        else:
+            loaded = 0
+            recent = rows.filter(revoked_at__gte=self._synced_at - SYNC_OVERLAP)
+            for jti, expires_at in recent.values_list('jti', 'expires_at'):
+                self.add(jti, expires_at.timestamp())
+                loaded += 1
+        self._synced_at = now
+        return loaded
+
+    def _load(self, rows, now):
+        """First sync: fill one right-sized filter per expiry day.
+
+        Reading a day at a time needs no per-row datetime, and a fresh filter
+        no duplicate checks. Gunicorn workers run this before serving (see
+        ``gunicorn.conf.py``), so no request waits for it.
+        """
+        last = rows.aggregate(last=Max('expires_at'))['last']
+        if last is None:
+            return 0
+        loaded = 0
+        for day in range(int(now.timestamp()) // DAY, int(last.timestamp()) // DAY + 1):
+            start = datetime.fromtimestamp(day * DAY, dt_timezone.utc)
+            jtis = list(
+                rows.filter(expires_at__gte=start, expires_at__lt=start + timedelta(days=1))
+                .values_list('jti', flat=True).iterator(chunk_size=10_000)
+            )
+            bloom = BloomFilter(max(self.capacity, len(jtis)))
+            for jti in jtis:
+                bloom.add(jti)
+            with self._lock:
+                self._buckets.setdefault(day, []).append(bloom)
+            loaded += len(jtis)
+        return loaded
+
+    def _expire(self, now):
+        today = int(now.timestamp()) // DAY
+        with self._lock:
+            for day in [day for day in self._buckets if day < today]:
+                del self._buckets[day]
+            for confirmed in (self._revoked, self._clear):
+                for jti in [jti for jti, day in confirmed.items() if day < today]:
+                    del confirmed[jti]
+
+    def memory(self):
+        """Bytes held by the Bloom filters."""
+        return sum(len(bloom.array) for filters in self._buckets.values() for bloom in filters)
+
+
+revocations = Revocations()
+
+
+def is_revoked(token):
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    return jti is not None and revocations.is_revoked(jti, token['exp'])
+
+
+async def ais_revoked(token):
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    return jti is not None and await revocations.ais_revoked(jti, token['exp'])
+
+
+def revoke(token):
+    """Revoke a validated token until it expires. Returns False if it already was."""
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    expires_at = datetime.fromtimestamp(token['exp'], dt_timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        created = True
+    except IntegrityError:
+        created = False
+    revocations.add(jti, token['exp'])
+    return created
+
+
+def prune_expired(now=None, using=None):
+    """Delete rows for tokens that have expired; they can no longer be presented."""
+    deleted, _ = RevokedToken.objects.using(using).filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
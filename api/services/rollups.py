@@ -0,0 +1,417 @@
+"""
+Hourly and daily reservation rollups.
+
+``LockerRollup`` and ``LocationRollup`` hold, for every locker and every
+location, the reservations started, the seconds occupied and the revenue
+(``total_price`` of the reservations completed) in each hour and day, UTC.
+A pass (``roll_up``) reads only the reservations, live or archived, changed
+since the database's ``RollupWatermark``, in ``(updated_at, id)`` order
+along the ``reservation_changes`` index, one transaction per batch. Changes
+are read up to ``ROLLUP_SETTLE_SECONDS`` ago, so a transaction that stamped
+its rows just before a pass and commits after it is not skipped.
+
+A finished (completed or cancelled) reservation is added once. An
+unfinished one is also kept in ``RollupOpenReservation`` as it was counted:
+when it changes, that contribution is taken back out before the new one
+goes in, and every pass extends the occupancy of the ones still running up
+to the new watermark. The tables therefore match a full recount as of the
+watermark (``rebuild`` does one), as long as finished reservations are not
+edited afterwards. Times are cut to whole seconds, so occupancy counted
+piece by piece adds up to the same integer as counted at once.
+
+``report`` answers range queries from the rollup tables alone.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from myapp.sharding import gather, shard_databases, sharded
+
+from ..models import (
+    ArchivedReservation, LocationRollup, LockerRollup, Reservation, RollupOpenReservation, RollupWatermark,
+)
+from .export import parse_bound
+from .stats import fleet_stats
+
+BATCH_SIZE = 1000
+MAX_BATCHES = 100
+# Rollup rows per statement; three ``IN`` lists of this many keys stay under
+# SQLite's 999 parameters on the fallback path.
+WRITE_BATCH = 300
+WATERMARK = 'reservations'
+FINISHED = ('completed', 'cancelled')
+PERIODS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# Buckets shown when the range is left open, and the most one query may ask for.
+DEFAULT_BUCKETS = {'hour': 24, 'day': 30}
+MAX_BUCKETS = 2000
+CENT = Decimal('0.01')
+
+# (id, locker_id, location, start_time, end_time, total_price, status, <position>)
+_CHANGED = ('id', 'locker_id', 'locker__location', 'start_time', 'end_time', 'total_price', 'status', 'updated_at')
+_OPEN = ('id', 'locker_id', 'location', 'start_time', 'end_time', 'total_price', 'status', 'counted_until')
+_COUNTERS = ('reservations', 'occupied_seconds', 'revenue')
+
+
+def _zero():
+    return [0, 0, Decimal(0)]
+
+
+def _second(value):
+    return value.replace(microsecond=0)
+
+
+def _truncate(value, period):
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if period == 'day' else value
+
+
+def _hours(start, stop):
+    """``(hour, seconds)`` for every hour ``[start, stop)`` covers."""
+    hour = _truncate(start, 'hour')
+    while hour < stop:
+        following = hour + PERIODS['hour']
+        yield hour, int((min(stop, following) - max(start, hour)).total_seconds())
+        hour = following
+
+
+def _contribute(deltas, row, until, since=None, sign=1):
+    """Add what ``row`` counts for up to ``until`` (only from ``since``, if given), times ``sign``.
+
+    ``deltas`` maps ``(hour, locker_id, location)`` to reservations, seconds
+    and revenue. A reservation counts as started in the hour of its
+    ``start_time``, occupies its locker from then until its ``end_time``
+    (no later than ``until`` while unfinished) and earns its ``total_price`` in the hour it ends.
+    """
+    _, locker_id, location, start, end, price, status = row[:7]
+    if status == 'cancelled':
+        return
+    start, until = _second(start), _second(until)
+    since = start if since is None else max(start, _second(since))
+    # A finished reservation is counted once, in full; a running one up to ``until``.
+    stop = until if end is None else _second(end) if status in FINISHED else min(_second(end), until)
+
+    if since == start and start < until:
+        deltas[(_truncate(start, 'hour'), locker_id, location)][0] += sign
+    for hour, seconds in _hours(since, stop):
+        deltas[(hour, locker_id, location)][1] += sign * seconds
+    if since == start and status == 'completed' and price is not None:
+        deltas[(_truncate(end or start, 'hour'), locker_id, location)][2] += sign * price
+
+
+def _upsert(model, key_fields, deltas, using, attrs=None):
+    """Add ``deltas`` (``{key: [reservations, seconds, revenue]}``) to ``model``'s rows.
+
+    PostgreSQL and SQLite take each batch as one ``INSERT ... ON CONFLICT DO
+    UPDATE``, adding to the stored counters in place; other backends read the
+    rows and write them back.
+    """
+    keys = [key for key, values in deltas.items() if any(values)]
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return _merge(model, key_fields, keys, deltas, using, attrs)
+    ops, quote = connection.ops, connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    extra = ['location'] if attrs else []
+    columns = [model._meta.get_field(name).column for name in (*key_fields, *extra, *_COUNTERS)]
+    bucket = key_fields.index('bucket')
+    updates = [f'{quote(c)} = {table}.{quote(c)} + EXCLUDED.{quote(c)}' for c in _COUNTERS]
+    updates += [f'{quote(c)} = EXCLUDED.{quote(c)}' for c in extra]
+    conflict = ', '.join(quote(model._meta.get_field(name).column) for name in key_fields)
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(c) for c in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))}) '
+        f'ON CONFLICT ({conflict}) DO UPDATE SET {", ".join(updates)}'
+    )
+    params = []
+    for key in keys:
+        values = list(key)
+        values[bucket] = ops.adapt_datetimefield_value(values[bucket])
+        values += [attrs[key][name] for name in extra]
+        reservations, seconds, revenue = deltas[key]
+        params.append([*values, reservations, seconds, ops.adapt_decimalfield_value(revenue, 14, 2)])
+    with connection.cursor() as cursor:
+        for start in range(0, len(params), WRITE_BATCH):
+            cursor.executemany(sql, params[start:start + WRITE_BATCH])
+
+
+def _merge(model, key_fields, keys, deltas, using, attrs=None):
+    rows = model.objects.using(using)
+    changed, created = [], []
+    for start in range(0, len(keys), WRITE_BATCH):
+        chunk = keys[start:start + WRITE_BATCH]
+        lookup = {f'{field}__in': {key[i] for key in chunk} for i, field in enumerate(key_fields)}
+        existing = {tuple(getattr(row, field) for field in key_fields): row for row in rows.filter(**lookup)}
+        for key in chunk:
+            row = existing.get(key)
+            if row is None:
+                row = model(**dict(zip(key_fields, key)))
+                created.append(row)
+            else:
+                changed.append(row)
+            n, seconds, revenue = deltas[key]
+            row.reservations += n
+            row.occupied_seconds += seconds
+            row.revenue += revenue
+            for name, value in (attrs or {}).get(key, {}).items():
+                setattr(row, name, value)
+    fields = [*_COUNTERS, *(['location'] if attrs else [])]
+    rows.bulk_update(changed, fields, batch_size=WRITE_BATCH)
+    rows.bulk_create(created, batch_size=WRITE_BATCH)
+
+
+def _write(deltas, using):
+    """Fold hourly ``_contribute`` deltas into the hour and day rows of both tables."""
+    by_locker, by_location, attrs = defaultdict(_zero), defaultdict(_zero), {}
+    for (hour, locker_id, location), values in deltas.items():
+        for period in PERIODS:
+            bucket = _truncate(hour, period)
+            for totals in (by_locker[(period, bucket, locker_id)], by_location[(period, bucket, location)]):
+                for i, value in enumerate(values):
+                    totals[i] += value
+            attrs[(period, bucket, locker_id)] = {'location': location}
+    _upsert(LockerRollup, ('period', 'bucket', 'locker_id'), by_locker, using, attrs)
+    _upsert(LocationRollup, ('period', 'bucket', 'location'), by_location, using)
+
+
+def _watermark(using):
+    """This database's watermark, locked until the end of the transaction."""
+    mark, _ = RollupWatermark.objects.using(using).select_for_update().get_or_create(name=WATERMARK)
+    return mark
+
+
+def _changed(mark, target, batch_size, using):
+    """The next ``batch_size`` reservations changed after ``mark`` and no later than ``target``."""
+    after = Q()
+    if mark.changed_at is not None:
+        # The leading ``>=`` bounds the index range scan; an OR alone would not.
+        after = Q(updated_at__gte=mark.changed_at) & (Q(updated_at__gt=mark.changed_at) | Q(id__gt=mark.last_id))
+    rows = []
+    for model in (Reservation, ArchivedReservation):
+        rows += (
+            model.objects.using(using).filter(after, updated_at__lte=target)
+            .order_by('updated_at', 'id').values_list(*_CHANGED)[:batch_size]
+        )
+    # A reservation archived between the two reads is in both; it is the same row.
+    rows = sorted({row[0]: row for row in rows}.values(), key=lambda row: (row[-1], row[0]))
+    return rows[:batch_size]
+
+
+def _apply_changes(rows, target, using):
+    opened = RollupOpenReservation.objects.using(using)
+    counted = {row[0]: row for row in opened.filter(pk__in=[row[0] for row in rows]).values_list(*_OPEN)}
+    deltas = defaultdict(_zero)
+    still_open = []
+    for row in rows:
+        before = counted.get(row[0])
+        if before is not None:
+            _contribute(deltas, before, before[-1], sign=-1)
+        _contribute(deltas, row, target)
+        if row[6] not in FINISHED:
+            still_open.append(RollupOpenReservation(**dict(zip(_OPEN, (*row[:7], target)))))
+    _write(deltas, using)
+
+    finished = [row[0] for row in rows if row[6] in FINISHED and row[0] in counted]
+    if finished:
+        opened.filter(pk__in=finished).delete()
+    opened.bulk_create(
+        still_open, batch_size=WRITE_BATCH, update_conflicts=True, unique_fields=['id'],
+        update_fields=[name for name in _OPEN if name != 'id'],
+    )
+
+
+def _extend_open(target, using):
+    """Count the reservations still running up to ``target``; returns how many there were."""
+    opened = RollupOpenReservation.objects.using(using).filter(counted_until__lt=target)
+    rows = list(opened.values_list(*_OPEN))
+    if not rows:
+        return 0
+    # Reservations deleted with their user or locker keep what they were counted for so far.
+    live = set()
+    for start in range(0, len(rows), WRITE_BATCH):
+        ids = [row[0] for row in rows[start:start + WRITE_BATCH]]
+        live.update(Reservation.objects.using(using).filter(pk__in=ids).values_list('pk', flat=True))
+    gone = [row[0] for row in rows if row[0] not in live]
+    if gone:
+        RollupOpenReservation.objects.using(using).filter(pk__in=gone).delete()
+        rows = [row for row in rows if row[0] in live]
+    deltas = defaultdict(_zero)
+    for row in rows:
+        _contribute(deltas, row, target, since=row[-1])
+    _write(deltas, using)
+    opened.update(counted_until=target)
+    return len(rows)
+
+
+def roll_up(now=None, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES, using=None):
+    """Run one rollup pass and return its metrics.
+
+    At most ``max_batches`` batches of changes are processed; ``backlog`` in
+    the result says whether some were left for the next pass, in which case
+    the running reservations are extended by that pass instead.
+    """
+    target = (now or timezone.now()) - timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+    started = time.perf_counter()
+    metrics = {'changed': 0, 'extended': 0, 'batches': 0, 'backlog': False}
+
+    for _ in range(max_batches):
+        with transaction.atomic(using=using):
+            mark = _watermark(using)
+            rows = _changed(mark, target, batch_size, using)
+            if rows:
+                _apply_changes(rows, target, using)
+                mark.changed_at, mark.last_id = rows[-1][-1], rows[-1][0]
+                mark.save(using=using, update_fields=['changed_at', 'last_id'])
+        metrics['changed'] += len(rows)
+        metrics['batches'] += 1
+        if len(rows) < batch_size:
+            break
+    else:
+        metrics['backlog'] = True
+
+    with transaction.atomic(using=using):
+        mark = _watermark(using)
+        if not metrics['backlog']:
+            metrics['extended'] = _extend_open(target, using)
+            if mark.through is None or mark.through < target:
+                mark.through = target
+                mark.save(using=using, update_fields=['through'])
+    metrics['through'] = mark.through.isoformat() if mark.through else None
+    metrics['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return metrics
+
+
+def rebuild(using=None):
+    """Empty the rollups and rewind the watermark; the next passes recount everything."""
+    with transaction.atomic(using=using):
+        mark = _watermark(using)
+        for model in (LockerRollup, LocationRollup, RollupOpenReservation):
+            model.objects.using(using).all().delete()
+        mark.changed_at, mark.last_id, mark.through = None, 0, None
+        mark.save(using=using)
+
+
+def parse_query(params):
+    """Validate ``period``, ``from``, ``to``, ``location`` and ``locker`` for ``report``.
+
+    The range is widened to whole buckets; left open, it covers the last
+    ``DEFAULT_BUCKETS`` buckets up to the current one.
+    """
+    period = params.get('period') or 'hour'
+    if period not in PERIODS:
+        raise ValidationError({'period': f'Expected one of {", ".join(PERIODS)}, got {period!r}'})
+    step = PERIODS[period]
+    end = parse_bound(params.get('to'), 'to', end=True) or _truncate(timezone.now(), period) + step
+    start = parse_bound(params.get('from'), 'from') or end - DEFAULT_BUCKETS[period] * step
+    start = _truncate(start, period)
+    if _truncate(end, period) != end:
+        end = _truncate(end, period) + step
+    if start >= end:
+        raise ValidationError({'to': 'Must be after from'})
+    if (end - start) / step > MAX_BUCKETS:
+        raise ValidationError({'to': f'At most {MAX_BUCKETS} {period}s per query'})
+
+    locker = params.get('locker') or None
+    if locker is not None:
+        try:
+            locker = int(locker)
+        except ValueError:
+            raise ValidationError({'locker': 'Must be an integer id'})
+    return {'period': period, 'start': start, 'end': end, 'location': params.get('location') or None, 'locker': locker}
+
+
+def watermark():
+    """The time up to which every database's rollups are complete, or None."""
+    marks = gather(
+        lambda using: RollupWatermark.objects.using(using).filter(name=WATERMARK).values_list('through', flat=True).first(),
+        shard_databases(),
+    )
+    return None if None in marks else min(marks)
+
+
+def _rollups(period, start, end, location, locker):
+    if locker is not None:
+        queryset = sharded(LockerRollup.objects.all()).filter(locker_id=locker)
+    else:
+        queryset = sharded(LocationRollup.objects.all())
+        if location is not None:
+            queryset = queryset.filter(location=location)
+    return queryset.filter(period=period, bucket__gte=start, bucket__lt=end)
+
+
+def _sums(queryset, field):
+    """``{value of field: [reservations, seconds, revenue]}``, summed by the database(s)."""
+    sums = defaultdict(_zero)
+    rows = queryset.order_by().values_list(field).annotate(*(Sum(name) for name in _COUNTERS))
+    # Under sharding each shard sums its own rows; a value can come back once per shard.
+    for value, *counters in rows:
+        for i, counter in enumerate(counters):
+            sums[value][i] += counter
+    return sums
+
+
+def _capacity(location, locker):
+    """Lockers the occupancy is measured against: the current count in scope."""
+    if locker is not None:
+        return 1
+    stats = fleet_stats()
+    if location is None:
+        return stats['total_lockers']
+    return stats['by_location'].get(location, {}).get('total', 0)
+
+
+def _summary(start, length, counters, lockers, through):
+    reservations, seconds, revenue = counters
+    # Occupancy of the time rolled up so far, not of the whole bucket.
+    elapsed = length if through is None else min(max((through - start).total_seconds(), 0), length)
+    capacity = lockers * elapsed
+    return {
+        'reservations': reservations,
+        'occupied_hours': round(seconds / 3600, 2),
+        'occupancy': round(seconds / capacity, 4) if capacity else None,
+        'revenue': str(revenue.quantize(CENT)),
+    }
+
+
+def report(period, start, end, location=None, locker=None):
+    """Reservations, occupancy and revenue per bucket of ``[start, end)``, with totals."""
+    step = PERIODS[period]
+    through = watermark()
+    rollups = _rollups(period, start, end, location, locker)
+    buckets = _sums(rollups, 'bucket')
+
+    lockers = _capacity(location, locker)
+    series = []
+    bucket = start
+    while bucket < end:
+        series.append({'start': bucket.isoformat(), **_summary(bucket, step.total_seconds(), buckets[bucket], lockers, through)})
+        bucket += step
+    totals = [sum(values[i] for values in buckets.values()) for i in range(len(_COUNTERS))]
+    result = {
+        'period': period,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'location': location,
+        'locker': locker,
+        'lockers': lockers,
+        'through': through.isoformat() if through else None,
+        'totals': _summary(start, (end - start).total_seconds(), [totals[0], totals[1], Decimal(totals[2])], lockers, through),
+        'buckets': series,
+    }
+    if location is None and locker is None:
+        by_location = _sums(rollups, 'location')
+        result['by_location'] = {
+            name: {
+                'reservations': values[0],
+                'occupied_hours': round(values[1] / 3600, 2),
+                'revenue': str(values[2].quantize(CENT)),
+            }
+            for name, values in sorted(by_location.items())
+        }
+    return result
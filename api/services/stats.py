@@ -0,0 +1,117 @@
+"""
+Fleet statistics backed by ``LockerStatusCount``.
+
+Every locker write path reports how many lockers entered or left each
+``(location, status)`` bucket (see ``api.signals``); ``apply_deltas`` folds
+those into the counter table inside the writer's transaction. Reading the
+stats is then a scan of one row per bucket instead of COUNTs over
+``lockers``. ``reconcile`` recomputes the buckets with a single GROUP BY
+and repairs any drift.
+
+Under location sharding each shard counts its own lockers, and the fleet
+totals gather every shard's counter rows in parallel.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from myapp.sharding import gather
+
+from ..models import Locker, LockerStatusCount
+
+STATUSES = [value for value, _ in Locker.STATUS_CHOICES]
+
+
+def apply_deltas(deltas, using=None):
+    """Add ``{(location, status): n}`` to the counters."""
+    counts = LockerStatusCount.objects.using(using)
+    with transaction.atomic(using=using, savepoint=False):
+        for (location, status), n in sorted(deltas.items()):
+            if counts.filter(location=location, status=status).update(count=F('count') + n):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    counts.create(location=location, status=status, count=n)
+            except IntegrityError:
+                counts.filter(location=location, status=status).update(count=F('count') + n)
+
+
+def aggregate_counts(using=None):
+    """Recount every bucket from ``lockers`` with one GROUP BY."""
+    rows = (
+        Locker.objects.using(using).order_by()
+        .values_list('location', 'status').annotate(n=Count('id'))
+    )
+    return {(location, status): n for location, status, n in rows}
+
+
+def _counter_rows(using=None):
+    return LockerStatusCount.objects.using(using).filter(count__gt=0).values_list('location', 'status', 'count')
+
+
+def fleet_stats(using=None):
+    """Totals and a per-location breakdown, read from the counter table."""
+    if using is None and settings.DATABASE_SHARDS:
+        shards = gather(lambda alias: list(_counter_rows(alias)), settings.DATABASE_SHARDS)
+        return _summarize(row for rows in shards for row in rows)
+    return _summarize(_counter_rows(using))
+
+
+async def afleet_stats(using=None):
+    """Async ``fleet_stats``."""
+    if using is None and settings.DATABASE_SHARDS:
+        return await sync_to_async(fleet_stats)()
+    return _summarize([row async for row in _counter_rows(using)])
+
+
+def _summarize(rows):
+    totals = dict.fromkeys(STATUSES, 0)
+    by_location = {}
+    for location, status, count in rows:
+        totals[status] = totals.get(status, 0) + count
+        entry = by_location.setdefault(location, dict.fromkeys(STATUSES, 0))
+        entry[status] = entry.get(status, 0) + count
+
+    for entry in by_location.values():
+        entry['total'] = sum(entry.values())
+
+    return {
+        'total_lockers': sum(totals.values()),
+        'available_lockers': totals['available'],
+        'occupied_lockers': totals['occupied'],
+        'maintenance_lockers': totals['maintenance'],
+        'by_location': dict(sorted(by_location.items())),
+    }
+
+
+def reconcile(repair=True, using=None):
+    """Compare the counters with a full aggregate.
+
+    Returns a list of ``(location, status, counted, actual)`` for every
+    bucket that disagrees. With ``repair`` the counters are overwritten with
+    the aggregate in the same transaction, under a lock on the counter rows
+    so concurrent writers queue behind the repair rather than racing it.
+    """
+    with transaction.atomic(using=using):
+        stored = {
+            (location, status): count
+            for location, status, count in LockerStatusCount.objects.using(using)
+            .select_for_update().values_list('location', 'status', 'count')
+        }
+        actual = aggregate_counts(using=using)
+
+        drift = []
+        for key in sorted(set(stored) | set(actual)):
+            counted, real = stored.get(key, 0), actual.get(key, 0)
+            if counted != real:
+                drift.append((key[0], key[1], counted, real))
+
+        if repair:
+            counts = LockerStatusCount.objects.using(using)
+            for location, status, _, real in drift:
+                if real:
+                    counts.update_or_create(location=location, status=status, defaults={'count': real})
+                else:
+                    counts.filter(location=location, status=status).delete()
+    return drift
@@ -0,0 +1,126 @@
+"""
+Reservation expiry and billing sweeper.
+
+Each pass works in bounded batches, oldest first, using the
+``(status, end_time)`` and ``(status, start_time)`` indexes:
+
+* live reservations whose ``end_time`` has passed become ``completed``,
+  are billed with one set-based UPDATE (``billed_price``) and, if they were
+  active and no other reservation now holds the locker, their lockers go
+  back to ``available``;
+* scheduled bookings whose window has opened become ``active`` and their
+  lockers ``occupied``.
+
+Expiry runs first so that a booking starting where the previous one ends
+takes the locker over within the same pass.
+
+Every batch is its own short transaction. The batch rows are locked with
+``SKIP LOCKED`` where supported, so several sweepers (or a sweeper and a
+manual release) never block each other or process the same row twice.
+Locker flips go through ``LockerQuerySet.update`` and therefore keep the
+status counters, change version and live stream in step.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from ..models import Locker, Reservation
+from .reservations import LIVE_STATUSES, billed_price
+
+BATCH_SIZE = 500
+MAX_BATCHES = 20
+
+
+def _locked_batch(queryset, ordering, batch_size):
+    return list(
+        queryset.select_for_update(skip_locked=True).order_by(ordering)
+        .values_list('pk', 'locker_id', 'status')[:batch_size]
+    )
+
+
+def activate_batch(now, batch_size=BATCH_SIZE, using=None):
+    """Start up to ``batch_size`` due bookings. Returns the number started."""
+    with transaction.atomic(using=using):
+        rows = _locked_batch(
+            Reservation.objects.using(using)
+            .filter(status='scheduled', start_time__lte=now)
+            .filter(Q(end_time__isnull=True) | Q(end_time__gt=now)),
+            'start_time', batch_size,
+        )
+        if not rows:
+            return 0
+        Reservation.objects.using(using).filter(pk__in=[pk for pk, _, _ in rows]).update(status='active')
+        Locker.objects.using(using).filter(
+            pk__in={locker_id for _, locker_id, _ in rows}, status='available'
+        ).update(status='occupied', updated_at=now)
+    return len(rows)
+
+
+def expire_batch(now, batch_size=BATCH_SIZE, using=None):
+    """Complete and bill up to ``batch_size`` overdue reservations.
+
+    Returns ``(expired, freed)``: reservations completed and lockers released.
+    """
+    with transaction.atomic(using=using):
+        rows = _locked_batch(
+            Reservation.objects.using(using).filter(status__in=LIVE_STATUSES, end_time__lte=now),
+            'end_time', batch_size,
+        )
+        if not rows:
+            return 0, 0
+        Reservation.objects.using(using).filter(pk__in=[pk for pk, _, _ in rows]).update(
+            status='completed', total_price=billed_price()
+        )
+        # Bookings that expired before they were ever activated never held
+        # the locker, so only active ones give it back, and only if no other
+        # reservation has become active on it since.
+        held = {locker_id for _, locker_id, state in rows if state == 'active'}
+        freed = 0
+        if held:
+            still_held = Reservation.objects.using(using).filter(locker=OuterRef('pk'), status='active')
+            freed = Locker.objects.using(using).filter(
+                ~Exists(still_held), pk__in=held, status='occupied'
+            ).update(status='available', updated_at=now)
+    return len(rows), freed
+
+
+def sweep(now=None, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES, using=None):
+    """Run one sweeper pass and return its metrics.
+
+    At most ``max_batches`` batches of each kind are processed; ``backlog``
+    in the result says whether work was left for the next pass.
+    """
+    now = now or timezone.now()
+    started = time.perf_counter()
+    oldest = (
+        Reservation.objects.using(using).filter(status='active', end_time__lte=now)
+        .order_by('end_time').values_list('end_time', flat=True).first()
+    )
+    metrics = {
+        'activated': 0, 'expired': 0, 'freed': 0, 'batches': 0, 'backlog': False,
+        'lag_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+    for _ in range(max_batches):
+        expired, freed = expire_batch(now, batch_size, using=using)
+        metrics['expired'] += expired
+        metrics['freed'] += freed
+        metrics['batches'] += 1
+        if expired < batch_size:
+            break
+    else:
+        metrics['backlog'] = True
+
+    for _ in range(max_batches):
+        activated = activate_batch(now, batch_size, using=using)
+        metrics['activated'] += activated
+        metrics['batches'] += 1
+        if activated < batch_size:
+            break
+    else:
+        metrics['backlog'] = True
+
+    metrics['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return metrics
@@ -0,0 +1,181 @@
+"""
+Keeping password hashing from taking over the workers.
+
+Every login or registration runs one deliberately slow password hash, so a
+credential-stuffing burst can occupy every worker. Two guards sit in front
+of it:
+
+* token buckets per client IP and per username (``LOGIN_THROTTLE``), checked
+  before ``authenticate()`` so a refused attempt costs no hash. Buckets live
+  in process memory, or in the cache named by ``LOGIN_THROTTLE['CACHE']``
+  to share them between processes (approximately: concurrent updates of one
+  bucket can let an extra attempt through);
+* a host-wide gate, ``hashing_slot``, letting at most
+  ``PASSWORD_HASH_SLOTS`` hashes run at once across all worker processes
+  (one lock file per slot). Requests that cannot get a slot within
+  ``PASSWORD_HASH_WAIT_SECONDS`` are refused with 503, and the other workers
+  stay free for the rest of the API.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows: the gate is then per process.
+    fcntl = None
+
+MAX_LOCAL_BUCKETS = 100_000
+POLL_SECONDS = 0.01
+
+
+class HashingBusy(Exception):
+    """No password-hashing slot became free in time."""
+
+
+class TokenBucket:
+    """``rate`` attempts per second on average, in bursts of up to ``burst``."""
+
+    def __init__(self, name, rate, burst, cache_alias=None):
+        self.name, self.rate, self.burst = name, rate, burst
+        self.cache = caches[cache_alias] if cache_alias else None
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Spend one token for ``key``; returns 0, or the seconds until one is available."""
+        now = time.time()
+        if self.cache is None:
+            with self._lock:
+                wait = self._spend(self._local.pop(key, None), now, lambda state: self._remember(key, state))
+        else:
+            cache_key = f'throttle:{self.name}:{hashlib.sha1(key.encode()).hexdigest()}'
+            timeout = int(self.burst / self.rate) + 1
+            wait = self._spend(self.cache.get(cache_key), now,
+                               lambda state: self.cache.set(cache_key, state, timeout))
+        return wait
+
+    def _spend(self, state, now, store):
+        tokens, stamp = state or (self.burst, now)
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        if tokens < 1:
+            store((tokens, now))
+            return (1 - tokens) / self.rate
+        store((tokens - 1, now))
+        return 0
+
+    def _remember(self, key, state):
+        self._local[key] = state
+        while len(self._local) > MAX_LOCAL_BUCKETS:
+            self._local.popitem(last=False)
+
+
+_buckets = {}
+_ident = BaseThrottle()
+
+
+def _bucket(name):
+    bucket = _buckets.get(name)
+    if bucket is None:
+        config = settings.LOGIN_THROTTLE
+        bucket = _buckets[name] = TokenBucket(
+            name, config[f'{name.upper()}_RATE'], config[f'{name.upper()}_BURST'], config['CACHE'],
+        )
+    return bucket
+
+
+def login_retry_after(request, username=None):
+    """Charge an attempt to the client IP and ``username``; returns 0 or seconds to wait.
+
+    The username bucket is only charged when the IP is allowed, so one noisy
+    address cannot lock a user out on its own.
+    """
+    wait = _bucket('ip').take(_ident.get_ident(request))
+    if not wait and username:
+        wait = _bucket('username').take(username.lower())
+    return wait
+
+
+class _HashGate:
+    def __init__(self, slots, directory):
+        self.slots = slots
+        self.paths = [os.path.join(directory, f'slot-{i}.lock') for i in range(slots)]
+        self._semaphore = threading.BoundedSemaphore(slots)
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _try_acquire(self):
+        if fcntl is None:
+            return self if self._semaphore.acquire(blocking=False) else None
+        # Start at a random slot so waiting processes do not all probe slot 0.
+        start = random.randrange(self.slots)
+        for i in range(self.slots):
+            fd = os.open(self.paths[(start + i) % self.slots], os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _release(self, held):
+        if fcntl is None:
+            self._semaphore.release()
+        else:
+            fcntl.flock(held, fcntl.LOCK_UN)
+            os.close(held)
+
+    @contextmanager
+    def slot(self, wait):
+        deadline = time.monotonic() + wait
+        held = self._try_acquire()
+        while held is None:
+            if time.monotonic() >= deadline:
+                raise HashingBusy()
+            time.sleep(POLL_SECONDS)
+            held = self._try_acquire()
+        try:
+            yield
+        finally:
+            self._release(held)
+
+    @contextmanager
+    def batch(self, wanted, wait):
+        """One slot, waited for as by ``slot``, plus up to ``wanted - 1`` that are free now."""
+        with self.slot(wait):
+            extra = []
+            try:
+                while len(extra) + 1 < wanted and (held := self._try_acquire()) is not None:
+                    extra.append(held)
+                yield len(extra) + 1
+            finally:
+                for held in extra:
+                    self._release(held)
+
+
+_gate = None
+
+
+def _hash_gate():
+    global _gate
+    if _gate is None:
+        _gate = _HashGate(settings.PASSWORD_HASH_SLOTS, settings.PASSWORD_HASH_LOCK_DIR)
+    return _gate
+
+
+def hashing_slot():
+    """Context manager around password hashing; raises ``HashingBusy`` when the host is saturated."""
+    return _hash_gate().slot(settings.PASSWORD_HASH_WAIT_SECONDS)
+
+
+def hashing_slots(wanted):
+    """``hashing_slot`` for a batch hashed in parallel: yields how many slots (1 to ``wanted``) it holds."""
+    return _hash_gate().batch(wanted, settings.PASSWORD_HASH_WAIT_SECONDS)
@@ -0,0 +1,186 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows are validated one by one with ``UserRegistrationSerializer`` (the
+checks ``register_user`` makes), minus its per-row uniqueness query. The
+surviving usernames and emails are then checked against the table in one
+set-based query, each list passed as a single array parameter (PostgreSQL
+``= ANY``, SQLite ``json_each``) instead of a placeholder per value.
+Passwords are hashed across a process pool (``hash_passwords``) and the users written with
+``bulk_create``, one transaction per batch; a batch that fails is retried
+row by row. Every row gets a result entry, so a bad row is reported and the
+rest are imported.
+
+With ``gated``, as for the endpoint, the pool only runs as many processes
+as it gets ``api.services.throttle`` hashing slots, and ``HashingBusy`` is
+raised when none is free.
+"""
+import csv
+import json
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueValidator
+
+from ..hashers import hash_passwords, pool_size
+from ..serializers import UserRegistrationSerializer
+from .throttle import hashing_slots
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+BATCH_SIZE = 1000
+DUPLICATE_USERNAME = 'A user with that username already exists.'
+DUPLICATE_EMAIL = 'A user with that email already exists.'
+NOT_SAVED = 'The user could not be saved.'
+
+
+def read_rows(lines, fmt):
+    """Yield ``(line, row, errors)`` for each record of a CSV or NDJSON file.
+
+    ``row`` is a dict of the record's fields, or None when the line could not
+    be parsed (``errors`` says why). CSV files need a header row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, None, {'non_field_errors': ['More fields than the header has.']}
+            else:
+                # Short rows leave the missing trailing fields as None: absent.
+                yield reader.line_num, {k: v for k, v in row.items() if v is not None}, None
+        return
+    for line, text in enumerate(lines, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, None, {'non_field_errors': [f'Invalid JSON: {e}']}
+            continue
+        if isinstance(row, dict):
+            yield line, row, None
+        else:
+            yield line, None, {'non_field_errors': ['Expected a JSON object.']}
+
+
+def _row_validator():
+    """A ``UserRegistrationSerializer`` with the per-row username lookup removed."""
+    serializer = UserRegistrationSerializer()
+    field = serializer.fields['username']
+    field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+    return serializer
+
+
+def _error(line, errors):
+    return {'line': line, 'status': 'error', 'errors': errors}
+
+
+def _taken(usernames, emails, using):
+    """The usernames and emails, among those given, that already belong to a user."""
+    connection = connections[using]
+    table = connection.ops.quote_name(User._meta.db_table)
+    if connection.vendor == 'postgresql':
+        where, params = 'username = ANY(%s) OR email = ANY(%s)', [list(usernames), list(emails)]
+    elif connection.vendor == 'sqlite':
+        where = 'username IN (SELECT value FROM json_each(%s)) OR email IN (SELECT value FROM json_each(%s))'
+        params = [json.dumps(list(usernames)), json.dumps(list(emails))]
+    else:
+        where = None
+    if where is None:
+        rows = User.objects.using(using).filter(
+            Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list('username', 'email')
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT username, email FROM {table} WHERE {where}', params)
+            rows = cursor.fetchall()
+    usernames, emails = set(usernames), set(emails)
+    return {u for u, _ in rows if u in usernames}, {e for _, e in rows if e in emails}
+
+
+def import_users(rows, workers=None, iterations=None, batch_size=BATCH_SIZE, using=None, gated=False):
+    """Create users from ``read_rows`` output; returns one result per row, in order."""
+    using = using or router.db_for_write(User)
+    validator = _row_validator()
+    results = []
+    valid = []
+    for line, row, errors in rows:
+        if errors is None:
+            try:
+                valid.append((len(results), line, validator.run_validation(row)))
+                results.append(None)
+                continue
+            except ValidationError as e:
+                errors = e.detail
+        results.append(_error(line, errors))
+
+    taken_usernames, taken_emails = _taken(
+        {data['username'] for *_, data in valid}, {data['email'] for *_, data in valid}, using,
+    )
+    pending = []
+    for index, line, data in valid:
+        errors = {}
+        if data['username'] in taken_usernames:
+            errors['username'] = [DUPLICATE_USERNAME]
+        if data['email'] in taken_emails:
+            errors['email'] = [DUPLICATE_EMAIL]
+        if errors:
+            results[index] = _error(line, errors)
+            continue
+        # Later rows with the same username or email are duplicates of this one.
+        taken_usernames.add(data['username'])
+        taken_emails.add(data['email'])
+        pending.append((index, line, data))
+
+    passwords = [data['password'] for *_, data in pending]
+    if gated and passwords:
+        with hashing_slots(pool_size(len(passwords), workers)) as slots:
+            passwords = hash_passwords(passwords, slots, iterations)
+    else:
+        passwords = hash_passwords(passwords, workers, iterations)
+    users = [
+        (index, line, User(
+            username=data['username'], email=data['email'], password=password,
+            first_name=data.get('first_name', ''), last_name=data.get('last_name', ''),
+        ))
+        for (index, line, data), password in zip(pending, passwords)
+    ]
+    for start in range(0, len(users), batch_size):
+        _insert(users[start:start + batch_size], results, using)
+    return results
+
+
+def _insert(batch, results, using):
+    try:
+        with transaction.atomic(using=using):
+            User.objects.using(using).bulk_create([user for *_, user in batch])
+    except IntegrityError:
+        # A user registered one of these names since the check: report those
+        # and insert the rest one at a time, each in its own savepoint, so a
+        # row that still fails is reported instead of failing the import.
+        taken, _ = _taken({user.username for *_, user in batch}, (), using)
+        for index, line, user in batch:
+            if user.username in taken:
+                results[index] = _error(line, {'username': [DUPLICATE_USERNAME]})
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    User.objects.using(using).bulk_create([user])
+            except IntegrityError:
+                duplicate = User.objects.using(using).filter(username=user.username).exists()
+                results[index] = _error(
+                    line, {'username': [DUPLICATE_USERNAME]} if duplicate else {'non_field_errors': [NOT_SAVED]},
+                )
+                continue
+            results[index] = _created(line, user)
+        return
+    for index, line, user in batch:
+        results[index] = _created(line, user)
+
+
+def _created(line, user):
+    return {'line': line, 'status': 'created', 'id': user.pk, 'username': user.username}
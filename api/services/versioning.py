@@ -0,0 +1,52 @@
+"""
+Change counters used as HTTP validators.
+
+Every write to a tracked table bumps a single ``ChangeCounter`` row (see
+``api.signals``). Conditional GETs compare the client's ETag against that
+row, so an unchanged poll costs one primary-key lookup and no serialization.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import http_date
+
+from ..models import ChangeCounter
+
+LOCKERS = 'lockers'
+
+
+def bump_version(name, using=None):
+    """Increment counter ``name``, creating it on first use."""
+    now = timezone.now()
+    counters = ChangeCounter.objects.using(using)
+    if counters.filter(name=name).update(version=F('version') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic(using=using):
+            counters.create(name=name, version=1, updated_at=now)
+    except IntegrityError:
+        counters.filter(name=name).update(version=F('version') + 1, updated_at=now)
+
+
+def get_version(name, using=None):
+    """Return ``(version, updated_at)`` for counter ``name``."""
+    row = ChangeCounter.objects.using(using).filter(name=name).values_list('version', 'updated_at').first()
+    if row is None:
+        return 0, None
+    return row
+
+
+async def aget_version(name, using=None):
+    """Async ``get_version``."""
+    row = await ChangeCounter.objects.using(using).filter(name=name).values_list('version', 'updated_at').afirst()
+    if row is None:
+        return 0, None
+    return row
+
+
+def etag_for(name, version):
+    return f'"{name}-v{version}"'
+
+
+def last_modified_for(updated_at):
+    return http_date(updated_at.timestamp()) if updated_at else None
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_migrate
+from django.dispatch import Signal, receiver
+
+# Sent whenever locker rows change, whichever write path was used.
+# Arguments: ``using`` (database alias), ``instances`` (the affected Locker
+# objects, or None for queryset updates), ``fields`` (the updated field
+# names, or None when whole rows were written) and ``deltas`` (net change
+# per ``(location, status)`` bucket, or None when no locker moved bucket).
+lockers_changed = Signal()
+
+
+def _stored_bucket(sender, instance, using):
+    # The in-memory instance may be stale (queryset updates don't touch it),
+    # so read the bucket the row is actually leaving, under a row lock.
+    return (
+        sender._base_manager.using(using).select_for_update().filter(pk=instance.pk)
+        .values_list('location', 'status').first()
+    )
+
+
+@receiver(pre_save, sender='api.Locker')
+def _remember_locker_bucket(sender, instance, using, **kwargs):
+    if not instance._state.adding:
+        instance._previous_bucket = _stored_bucket(sender, instance, using)
+
+
+@receiver(pre_delete, sender='api.Locker')
+def _remember_deleted_bucket(sender, instance, using, **kwargs):
+    instance._previous_bucket = _stored_bucket(sender, instance, using)
+
+
+@receiver(post_save, sender='api.Locker')
+def _locker_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    from .models import bucket_deltas
+    previous = None if created else instance.__dict__.pop('_previous_bucket', None)
+    deltas = bucket_deltas([previous] if previous else [], [instance.bucket])
+    lockers_changed.send(
+        sender=sender, using=using, instances=[instance],
+        fields=set(update_fields) if update_fields else None,
+        deltas=deltas or None,
+    )
+
+
+@receiver(post_delete, sender='api.Locker')
+def _locker_deleted(sender, instance, using, **kwargs):
+    from .services.broker import broker
+    locker_id = instance.pk
+    transaction.on_commit(lambda: broker.note_deleted(locker_id), using=using)
+    bucket = instance.__dict__.pop('_previous_bucket', None)
+    lockers_changed.send(
+        sender=sender, using=using, instances=[instance], fields=None,
+        deltas={bucket: -1} if bucket else None,
+    )
+
+
+@receiver(lockers_changed)
+def _bump_locker_version(sender, using, **kwargs):
+    from .services.versioning import LOCKERS, bump_version
+    # Once the write has committed: bumped inside the writer's transaction,
+    # the one counter row would hold every other locker write and
+    # reservation until that commit. Until the bump lands, conditional GETs
+    # still match the previous ETag. Under sharding the counter is on the
+    # primary.
+    counter_db = None if using in settings.DATABASE_SHARDS else using
+    transaction.on_commit(lambda: bump_version(LOCKERS, using=counter_db), using=using)
+
+
+@receiver(lockers_changed)
+def _wake_locker_stream(sender, using, **kwargs):
+    from .services.broker import broker
+    transaction.on_commit(broker.wake, using=using)
+
+
+@receiver(lockers_changed)
+def _count_locker_buckets(sender, using, deltas=None, **kwargs):
+    if deltas:
+        from .services.stats import apply_deltas
+        apply_deltas(deltas, using=using)
+
+
+@receiver(post_delete, sender='auth.User')
+def _delete_sharded_reservations(sender, instance, using, **kwargs):
+    # The ORM cascade only reaches the user's own database.
+    if settings.DATABASE_SHARDS:
+        from myapp.sharding import gather
+        from .models import ArchivedReservation, Reservation
+        user_id = instance.pk
+
+        def delete(alias):
+            for model in (Reservation, ArchivedReservation):
+                model.objects.using(alias).filter(user_id=user_id).delete()
+        transaction.on_commit(lambda: gather(delete, settings.DATABASE_SHARDS), using=using)
+
+
+@receiver(post_migrate)
+def _reserve_shard_ids(sender, using, **kwargs):
+    if sender.name == 'api':
+        from myapp.sharding import reserve_id_range
+        reserve_id_range(using)
+
+
+@receiver(post_save, sender='auth.User')
+@receiver(post_delete, sender='auth.User')
+def _forget_cached_user(sender, instance, **kwargs):
+    # Other processes catch up when their copy expires (JWT_USER_CACHE_TTL).
+    from .authentication import forget_user
+    forget_user(instance.pk)
@@ -1,3 +1,1383 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import importlib
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+import api.urls
+import myapp.urls
+from api import authentication
+from api.authentication import CachedJWTAuthentication, fresh_claims, tokens_for
+from api.models import ArchivedReservation, LocationRollup, Locker, LockerRollup, LockerStatusCount, Reservation, RevokedToken
+from api.serializers import LockerRowSerializer, LockerSerializer
+from api.services import bulk, cache as locker_cache, rollups, stats, throttle, user_import
+from api.services.archive import archive
+from api.services.broker import LockerEventBroker
+from api.services.reservations import (
+    CONFLICT, NOT_FOUND, book_locker, free_lockers, overlapping, release_reservation, reserve_locker,
+)
+from api.services.revocation import BloomFilter, Revocations, revocations, revoke
+from api.services.sweeper import sweep
+from api.services.throttle import HashingBusy, hashing_slot
+from api.services.versioning import LOCKERS as LOCKERS_VERSION, get_version
+from api.views import auth_views
+from myapp import middleware as middleware_module, routers
+from myapp.middleware import MetricsMiddleware, ReplicaMiddleware, RequestTimingMiddleware
+from myapp.sharding import ShardedQuerySet, shard_for_id, shard_for_location, sharded
+
+LOCKERS = 20_000
+USERS = 200
+RESERVATIONS = 60_000
+LOCATIONS = 20
+
+
+def _plan_lines(plan):
+    if connection.vendor == 'postgresql':
+        return [line.strip() for line in plan.splitlines()]
+    # SQLite rows are "<id> <parent> <notused> <detail>".
+    return [line.split(' ', 3)[-1] for line in plan.splitlines()]
+
+
+def _full_scans(plan, table):
+    """Plan lines that walk the whole of ``table`` instead of seeking into an index."""
+    if connection.vendor == 'postgresql':
+        return [line for line in _plan_lines(plan) if f'Seq Scan on {table}' in line]
+    # SQLite seeks with "SEARCH"; "SCAN" visits every row, via an index or not.
+    return [line for line in _plan_lines(plan) if line == f'SCAN {table}' or line.startswith(f'SCAN {table} ')]
+
+
+def _sorts(plan):
+    """Plan lines that sort rows instead of reading them in index order."""
+    if connection.vendor == 'postgresql':
+        return [line for line in _plan_lines(plan) if line.startswith(('Sort ', '->  Sort '))]
+    return [line for line in _plan_lines(plan) if 'TEMP B-TREE FOR ORDER BY' in line]
+
+
+@unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'plans are checked on SQLite and PostgreSQL')
+@override_settings(DATABASE_SHARDS=[])  # plans are checked on one database
+class HotQueryPlanTests(TestCase):
+    """Fail when a hot query stops using an index on a realistically sized table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(9)
+        now = timezone.now()
+        statuses = ['occupied'] * 6 + ['available'] * 3 + ['maintenance']
+        Locker.objects.bulk_create(
+            [
+                Locker(locker_number=f'P{i:06d}', location=f'plan-{i % LOCATIONS}', status=rng.choice(statuses))
+                for i in range(LOCKERS)
+            ],
+            batch_size=2000,
+        )
+        User.objects.bulk_create([User(username=f'plan-{i}') for i in range(USERS)], batch_size=2000)
+        cls.user = User.objects.get(username='plan-0')
+        user_ids = list(User.objects.values_list('id', flat=True))
+        locker_ids = list(Locker.objects.values_list('id', flat=True))
+        cls.locker_id = locker_ids[0]
+
+        # Seeded with executemany; model instances would dominate the run time.
+        ops = connection.ops
+        table = ops.quote_name(Reservation._meta.db_table)
+        rows = []
+        for _ in range(RESERVATIONS):
+            start = now - timedelta(minutes=rng.randint(60, 60 * 24 * 365))
+            end = start + timedelta(minutes=rng.randint(30, 600))
+            status = rng.choice(('completed', 'completed', 'completed', 'cancelled', 'active'))
+            rows.append((
+                rng.choice(user_ids), rng.choice(locker_ids), ops.adapt_datetimefield_value(start),
+                ops.adapt_datetimefield_value(end), status, ops.adapt_datetimefield_value(start),
+                ops.adapt_datetimefield_value(end),
+            ))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} (user_id, locker_id, start_time, end_time, status, created_at, updated_at) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                rows,
+            )
+            # Give the planner real statistics, as production has.
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, queryset, table, ordered=False):
+        plan = queryset.explain()
+        scans = _full_scans(plan, table)
+        self.assertFalse(scans, f'{table} is read with a full scan:\n{plan}\n\n{queryset.query}')
+        if ordered:
+            self.assertFalse(_sorts(plan), f'results are sorted instead of read in index order:\n{plan}')
+
+    def test_available_lockers_listing(self):
+        queryset = Locker.objects.filter(status='available').order_by('locker_number')[:101]
+        self.assertIndexed(queryset, 'lockers', ordered=True)
+
+    def test_lockers_by_status(self):
+        queryset = Locker.objects.filter(status='maintenance').order_by('locker_number')[:101]
+        self.assertIndexed(queryset, 'lockers', ordered=True)
+
+    def test_location_status_counts(self):
+        queryset = (
+            Locker.objects.filter(location='plan-3').order_by()
+            .values('status').annotate(n=Count('id'))
+        )
+        self.assertIndexed(queryset, 'lockers')
+
+    def test_user_reservations_newest_first(self):
+        queryset = Reservation.objects.filter(user=self.user).order_by('-created_at')
+        self.assertIndexed(queryset, 'reservations', ordered=True)
+
+    def test_locker_live_reservations(self):
+        queryset = Reservation.objects.filter(locker_id=self.locker_id, status='active')
+        self.assertIndexed(queryset, 'reservations')
+
+    def test_booking_overlap_probe(self):
+        now = timezone.now()
+        self.assertIndexed(overlapping(self.locker_id, now, now + timedelta(hours=2)), 'reservations')
+
+    def test_free_lockers_subquery(self):
+        now = timezone.now()
+        plan = free_lockers(now, now + timedelta(hours=2), location='plan-3').explain()
+        self.assertFalse(_full_scans(plan, 'reservations'), plan)
+        self.assertFalse(_full_scans(plan, 'lockers'), plan)
+
+    def test_sweeper_overdue_batch(self):
+        queryset = (
+            Reservation.objects.filter(status='active', end_time__lte=timezone.now())
+            .order_by('end_time')[:500]
+        )
+        self.assertIndexed(queryset, 'reservations', ordered=True)
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False)
+class ReserveLockerTests(TestCase):
+    """One reservation per locker; a losing attempt changes nothing."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'reserve-{i}') for i in range(2)]
+        self.locker = Locker.objects.create(locker_number='R1', location='reserve-site')
+
+    def _state(self):
+        self.locker.refresh_from_db()
+        return self.locker.status, Reservation.objects.filter(locker=self.locker).count()
+
+    def test_second_reservation_loses(self):
+        first = reserve_locker(self.users[0], self.locker.pk)
+        second = reserve_locker(self.users[1], self.locker.pk)
+        self.assertTrue(first.ok)
+        self.assertEqual(second.outcome, CONFLICT)
+        self.assertIsNone(second.reservation)
+        self.assertEqual(self._state(), ('occupied', 1))
+        self.assertEqual(Reservation.objects.get().user, self.users[0])
+
+    def test_failed_reservations_leave_the_locker_alone(self):
+        Locker.objects.filter(pk=self.locker.pk).update(status='maintenance')
+        self.assertEqual(reserve_locker(self.users[0], self.locker.pk).outcome, CONFLICT)
+        self.assertEqual(self._state(), ('maintenance', 0))
+        self.assertEqual(reserve_locker(self.users[0], self.locker.pk + 1000).outcome, NOT_FOUND)
+        self.assertEqual(reserve_locker(self.users[0], 'abc').outcome, NOT_FOUND)
+
+    def test_claim_is_rolled_back_when_a_booking_overlaps(self):
+        now = timezone.now()
+        self.assertTrue(book_locker(self.users[1], self.locker.pk, now - timedelta(minutes=5), now + timedelta(hours=1)).ok)
+        self.assertEqual(reserve_locker(self.users[0], self.locker.pk, 2).outcome, CONFLICT)
+        self.assertEqual(self._state(), ('available', 1))
+        counts = dict(LockerStatusCount.objects.filter(location='reserve-site').values_list('status', 'count'))
+        self.assertEqual(counts.get('available'), 1)
+        self.assertFalse(counts.get('occupied'))
+
+    def test_endpoint_answers_the_loser_with_409(self):
+        clients = []
+        for user in self.users:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user)[1]}')
+            clients.append(client)
+        path = f'/api/lockers/{self.locker.pk}/reserve/'
+        self.assertEqual(clients[0].post(path, {'duration': 1}, format='json').status_code, 200)
+        response = clients[1].post(path, {'duration': 1}, format='json')
+        self.assertEqual((response.status_code, response.data), (409, {'error': 'Locker is not available'}))
+        response = clients[1].post(f'/api/lockers/{self.locker.pk + 1000}/reserve/', format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_reservations_cannot_be_edited_or_deleted(self):
+        other = Locker.objects.create(locker_number='R2', location='reserve-site')
+        reservation = reserve_locker(self.users[0], self.locker.pk).reservation
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(self.users[0])[1]}')
+        path = f'/api/reservations/{reservation.pk}/'
+        self.assertEqual(client.patch(path, {'locker': other.pk}, format='json').status_code, 405)
+        self.assertEqual(client.put(path, {'locker': other.pk}, format='json').status_code, 405)
+        self.assertEqual(client.delete(path).status_code, 405)
+
+        reservation.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((reservation.locker_id, reservation.status), (self.locker.pk, 'active'))
+        self.assertEqual(self._state(), ('occupied', 1))
+        self.assertEqual(other.status, 'available')
+        self.assertEqual(client.get(path).data['locker'], self.locker.pk)
+
+
+@override_settings(DATABASE_SHARDS=[])
+class ConcurrentReserveTests(TransactionTestCase):
+    """Threads racing for one locker: exactly one wins."""
+
+    def test_exactly_one_concurrent_reservation_wins(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Shared-cache memory databases fail at once on a lock instead of waiting.
+            self.skipTest('needs a database file (or PostgreSQL) for threads to wait on locks')
+        users = [User.objects.create_user(f'racer-{i}') for i in range(8)]
+        locker = Locker.objects.create(locker_number='RACE', location='race-site')
+        start = threading.Barrier(len(users))
+        outcomes = []
+
+        def race(user):
+            try:
+                start.wait()
+                outcomes.append(reserve_locker(user, locker.pk).outcome)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=race, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['conflict'] * (len(users) - 1) + ['reserved'])
+        self.assertEqual(Reservation.objects.filter(locker=locker).count(), 1)
+        self.assertEqual(Locker.objects.get(pk=locker.pk).status, 'occupied')
+
+
+@override_settings(DATABASE_SHARDS=[])
+class SweeperTests(TestCase):
+    """Bookings start, overdue reservations are billed and lockers change hands."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'sweep-{i}') for i in range(2)]
+        self.locker = Locker.objects.create(locker_number='S1', location='sweep-site', price_per_hour=Decimal('2.00'))
+        self.now = timezone.now()
+
+    def _reserve(self, user, start, end, status):
+        return Reservation.objects.create(user=user, locker=self.locker, start_time=start, end_time=end, status=status)
+
+    def _locker_status(self):
+        self.locker.refresh_from_db()
+        return self.locker.status
+
+    def test_due_booking_is_activated(self):
+        booking = self._reserve(self.users[0], self.now - timedelta(minutes=1), self.now + timedelta(hours=1), 'scheduled')
+        metrics = sweep(now=self.now)
+        self.assertEqual((metrics['activated'], metrics['expired'], metrics['backlog']), (1, 0, False))
+        booking.refresh_from_db()
+        self.assertEqual((booking.status, self._locker_status()), ('active', 'occupied'))
+
+    def test_overdue_reservation_is_billed_and_frees_the_locker(self):
+        Locker.objects.filter(pk=self.locker.pk).update(status='occupied')
+        reservation = self._reserve(self.users[0], self.now - timedelta(hours=3), self.now - timedelta(hours=1), 'active')
+        metrics = sweep(now=self.now)
+        self.assertEqual((metrics['expired'], metrics['freed']), (1, 1))
+        reservation.refresh_from_db()
+        self.assertEqual((reservation.status, reservation.total_price), ('completed', Decimal('4.00')))
+        self.assertEqual(self._locker_status(), 'available')
+
+    def test_back_to_back_booking_takes_the_locker_over(self):
+        Locker.objects.filter(pk=self.locker.pk).update(status='occupied')
+        handover = self.now - timedelta(minutes=1)
+        ending = self._reserve(self.users[0], handover - timedelta(hours=1), handover, 'active')
+        starting = self._reserve(self.users[1], handover, handover + timedelta(hours=2), 'scheduled')
+
+        metrics = sweep(now=self.now)
+        self.assertEqual((metrics['activated'], metrics['expired']), (1, 1))
+        ending.refresh_from_db()
+        starting.refresh_from_db()
+        self.assertEqual((ending.status, starting.status), ('completed', 'active'))
+        self.assertEqual(self._locker_status(), 'occupied')
+        self.assertEqual(reserve_locker(self.users[0], self.locker.pk).outcome, CONFLICT)
+
+    def test_expiry_keeps_a_locker_another_reservation_holds(self):
+        # The next booking was started by an earlier pass (or a manual claim)
+        # before the previous one was expired.
+        Locker.objects.filter(pk=self.locker.pk).update(status='occupied')
+        self._reserve(self.users[0], self.now - timedelta(hours=2), self.now - timedelta(minutes=5), 'active')
+        self._reserve(self.users[1], self.now - timedelta(minutes=5), self.now + timedelta(hours=1), 'active')
+        metrics = sweep(now=self.now)
+        self.assertEqual((metrics['expired'], metrics['freed']), (1, 0))
+        self.assertEqual(self._locker_status(), 'occupied')
+
+
+class ReadThroughCacheTests(SimpleTestCase):
+    """Only the caller that took the recompute lock releases it."""
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_waiter_leaves_the_holders_lock_alone(self):
+        caches['default'].add('payload:lock', 1)  # another process is recomputing
+        with mock.patch.object(locker_cache, 'WAIT_SECONDS', 0):
+            self.assertEqual(locker_cache.read_through('payload', lambda: ('fresh', True)), 'fresh')
+        self.assertIsNotNone(caches['default'].get('payload:lock'))
+
+    def test_holder_releases_its_lock(self):
+        self.assertEqual(locker_cache.read_through('payload', lambda: ('fresh', False)), 'fresh')
+        self.assertIsNone(caches['default'].get('payload:lock'))
+        self.assertIsNone(caches['default'].get('payload'))
+
+
+def _route_read_views():
+    importlib.reload(api.urls)
+    importlib.reload(myapp.urls)
+    clear_url_caches()
+
+
+@contextlib.contextmanager
+def _read_views(use_async):
+    """Serve the read endpoints from the async views (``ASYNC_READ_VIEWS``) or from DRF."""
+    try:
+        with override_settings(ASYNC_READ_VIEWS=use_async):
+            _route_read_views()
+            yield
+    finally:
+        _route_read_views()
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False, JWT_CLAIMS_MAX_AGE=300, JWT_USER_CACHE_TTL=60)
+class ClaimsAuthenticationTests(TestCase):
+    """Claims are trusted for JWT_CLAIMS_MAX_AGE, user rows cached for JWT_USER_CACHE_TTL."""
+
+    def setUp(self):
+        caches['default'].clear()
+        authentication._users.clear()
+        self.addCleanup(authentication._users.clear)
+        self.user = User.objects.create_user('claims-user')
+        self.locker = Locker.objects.create(locker_number='C1', location='claims-site')
+
+    def _token(self, age=0):
+        token = tokens_for(self.user)[1]
+        token['iat'] = int(time.time()) - age
+        return AccessToken(str(token))
+
+    def _get(self, token, path='/api/lockers/'):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get(path)
+
+    def test_claims_go_stale(self):
+        token = self._token()
+        self.assertTrue(fresh_claims(token))
+        self.assertFalse(fresh_claims(self._token(age=301)))
+        del token['is_staff']
+        self.assertFalse(fresh_claims(token))
+
+    def test_user_rows_are_cached_for_the_ttl(self):
+        token = self._token(age=3600)
+        with self.assertNumQueries(1):
+            CachedJWTAuthentication().get_user(token)
+            CachedJWTAuthentication().get_user(token)
+        later = time.monotonic() + 61
+        with mock.patch('api.authentication.time.monotonic', return_value=later), self.assertNumQueries(1):
+            CachedJWTAuthentication().get_user(token)
+
+        authentication._users.clear()
+        with override_settings(JWT_USER_CACHE_TTL=0), self.assertNumQueries(2):
+            CachedJWTAuthentication().get_user(token)
+            CachedJWTAuthentication().get_user(token)
+
+    def test_deactivated_user_is_refused_once_the_claims_are_stale(self):
+        stale, fresh = self._token(age=3600), self._token()
+        # A queryset update sends no signal, so nothing is evicted: the worst case.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        for use_async in (False, True):
+            for path in ('/api/lockers/', f'/api/lockers/{self.locker.pk}/'):
+                with self.subTest(async_views=use_async, path=path), _read_views(use_async):
+                    response = self._get(stale, path)
+                    self.assertEqual((response.status_code, response.json()), (401, {'detail': 'User is inactive', 'code': 'user_inactive'}))
+                    self.assertEqual(self._get(fresh, path).status_code, 200)
+
+    def test_deactivation_reaches_cached_users_after_the_ttl(self):
+        stale = self._token(age=3600)
+        self.assertEqual(self._get(stale).status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self._get(stale).status_code, 200)
+        later = time.monotonic() + 61
+        with mock.patch('api.authentication.time.monotonic', return_value=later):
+            self.assertEqual(self._get(stale).status_code, 401)
+
+        # Saving the user evicts its cached copy at once.
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.assertEqual(self._get(stale).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self._get(stale).status_code, 401)
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False)
+class AsyncReadViewTests(TestCase):
+    """With ASYNC_READ_VIEWS on or off, the read endpoints answer the same bytes and headers."""
+
+    HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary', 'Allow', 'WWW-Authenticate')
+
+    def setUp(self):
+        statuses = ['available', 'available', 'occupied', 'available', 'maintenance']
+        prices = ['2.50', '3', '0.10', '12.345', '7']
+        self.lockers = Locker.objects.bulk_create([
+            Locker(
+                locker_number=f'A{i:02d}', location=f'async-{i % 2}',
+                price_per_hour=Decimal(prices[i % len(prices)]), status=statuses[i % len(statuses)],
+            )
+            for i in range(9)
+        ])
+        self.user = User.objects.create_user('async-user', email='async@example.com', first_name='Ann')
+        self.admin = User.objects.create_user('async-admin', is_staff=True)
+
+    def assertSameResponse(self, path, user=None, **headers):
+        """GET ``path`` through the DRF and the async views; returns the (matching) DRF response."""
+        responses = []
+        for use_async in (False, True):
+            caches['default'].clear()
+            authentication._users.clear()
+            client = APIClient()
+            if user is not None:
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user)[1]}')
+            with _read_views(use_async):
+                response = client.get(path, **headers)
+                # Resolved lazily: look while the routes are in place.
+                self.assertEqual(response.resolver_match.url_name.endswith('-async'), use_async, path)
+            responses.append(response)
+        drf, served_async = responses
+        self.assertEqual(served_async.status_code, drf.status_code, path)
+        self.assertEqual(served_async.content, drf.content, path)
+        for header in self.HEADERS:
+            self.assertEqual(served_async.get(header), drf.get(header), f'{header} of {path}')
+        return drf
+
+    def test_locker_list_pages_and_fields(self):
+        for path in ('/api/lockers/', '/api/lockers/?fields=id,status', '/api/lockers/?location=async-1'):
+            with self.subTest(path=path):
+                self.assertEqual(self.assertSameResponse(path, self.user).status_code, 200)
+
+        path, pages = '/api/lockers/?page_size=2&fields=id,price_per_hour', 0
+        while path:
+            response = self.assertSameResponse(path, self.user)
+            pages += 1
+            path = response.json()['next']
+        self.assertEqual(pages, 3)
+
+    def test_locker_detail(self):
+        available, _, occupied = self.lockers[:3]
+        for path in (f'/api/lockers/{available.pk}/', f'/api/lockers/{available.pk}/?fields=id,locker_number',
+                     f'/api/lockers/{occupied.pk}/', '/api/lockers/999999/'):
+            with self.subTest(path=path):
+                self.assertSameResponse(path, self.user)
+        self.assertEqual(self.assertSameResponse(f'/api/lockers/{occupied.pk}/', self.user).status_code, 404)
+
+    def test_conditional_get(self):
+        for path in ('/api/lockers/', f'/api/lockers/{self.lockers[0].pk}/'):
+            with self.subTest(path=path):
+                etag = self.assertSameResponse(path, self.user)['ETag']
+                response = self.assertSameResponse(path, self.user, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                stale = self.assertSameResponse(path, self.user, HTTP_IF_NONE_MATCH='"lockers-0"')
+                self.assertEqual(stale.status_code, 200)
+
+    def test_stats_and_current_user(self):
+        self.assertEqual(self.assertSameResponse('/api/admin/lockers/stats/', self.admin).status_code, 200)
+        self.assertEqual(self.assertSameResponse('/api/admin/lockers/stats/', self.user).status_code, 403)
+        self.assertEqual(self.assertSameResponse('/api/auth/me/', self.user).status_code, 200)
+        self.assertEqual(self.assertSameResponse('/api/auth/me/', self.admin).status_code, 200)
+
+    def test_unauthenticated_requests(self):
+        for path in ('/api/lockers/', f'/api/lockers/{self.lockers[0].pk}/', '/api/admin/lockers/stats/', '/api/auth/me/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.assertSameResponse(path).status_code, 401)
+                self.assertEqual(self.assertSameResponse(path, HTTP_AUTHORIZATION='Bearer junk').status_code, 401)
+
+    @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 1.0})
+    async def test_served_through_the_asgi_handler(self):
+        # The path uvicorn takes: ASGIHandler and the async middleware chain.
+        available = [locker.pk for locker in sorted(self.lockers, key=lambda l: l.locker_number)
+                     if locker.status == 'available']
+        headers = {'Authorization': f'Bearer {tokens_for(self.user)[1]}'}
+        with _read_views(True):
+            response = await AsyncClient().get('/api/lockers/', headers=headers)
+            self.assertEqual(response.resolver_match.url_name, 'locker-list-async')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([locker['id'] for locker in response.json()['results']], available)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False, TOKEN_REVOCATION_SYNC_SECONDS=3600)
+class TokenRevocationTests(TestCase):
+    """Revoked tokens are refused; Bloom filter hits are settled by the table."""
+
+    def setUp(self):
+        revocations.reset()
+        self.user = User.objects.create_user('revoke-user')
+
+    def tearDown(self):
+        revocations.reset()
+
+    def _get(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get('/api/lockers/')
+
+    def test_revoked_token_is_rejected(self):
+        token = tokens_for(self.user)[1]
+        self.assertEqual(self._get(token).status_code, 200)
+        self.assertTrue(revoke(token))
+        self.assertEqual(self._get(token).status_code, 401)
+        # Another process learns of it on its first sync.
+        self.assertTrue(Revocations().is_revoked(token['jti'], token['exp']))
+
+    def test_false_positive_falls_back_to_the_table(self):
+        revoked, kept = tokens_for(self.user)[1], tokens_for(self.user)[1]
+        revoke(revoked)
+        process = Revocations()
+        process.sync(force=True)
+        with mock.patch.object(BloomFilter, '__contains__', lambda bloom, key: True):
+            with self.assertNumQueries(1):
+                self.assertFalse(process.is_revoked(kept['jti'], kept['exp']))
+            with self.assertNumQueries(0):  # the answer is remembered
+                self.assertFalse(process.is_revoked(kept['jti'], kept['exp']))
+            self.assertTrue(process.is_revoked(revoked['jti'], revoked['exp']))
+
+            revocations.sync(force=True)
+            self.assertEqual(self._get(kept).status_code, 200)
+            self.assertEqual(self._get(revoked).status_code, 401)
+
+    def test_expired_rows_are_pruned_once_a_day(self):
+        now = timezone.now()
+        live = RevokedToken.objects.create(jti='live', expires_at=now + timedelta(days=2))
+        RevokedToken.objects.create(jti='expired', expires_at=now - timedelta(minutes=1))
+        process = Revocations()
+        process.sync(force=True)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+
+        # Later the same day the sync only reads.
+        RevokedToken.objects.create(jti='expired-later', expires_at=now - timedelta(minutes=1))
+        process.sync(force=True)
+        self.assertTrue(RevokedToken.objects.filter(jti='expired-later').exists())
+
+        with mock.patch('api.services.revocation.timezone.now', return_value=now + timedelta(days=1)):
+            process.sync(force=True)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertTrue(process.is_revoked('live', live.expires_at.timestamp()))
+
+
+def _isolate_hash_gate(test):
+    """Give ``test`` its own hashing-slot lock files, a gate built from its settings and fresh buckets."""
+    lock_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(lock_dir.cleanup)
+    lock_settings = override_settings(PASSWORD_HASH_LOCK_DIR=lock_dir.name)
+    lock_settings.enable()
+    test.addCleanup(lock_settings.disable)
+    for name, value in (('_buckets', {}), ('_gate', None)):
+        patcher = mock.patch.object(throttle, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, PASSWORD_HASH_SLOTS=1, PASSWORD_HASH_WAIT_SECONDS=0, PASSWORD_HASH_ITERATIONS=1000,
+    LOGIN_THROTTLE={'IP_RATE': 0.001, 'IP_BURST': 2, 'USERNAME_RATE': 0.001, 'USERNAME_BURST': 5, 'CACHE': ''},
+)
+class LoginThrottleTests(TestCase):
+    """Throttled logins cost no hash, and at most ``PASSWORD_HASH_SLOTS`` hashes run at once."""
+
+    def setUp(self):
+        _isolate_hash_gate(self)
+        User.objects.create_user('throttle-user', password='secret123')
+        self.client = APIClient()
+
+    def _login(self, password='wrong'):
+        return self.client.post('/api/auth/login/', {'username': 'throttle-user', 'password': password}, format='json')
+
+    def test_throttled_login_is_refused_before_hashing(self):
+        with mock.patch.object(auth_views, 'authenticate', wraps=auth_views.authenticate) as authenticate:
+            self.assertEqual(self._login().status_code, 401)
+            self.assertEqual(self._login('secret123').status_code, 200)
+            response = self._login('secret123')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(authenticate.call_count, 2)
+
+    def test_hashing_slots_are_capped(self):
+        with hashing_slot():
+            with self.assertRaises(HashingBusy):
+                with hashing_slot():
+                    pass
+            self.assertEqual(self._login('secret123').status_code, 503)
+        self.assertEqual(self._login('secret123').status_code, 200)
+
+    def test_slot_is_released_on_error(self):
+        with self.assertRaises(ValueError):
+            with hashing_slot():
+                raise ValueError
+        with hashing_slot():
+            pass
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, PASSWORD_HASH_SLOTS=1, PASSWORD_HASH_WAIT_SECONDS=0, USER_IMPORT_ITERATIONS=1000,
+)
+class UserImportTests(TestCase):
+    """Bulk imports report every row and hash within the host's slots."""
+
+    def setUp(self):
+        _isolate_hash_gate(self)
+        User.objects.create_user('taken', 'taken@example.com')
+
+    def _rows(self, *usernames):
+        return '\n'.join(
+            json.dumps({'username': name, 'email': f'{name}-new@example.com', 'password': 'secret123'})
+            for name in usernames
+        )
+
+    def test_rows_failing_on_retry_are_reported(self):
+        # A lookup that misses the clash: the batch insert fails and so does the row's retry.
+        with mock.patch.object(user_import, '_taken', side_effect=lambda *args: (set(), set())):
+            results = user_import.import_users(
+                user_import.read_rows(io.StringIO(self._rows('first', 'taken', 'second')), 'ndjson'), iterations=1000,
+            )
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'created'])
+        self.assertEqual(results[1]['errors'], {'username': [user_import.DUPLICATE_USERNAME]})
+        self.assertEqual(User.objects.filter(username__in=['first', 'second']).count(), 2)
+
+    def test_endpoint_hashes_within_the_slots(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {tokens_for(User.objects.create_user("import-admin", is_staff=True))[1]}'
+        )
+
+        def post():
+            return client.post('/api/admin/users/import.ndjson', self._rows('new-user'),
+                               content_type='application/x-ndjson')
+
+        with hashing_slot():
+            self.assertEqual(post().status_code, 503)
+        self.assertFalse(User.objects.filter(username='new-user').exists())
+        self.assertEqual(post().status_code, 200)
+        self.assertTrue(User.objects.filter(username='new-user').exists())
+
+
+class LockerBrokerTests(SimpleTestCase):
+    """The event pump runs outside the request that happens to start it."""
+
+    def test_pump_does_not_inherit_the_request_context(self):
+        broker = LockerEventBroker()
+        broker.version = 1  # skip the initial counter read
+        seen = []
+
+        async def pump(state):
+            seen.append(routers._current.get())
+
+        async def request():
+            routers._current.set(routers._Routing(user_id=1, replica='replica_1'))
+            with mock.patch.object(broker, '_pump', pump):
+                await (await broker._loop_state())['task']
+
+        asyncio.run(request())
+        self.assertEqual(seen, [None])
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False)
+class LockerListingTests(TestCase):
+    """Keyset pages and the row serializer behind the locker list."""
+
+    def setUp(self):
+        caches['default'].clear()
+        prices = ['2.50', '3', '0.10', '12.345', '7']
+        statuses = ['available', 'available', 'occupied', 'maintenance']
+        Locker.objects.bulk_create([
+            Locker(
+                locker_number=f'L{(i * 7) % 23:03d}-{i}', location=f'list-{i % 3}',
+                price_per_hour=Decimal(prices[i % len(prices)]), status=statuses[i % len(statuses)],
+            )
+            for i in range(23)
+        ])
+        user = User.objects.create_user('list-user')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user)[1]}')
+
+    def _walk(self, path):
+        ids = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, response.data)
+            ids += [locker['id'] for locker in response.data['results']]
+            path = response.data['next']
+        return ids
+
+    def test_pages_cover_every_locker_once(self):
+        available = Locker.objects.filter(status='available').order_by('locker_number')
+        self.assertEqual(self._walk('/api/lockers/?page_size=4'), list(available.values_list('id', flat=True)))
+        self.assertEqual(
+            self._walk('/api/lockers/?page_size=3&location=list-1&fields=id,status'),
+            list(available.filter(location='list-1').values_list('id', flat=True)),
+        )
+
+    def test_row_serializer_matches_locker_serializer(self):
+        lockers = Locker.objects.order_by('locker_number')
+        rows = LockerRowSerializer()
+        self.assertEqual(rows.to_representation(rows.queryset(lockers)), LockerSerializer(lockers, many=True).data)
+
+        trimmed = LockerRowSerializer(fields={'id', 'price_per_hour', 'updated_at'})
+        self.assertEqual(
+            trimmed.to_representation(trimmed.queryset(lockers)),
+            [{name: item[name] for name in ('id', 'price_per_hour', 'updated_at')}
+             for item in LockerSerializer(lockers, many=True).data],
+        )
+
+
+@override_settings(DATABASE_SHARDS=[])
+class LockerVersionTests(TestCase):
+    """The locker change counter is bumped after the write commits, not inside it."""
+
+    def test_version_is_bumped_on_commit(self):
+        before, _ = get_version(LOCKERS_VERSION)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                locker = Locker.objects.create(locker_number='V1', location='version-site')
+                Locker.objects.filter(pk=locker.pk).update(status='maintenance')
+                self.assertEqual(get_version(LOCKERS_VERSION)[0], before)
+        self.assertEqual(get_version(LOCKERS_VERSION)[0], before + 2)
+
+
+@override_settings(DATABASE_SHARDS=[])
+class LockerStatusCountTests(TestCase):
+    """The (location, status) counters always equal a fresh GROUP BY."""
+
+    def assertCountersMatch(self):
+        counters = dict(
+            ((location, status), count) for location, status, count
+            in LockerStatusCount.objects.filter(count__gt=0).values_list('location', 'status', 'count')
+        )
+        self.assertEqual(counters, stats.aggregate_counts())
+        self.assertEqual(stats.reconcile(repair=False), [])
+
+    def test_every_write_path_keeps_the_counters(self):
+        locker = Locker.objects.create(locker_number='N1', location='north')
+        Locker.objects.bulk_create([Locker(locker_number=f'N{i}', location='north') for i in range(2, 6)])
+        self.assertCountersMatch()
+
+        locker.status = 'maintenance'
+        locker.save()
+        Locker.objects.filter(locker_number__in=['N2', 'N3']).update(status='occupied')
+        self.assertCountersMatch()
+
+        Locker.objects.filter(locker_number='N4').update(location='south')
+        bulk.bulk_update_lockers([{'id': locker.pk, 'location': 'south', 'status': 'available'}])
+        self.assertCountersMatch()
+
+        locker.delete()
+        Locker.objects.filter(location='north', status='occupied').delete()
+        self.assertCountersMatch()
+        self.assertEqual(stats.fleet_stats(), {
+            'total_lockers': 2, 'available_lockers': 2, 'occupied_lockers': 0, 'maintenance_lockers': 0,
+            'by_location': {
+                'north': {'available': 1, 'occupied': 0, 'maintenance': 0, 'total': 1},
+                'south': {'available': 1, 'occupied': 0, 'maintenance': 0, 'total': 1},
+            },
+        })
+
+    def test_apply_deltas_creates_and_adjusts_buckets(self):
+        stats.apply_deltas({('east', 'available'): 3, ('east', 'occupied'): 1})
+        stats.apply_deltas({('east', 'available'): -1, ('east', 'occupied'): 1})
+        self.assertEqual(
+            sorted(LockerStatusCount.objects.values_list('location', 'status', 'count')),
+            [('east', 'available', 2), ('east', 'occupied', 2)],
+        )
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        Locker.objects.bulk_create([Locker(locker_number=f'W{i}', location='west') for i in range(3)])
+        Locker.objects.filter(locker_number='W0').update(status='maintenance')
+        LockerStatusCount.objects.filter(location='west', status='available').update(count=7)
+        LockerStatusCount.objects.filter(location='west', status='maintenance').delete()
+        LockerStatusCount.objects.create(location='nowhere', status='occupied', count=2)
+
+        expected = [('nowhere', 'occupied', 2, 0), ('west', 'available', 7, 2), ('west', 'maintenance', 0, 1)]
+        self.assertEqual(stats.reconcile(repair=False), expected)
+        with self.assertRaisesMessage(CommandError, '3 counter(s) drifted'):
+            call_command('reconcile_locker_stats', '--check', stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('reconcile_locker_stats', stdout=out)
+        self.assertIn('Repaired 3 counter(s)', out.getvalue())
+        self.assertCountersMatch()
+        self.assertFalse(LockerStatusCount.objects.filter(location='nowhere').exists())
+
+    def test_generated_dataset_starts_without_drift(self):
+        call_command(
+            'generate_data', users=5, lockers=40, locations=3, reservations=100, seed=1,
+            prefix='drift', stdout=io.StringIO(),
+        )
+        self.assertEqual(Locker.objects.filter(locker_number__startswith='DRIFT').count(), 40)
+        self.assertCountersMatch()
+
+
+@override_settings(DATABASE_SHARDS=[])
+class BulkLockerUpdateTests(TestCase):
+    """Bulk edits write each locker's own changes over the row as it is at write time."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('bulk-user')
+        self.lockers = [Locker.objects.create(locker_number=f'BU{i}', location='bulk-site') for i in range(3)]
+
+    def test_reservation_made_during_a_bulk_edit_is_kept(self):
+        first, second, third = self.lockers
+        reservations = []
+        existing_numbers = bulk._existing_numbers
+
+        def reserve_meanwhile(numbers):
+            # Runs after the batch was read and validated, before it is written.
+            reservations.append(reserve_locker(self.user, first.pk))
+            return existing_numbers(numbers)
+
+        with mock.patch.object(bulk, '_existing_numbers', side_effect=reserve_meanwhile):
+            results = bulk.bulk_update_lockers([
+                {'id': first.pk, 'price_per_hour': '7.50'},
+                {'id': second.pk, 'status': 'maintenance'},
+                {'id': third.pk, 'locker_number': 'BU-renamed'},
+            ])
+
+        self.assertEqual([result['status'] for result in results], ['updated'] * 3)
+        self.assertTrue(reservations[0].ok)
+        self.assertEqual(
+            list(Locker.objects.order_by('pk').values_list('locker_number', 'status', 'price_per_hour')),
+            [('BU0', 'occupied', Decimal('7.50')), ('BU1', 'maintenance', Decimal('2.50')),
+             ('BU-renamed', 'available', Decimal('2.50'))],
+        )
+        self.assertEqual(reservations[0].reservation.status, 'active')
+        counts = dict(LockerStatusCount.objects.filter(location='bulk-site').values_list('status', 'count'))
+        self.assertEqual((counts['available'], counts['occupied'], counts['maintenance']), (1, 1, 1))
+
+    def test_lockers_deleted_before_the_write_are_reported(self):
+        first, second, _ = self.lockers
+        existing_numbers = bulk._existing_numbers
+
+        def delete_meanwhile(numbers):
+            Locker.objects.filter(pk=second.pk).delete()
+            return existing_numbers(numbers)
+
+        with mock.patch.object(bulk, '_existing_numbers', side_effect=delete_meanwhile):
+            results = bulk.bulk_update_lockers([
+                {'id': first.pk, 'location': 'bulk-annex'}, {'id': second.pk, 'location': 'bulk-annex'},
+            ])
+        self.assertEqual([result['status'] for result in results], ['updated', 'error'])
+        self.assertEqual(Locker.objects.get(pk=first.pk).location, 'bulk-annex')
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_malformed_ids_are_reported_per_item(self):
+        admin = User.objects.create_user('bulk-admin', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(admin)[1]}')
+        first = self.lockers[0]
+        response = client.patch('/api/admin/lockers/bulk/', [
+            {'id': [first.pk]}, {'id': {'pk': first.pk}}, {'id': True}, {'id': str(first.pk)},
+            {'price_per_hour': '1.00'}, {'id': first.pk, 'price_per_hour': '9.00'},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (1, 5))
+        self.assertEqual(
+            [result.get('errors', {}).get('id') for result in response.data['results']],
+            [[bulk.INVALID_ID]] * 4 + [['Locker not found'], None],
+        )
+        self.assertEqual(Locker.objects.get(pk=first.pk).price_per_hour, Decimal('9.00'))
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False)
+class ReservationExportTests(TestCase):
+    """The history export covers archived reservations as well as live ones."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('export-user', 'export@example.com')
+        locker = Locker.objects.create(locker_number='EX1', location='export-site')
+        now = timezone.now()
+        self.reservations = [
+            Reservation.objects.create(
+                user=self.user, locker=locker, start_time=now - timedelta(days=days),
+                end_time=now - timedelta(days=days) + timedelta(hours=1), status=status,
+            )
+            for days, status in ((200, 'completed'), (150, 'cancelled'), (100, 'completed'), (1, 'completed'))
+        ]
+        admin = User.objects.create_user('export-admin', is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(admin)[1]}')
+
+    def _export(self, query=''):
+        response = self.client.get(f'/api/admin/reservations/export.csv{query}')
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode().splitlines()[1:]
+        return [int(row.split(',')[0]) for row in rows]
+
+    def test_archived_reservations_are_exported(self):
+        archive(cutoff=timezone.now() - timedelta(days=120))
+        self.assertEqual(ArchivedReservation.objects.count(), 2)
+        ids = [reservation.pk for reservation in self.reservations]
+        self.assertEqual(self._export(), ids)
+
+        since = (timezone.now() - timedelta(days=160)).date().isoformat()
+        self.assertEqual(self._export(f'?from={since}'), ids[1:])
+        self.assertEqual(self._export(f'?from={since}&status=cancelled'), [ids[1]])
+        self.assertEqual(self._export('?status=active'), [])
+
+    def test_formula_cells_are_neutralised_in_csv(self):
+        User.objects.filter(pk=self.user.pk).update(username='=HYPERLINK("http://evil")', email='+1@example.com')
+        Locker.objects.filter(locker_number='EX1').update(location='@SUM(A1)')
+        response = self.client.get('/api/admin/reservations/export.csv')
+        row = next(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(
+            (row['username'], row['email'], row['location'], row['locker_number']),
+            ('\'=HYPERLINK("http://evil")', "'+1@example.com", "'@SUM(A1)", 'EX1'),
+        )
+
+        response = self.client.get('/api/admin/reservations/export.ndjson')
+        record = json.loads(b''.join(response.streaming_content).splitlines()[0])
+        self.assertEqual((record['username'], record['email']), ('=HYPERLINK("http://evil")', '+1@example.com'))
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False, DEBUG=False, METRICS_TOKEN=None)
+class MetricsTests(TestCase):
+    """Prometheus series for views, reservations and connections; /metrics is not public."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('metrics-user')
+        self.admin = User.objects.create_user('metrics-admin', is_staff=True)
+        self.locker = Locker.objects.create(locker_number='M1', location='metrics-site')
+
+    def _client(self, user=None, authorization=None):
+        client = APIClient()
+        if user is not None:
+            authorization = f'Bearer {tokens_for(user)[1]}'
+        if authorization is not None:
+            client.credentials(HTTP_AUTHORIZATION=authorization)
+        return client
+
+    def _value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_reservation_outcomes_are_counted(self):
+        reserved = self._value('smartlocker_reservations_total', kind='walk_up', outcome='reserved')
+        conflicts = self._value('smartlocker_reservations_total', kind='walk_up', outcome='conflict')
+        reserve_locker(self.user, self.locker.pk)
+        reserve_locker(self.admin, self.locker.pk)
+        self.assertEqual(self._value('smartlocker_reservations_total', kind='walk_up', outcome='reserved'), reserved + 1)
+        self.assertEqual(self._value('smartlocker_reservations_total', kind='walk_up', outcome='conflict'), conflicts + 1)
+
+    def test_latency_is_labelled_by_view_and_action(self):
+        series = [
+            ('LockerViewSet.list', 'GET'), ('LockerViewSet.reserve', 'POST'), ('get_current_user', 'GET'),
+        ]
+        before = [self._value('smartlocker_request_duration_seconds_count', view=view, method=method)
+                  for view, method in series]
+        client = self._client(self.user)
+        client.get('/api/lockers/')
+        client.post(f'/api/lockers/{self.locker.pk}/reserve/', {'duration': 1}, format='json')
+        client.get('/api/auth/me/')
+        after = [self._value('smartlocker_request_duration_seconds_count', view=view, method=method)
+                 for view, method in series]
+        self.assertEqual(after, [count + 1 for count in before])
+
+    def test_reused_connections_are_counted_on_both_paths(self):
+        connection.ensure_connection()
+        reused = self._value('smartlocker_db_connections_reused_total', alias='default')
+        middleware = MetricsMiddleware(lambda request: HttpResponse())
+        middleware(RequestFactory().get('/'))
+
+        async def respond(request):
+            return HttpResponse()
+        async_middleware = MetricsMiddleware(respond)
+        async_to_sync(async_middleware)(RequestFactory().get('/'))
+        self.assertEqual(self._value('smartlocker_db_connections_reused_total', alias='default'), reused + 2)
+
+    def test_metrics_need_a_token_or_staff(self):
+        self.assertEqual(self._client().get('/metrics').status_code, 403)
+        self.assertEqual(self._client(self.user).get('/metrics').status_code, 403)
+        self.assertEqual(self._client(authorization='Bearer not-a-token').get('/metrics').status_code, 403)
+        response = self._client(self.admin).get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'smartlocker_request_duration_seconds_bucket', response.content)
+
+        session = APIClient()
+        session.force_login(self.admin)
+        self.assertEqual(session.get('/metrics').status_code, 200)
+
+        with override_settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self._client(authorization='Bearer scrape-secret').get('/metrics').status_code, 200)
+            self.assertEqual(self._client(authorization='Bearer wrong').get('/metrics').status_code, 403)
+            self.assertEqual(self._client(self.admin).get('/metrics').status_code, 200)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self._client().get('/metrics').status_code, 200)
+            with override_settings(METRICS_TOKEN='scrape-secret'):
+                self.assertEqual(self._client().get('/metrics').status_code, 403)
+
+
+@override_settings(DATABASE_SHARDS=[], SECURE_SSL_REDIRECT=False)
+class RequestTimingTests(TestCase):
+    """Slow and N+1 requests are logged with their SQL counts, timings and repeated statements."""
+
+    def _records(self, logs):
+        return [json.loads(line.split('Request timing ', 1)[1]) for line in logs.output]
+
+    @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 1.0, 'SLOW_MS': 0, 'DUPLICATE_THRESHOLD': 5})
+    def test_slow_request_record(self):
+        Locker.objects.create(locker_number='T1', location='timing-site')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(User.objects.create_user("timing"))[1]}')
+        with self.assertLogs('myapp.requests', 'WARNING') as logs:
+            response = client.get('/api/lockers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", view;dur=[\d.]+, '
+                                                     r'render;dur=[\d.]+, total;dur=[\d.]+$')
+        [record] = self._records(logs)
+        self.assertEqual(
+            {key: record[key] for key in ('reason', 'method', 'path', 'view', 'status', 'duplicates')},
+            {'reason': 'slow', 'method': 'GET', 'path': '/api/lockers/', 'view': 'locker-list',
+             'status': 200, 'duplicates': []},
+        )
+        self.assertGreaterEqual(record['queries'], 1)
+        for key in ('total_ms', 'db_ms', 'view_ms', 'render_ms'):
+            self.assertIsInstance(record[key], (int, float), key)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertLessEqual(record['db_ms'], record['total_ms'])
+
+    @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 1.0, 'SLOW_MS': 60_000, 'DUPLICATE_THRESHOLD': 3})
+    def test_repeated_statements_are_grouped_and_shortened(self):
+        def view(request):
+            middleware.process_view(request, view, (), {})
+            for i in range(3):
+                Locker.objects.filter(pk__in=range(i, i + 600)).exists()
+                Locker.objects.bulk_create([Locker(locker_number=f'D{i}-{n}', location='dup') for n in range(50)])
+            Locker.objects.filter(location='dup').count()
+            return HttpResponse()
+
+        middleware = RequestTimingMiddleware(view)
+        with self.assertLogs('myapp.requests', 'WARNING') as logs:
+            middleware(RequestFactory().get('/n-plus-one/'))
+        [record] = self._records(logs)
+        self.assertEqual(record['reason'], 'duplicate_queries')
+        self.assertGreaterEqual(record['queries'], 7)
+        duplicates = {entry['sql']: entry['count'] for entry in record['duplicates']}
+        # The bulk inserts also repeat their counter updates.
+        self.assertEqual(set(duplicates.values()), {3})
+        for sql in duplicates:
+            self.assertLessEqual(len(sql), middleware_module.MAX_SQL_LENGTH + 3)
+            self.assertNotIn('%s, %s', sql)
+        self.assertTrue(any(' IN (%s, ...)' in sql for sql in duplicates), duplicates)
+        self.assertTrue(any('VALUES (%s, ...), ...' in sql for sql in duplicates), duplicates)
+
+    def test_long_statements_are_truncated(self):
+        sql = 'SELECT ' + ', '.join(f'"column_{i}"' for i in range(500)) + ' FROM "lockers"'
+        shortened = middleware_module._loggable_sql(sql)
+        self.assertEqual(shortened, sql[:middleware_module.MAX_SQL_LENGTH] + '...')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], REPLICA_STICKY_SECONDS=10, REPLICA_PIN_CACHE='default')
+class ReplicaRoutingTests(SimpleTestCase):
+    """Where ``ReplicaMiddleware`` and ``ReplicaRouter`` send reads and writes."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = RequestFactory()
+
+    def _request(self, method, user_id=None, during=lambda: None):
+        """Run a request; returns ``during``'s result, computed while it is handled."""
+        headers = {}
+        if user_id is not None:
+            token = AccessToken()
+            token['user_id'] = user_id
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        seen = []
+        middleware = ReplicaMiddleware(lambda request: seen.append(during()))
+        middleware(getattr(self.factory, method.lower())('/api/lockers/', **headers))
+        return seen[0]
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(router.db_for_read(Locker), 'default')
+
+    def test_safe_requests_read_from_a_replica(self):
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(Locker)), 'replica_1')
+        self.assertEqual(self._request('GET', during=lambda: router.db_for_read(Locker)), 'replica_1')
+
+    def test_revocations_are_read_from_the_primary(self):
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(RevokedToken)), 'default')
+
+    def test_unsafe_requests_use_the_primary(self):
+        self.assertEqual(self._request('POST', 1, lambda: router.db_for_read(Locker)), 'default')
+        self.assertEqual(self._request('POST', 1, lambda: router.db_for_write(Locker)), 'default')
+
+    def test_reads_after_a_write_stick_to_the_primary(self):
+        def write_then_read():
+            router.db_for_write(Reservation)
+            return router.db_for_read(Locker)
+
+        self.assertEqual(self._request('GET', 1, write_then_read), 'default')
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(Locker)), 'default')
+        self.assertEqual(self._request('GET', 2, lambda: router.db_for_read(Locker)), 'replica_1')
+
+    def test_writes_pin_the_user_for_the_window(self):
+        self._request('POST', 1, lambda: router.db_for_write(Reservation))
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(Locker)), 'default')
+        caches['default'].delete('replica-pin:1')  # the window passing
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(Locker)), 'replica_1')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        self.assertEqual(self._request('GET', 1, lambda: router.db_for_read(Locker)), 'default')
+
+    def test_pin_cache_must_be_shared_between_workers(self):
+        self.assertEqual([error.id for error in routers.check_pin_cache()], ['myapp.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(routers.check_pin_cache(), [])
+        with override_settings(REPLICA_PIN_CACHE='pins'):
+            self.assertEqual([error.id for error in routers.check_pin_cache()], ['myapp.E002'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(routers.check_pin_cache(), [])
+
+
+@override_settings(DATABASE_SHARDS=['shard_1', 'shard_2'], SHARD_LOCATIONS={'North': 'shard_2'}, SHARD_ID_SPAN=1000)
+class ShardRoutingTests(SimpleTestCase):
+    """Where ``ShardRouter`` and ``sharded`` send locker and reservation queries."""
+
+    def test_locations_map_to_shards(self):
+        self.assertEqual(shard_for_location('North'), 'shard_2')
+        # Unpinned locations hash to a stable shard.
+        self.assertIn(shard_for_location('Harbour'), ['shard_1', 'shard_2'])
+        self.assertEqual(shard_for_location('Harbour'), shard_for_location('Harbour'))
+
+    def test_ids_name_their_shard(self):
+        self.assertEqual(shard_for_id(1001), 'shard_1')
+        self.assertEqual(shard_for_id(2000), 'shard_1')
+        self.assertEqual(shard_for_id(2001), 'shard_2')
+        self.assertIsNone(shard_for_id(5))
+        self.assertIsNone(shard_for_id(3001))
+
+    def test_new_rows_follow_their_location_or_locker(self):
+        self.assertEqual(router.db_for_write(Locker, instance=Locker(location='North')), 'shard_2')
+        self.assertEqual(router.db_for_write(LockerStatusCount, instance=LockerStatusCount(location='North')), 'shard_2')
+        self.assertEqual(router.db_for_write(Reservation, instance=Reservation(locker_id=1500)), 'shard_1')
+        self.assertEqual(router.db_for_write(Locker, pk=2500), 'shard_2')
+
+    def test_users_stay_on_the_primary(self):
+        reservation = Reservation(locker_id=1500)
+        reservation._state.db = 'shard_1'
+        self.assertEqual(router.db_for_read(User, instance=reservation), 'default')
+        self.assertEqual(router.db_for_write(User), 'default')
+
+    def test_filters_narrow_to_the_owning_shard(self):
+        lockers = sharded(Locker.objects.all())
+        self.assertIsInstance(lockers, ShardedQuerySet)
+        self.assertEqual(lockers.filter(pk=2500).db, 'shard_2')
+        self.assertEqual(lockers.filter(location='North').db, 'shard_2')
+        self.assertEqual(sharded(Reservation.objects.all()).filter(locker_id=1500).db, 'shard_1')
+        self.assertIsInstance(lockers.filter(pk__in=[1500, 2500]), ShardedQuerySet)
+        self.assertTrue(lockers.filter(pk=5).query.is_empty())  # outside every range: no query at all
+
+    def test_explicit_databases_are_left_alone(self):
+        queryset = Locker.objects.using('default')
+        self.assertIs(sharded(queryset), queryset)
+        with override_settings(DATABASE_SHARDS=[]):
+            queryset = Locker.objects.all()
+            self.assertIs(sharded(queryset), queryset)
+
+
+@unittest.skipUnless(len(settings.DATABASE_SHARDS) >= 2, 'needs DATABASE_SHARD_URLS with two or more shards')
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ShardedReservationTests(TransactionTestCase):
+    """Lockers and reservations on several shards, read back through the API."""
+    databases = '__all__'
+
+    def setUp(self):
+        caches['default'].clear()
+        self.shards = settings.DATABASE_SHARDS[:2]
+        self.locations = {alias: f'site-{alias}' for alias in self.shards}
+        self.admin = User.objects.create_user('shard-admin', 'admin@example.com', 'secret123', is_staff=True)
+        self.user = User.objects.create_user('shard-user', 'user@example.com', 'secret123')
+        self.client = self._client(self.admin)
+
+    def _client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user)[1]}')
+        return client
+
+    def _create(self, count=3):
+        lockers = [
+            {'locker_number': f'{alias[-1]}-{i}', 'location': location}
+            for alias, location in self.locations.items() for i in range(count)
+        ]
+        with override_settings(SHARD_LOCATIONS={location: alias for alias, location in self.locations.items()}):
+            response = self.client.post('/api/admin/lockers/bulk/', lockers, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [result['id'] for result in response.data['results']]
+
+    def test_lockers_are_written_to_their_shard_with_its_ids(self):
+        ids = self._create()
+        for alias in self.shards:
+            on_shard = set(Locker.objects.using(alias).values_list('id', flat=True))
+            self.assertEqual(len(on_shard), 3)
+            self.assertEqual({shard_for_id(pk) for pk in on_shard}, {alias})
+        self.assertEqual(set(ids), set(sharded(Locker.objects.all()).values_list('id', flat=True)))
+        self.assertFalse(Locker.objects.using('default').exists())
+
+    def test_locker_numbers_are_unique_across_shards(self):
+        self._create()
+        first, second = self.shards
+        response = self.client.post(
+            '/api/admin/lockers/', {'locker_number': f'{first[-1]}-0', 'location': self.locations[second]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_merge_every_shard_in_order(self):
+        self._create()
+        client = self._client(self.user)
+        numbers, path = [], '/api/lockers/?page_size=4'
+        while path:
+            response = client.get(path)
+            numbers += [locker['locker_number'] for locker in response.data['results']]
+            path = response.data['next']
+        self.assertEqual(numbers, sorted(Locker.objects.using(alias).get(pk=pk).locker_number
+                                         for alias in self.shards
+                                         for pk in Locker.objects.using(alias).values_list('pk', flat=True)))
+
+    def test_reservations_live_with_their_locker(self):
+        ids = self._create(1)
+        client = self._client(self.user)
+        reservations = []
+        for locker_id in ids:
+            response = client.post(f'/api/lockers/{locker_id}/reserve/', {'duration': 1}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            reservations.append(response.data['reservation_id'])
+            self.assertEqual(shard_for_id(response.data['reservation_id']), shard_for_id(locker_id))
+
+        self.assertEqual({r['id'] for r in client.get('/api/reservations/').data}, set(reservations))
+        stats = self.client.get('/api/admin/lockers/stats/').data
+        self.assertEqual((stats['total_lockers'], stats['occupied_lockers']), (2, 2))
+
+        response = client.put(f'/api/reservations/{reservations[0]}/release/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.client.get('/api/admin/lockers/stats/').data['occupied_lockers'], 1)
+
+        export = b''.join(self.client.get('/api/admin/reservations/export.csv').streaming_content).decode()
+        rows = export.splitlines()[1:]
+        self.assertEqual([int(row.split(',')[0]) for row in rows], sorted(reservations))
+        self.assertTrue(all(',shard-user,user@example.com,' in row for row in rows))
+
+
+@override_settings(DATABASE_SHARDS=[], ROLLUP_SETTLE_SECONDS=0, SECURE_SSL_REDIRECT=False)
+class ReservationRollupTests(TestCase):
+    """Incremental rollups agree with a full recount, and the analytics endpoint reads them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rollup-user')
+        self.lockers = [
+            Locker.objects.create(locker_number=f'RU{i}', location=f'site-{i % 2}', price_per_hour=2)
+            for i in range(4)
+        ]
+
+    def _at(self, day, hour, minute=0):
+        return datetime(2026, 3, day, hour, minute, tzinfo=dt_timezone.utc)
+
+    def _rows(self):
+        return (
+            sorted(LockerRollup.objects.values_list(
+                'period', 'bucket', 'locker_id', 'location', 'reservations', 'occupied_seconds', 'revenue')),
+            sorted(LocationRollup.objects.values_list(
+                'period', 'bucket', 'location', 'reservations', 'occupied_seconds', 'revenue')),
+        )
+
+    def test_reservation_is_split_across_hours_and_days(self):
+        Reservation.objects.create(
+            user=self.user, locker=self.lockers[0], start_time=self._at(1, 23, 30), end_time=self._at(2, 1, 15),
+            status='completed', total_price=Decimal('3.50'),
+        )
+        rollups.roll_up()
+        hours = LockerRollup.objects.filter(period='hour').order_by('bucket')
+        self.assertEqual(
+            [(row.bucket.hour, row.reservations, row.occupied_seconds, row.revenue) for row in hours],
+            [(23, 1, 1800, Decimal('0')), (0, 0, 3600, Decimal('0')), (1, 0, 900, Decimal('3.50'))],
+        )
+        days = LocationRollup.objects.filter(period='day', location='site-0').order_by('bucket')
+        self.assertEqual(
+            [(row.bucket.day, row.reservations, row.occupied_seconds, row.revenue) for row in days],
+            [(1, 1, 1800, Decimal('0')), (2, 0, 4500, Decimal('3.50'))],
+        )
+
+    def test_incremental_passes_match_a_rebuild(self):
+        now = timezone.now()
+        for i in range(12):
+            start = now - timedelta(hours=30 - 2 * i, minutes=7 * i)
+            Reservation.objects.create(
+                user=self.user, locker=self.lockers[i % 4], start_time=start, end_time=start + timedelta(minutes=95),
+                status='cancelled' if i % 5 == 0 else 'completed', total_price=Decimal('1.25') * i,
+            )
+        rollups.roll_up(batch_size=5)
+
+        running = [reserve_locker(self.user, locker.pk).reservation for locker in self.lockers[:3]]
+        Reservation.objects.filter(pk__in=[r.pk for r in running]).update(start_time=now - timedelta(hours=3))
+        rollups.roll_up(batch_size=5)
+        release_reservation(Reservation.objects.get(pk=running[0].pk))
+        archive(cutoff=timezone.now())
+        pinned = timezone.now() + timedelta(hours=2)
+        rollups.roll_up(now=pinned, batch_size=5)
+        incremental = self._rows()
+
+        rollups.rebuild()
+        rollups.roll_up(now=pinned)
+        self.assertEqual(incremental, self._rows())
+
+    def test_deleted_reservations_stop_counting(self):
+        reservation = reserve_locker(self.user, self.lockers[0].pk).reservation
+        rollups.roll_up(now=timezone.now() + timedelta(hours=1))
+        before = self._rows()
+        reservation.delete()
+        rollups.roll_up(now=timezone.now() + timedelta(hours=5))
+        self.assertEqual(self._rows(), before)
+
+    def test_analytics_endpoint(self):
+        Reservation.objects.create(
+            user=self.user, locker=self.lockers[1], start_time=self._at(3, 10), end_time=self._at(3, 12),
+            status='completed', total_price=Decimal('4.00'),
+        )
+        rollups.roll_up()
+        admin = User.objects.create_user('rollup-admin', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(admin)[1]}')
+
+        response = client.get('/api/admin/analytics/?period=hour&from=2026-03-03T09:00:00Z&to=2026-03-03T13:00:00Z')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([bucket['occupied_hours'] for bucket in response.data['buckets']], [0, 1, 1, 0])
+        self.assertEqual(response.data['lockers'], 4)
+        self.assertEqual(response.data['totals']['revenue'], '4.00')
+        self.assertEqual(response.data['totals']['occupancy'], round(2 / (4 * 4), 4))
+        self.assertEqual(response.data['by_location']['site-1']['reservations'], 1)
+
+        response = client.get(f'/api/admin/analytics/?period=day&from=2026-03-01&to=2026-03-05&locker={self.lockers[1].pk}')
+        self.assertEqual([bucket['reservations'] for bucket in response.data['buckets']], [0, 0, 1, 0, 0])
+        self.assertEqual(client.get('/api/admin/analytics/?period=week').status_code, 400)
+        self.assertEqual(client.get('/api/admin/analytics/?period=hour&from=2020-01-01').status_code, 400)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(self.user)[1]}')
+        self.assertEqual(client.get('/api/admin/analytics/').status_code, 403)
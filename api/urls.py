@@ -1,23 +1,52 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views.auth_views import register_user, login_user, logout_user
+from .views.auth_views import register_user, login_user, logout_user, get_current_user
 from .views.locker_views import LockerViewSet
 from .views.admin_views import AdminLockerViewSet
+from .views.reservation_views import ReservationViewSet
+from .views.stream_views import locker_stream, locker_changes
+from .views.export_views import ReservationExportView
+from .views.import_views import UserImportView
+from .views.analytics_views import ReservationAnalyticsView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'lockers', LockerViewSet, basename='locker')
 router.register(r'admin/lockers', AdminLockerViewSet, basename='admin-locker')
+router.register(r'reservations', ReservationViewSet, basename='reservation')
 
 urlpatterns = [
     # Authentication endpoints
     path('auth/register/', register_user, name='register'),
     path('auth/login/', login_user, name='login'),
     path('auth/logout/', logout_user, name='logout'),
+    path('auth/me/', get_current_user, name='current-user'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    # Locker status push (ASGI)
+    path('lockers/stream/', locker_stream, name='locker-stream'),
+    path('lockers/changes/', locker_changes, name='locker-changes'),
+    # Reservation history export (CSV / NDJSON)
+    path('admin/reservations/export.<str:export_format>', ReservationExportView.as_view(), name='reservation-export'),
+    # Occupancy, revenue and turnover from the reservation rollups
+    path('admin/analytics/', ReservationAnalyticsView.as_view(), name='reservation-analytics'),
+    # Bulk user import (CSV / NDJSON)
+    path('admin/users/import.<str:import_format>', UserImportView.as_view(), name='user-import'),
     # API endpoints
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if settings.ASYNC_READ_VIEWS:
+    from .views import async_views
+
+    # Matched before the DRF routes above; they fall back to them for
+    # anything other than plain JSON GETs.
+    urlpatterns[:0] = [
+        path('auth/me/', async_views.current_user, name='current-user-async'),
+        path('lockers/', async_views.locker_list, name='locker-list-async'),
+        path('lockers/<int:pk>/', async_views.locker_detail, name='locker-detail-async'),
+        path('admin/lockers/stats/', async_views.locker_stats, name='admin-locker-stats-async'),
+    ]
\ No newline at end of file
@@ -0,0 +1,19 @@
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def parse_window_time(value):
+    """Parse an ISO-8601 timestamp from a request; naive values are taken as UTC.
+
+    Returns None for empty input and raises ValueError for malformed input.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
@@ -1,13 +1,26 @@
+from django.db import IntegrityError
 from rest_framework import viewsets, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from myapp.sharding import sharded
 from ..models import Locker
+from ..pagination import LockerCursorPagination
 from ..serializers import LockerSerializer
+from ..services.bulk import bulk_create_lockers, bulk_update_lockers, bulk_transition_status
+from ..services.stats import fleet_stats
+from .mixins import ClaimsAuthenticationMixin, LockerConditionalGetMixin, LockerFilterMixin, LockerRowListMixin
 
-class AdminLockerViewSet(viewsets.ModelViewSet):
+class AdminLockerViewSet(ClaimsAuthenticationMixin, LockerConditionalGetMixin, LockerRowListMixin, LockerFilterMixin,
+                         viewsets.ModelViewSet):
     queryset = Locker.objects.all().order_by('locker_number')
     serializer_class = LockerSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = LockerCursorPagination
+    claims_actions = ('list', 'retrieve', 'stats')
+
+    def get_queryset(self):
+        return sharded(super().get_queryset())
 
     def update(self, request, *args, **kwargs):
         try:
@@ -29,14 +42,41 @@ class AdminLockerViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        total_lockers = Locker.objects.count()
-        available_lockers = Locker.objects.filter(status='available').count()
-        occupied_lockers = Locker.objects.filter(status='occupied').count()
-        maintenance_lockers = Locker.objects.filter(status='maintenance').count()
-        
-        return Response({
-            'total_lockers': total_lockers,
-            'available_lockers': available_lockers,
-            'occupied_lockers': occupied_lockers,
-            'maintenance_lockers': maintenance_lockers
-        })
\ No newline at end of file
+        return Response(fleet_stats())
+
+    @action(detail=False, methods=['post', 'patch'])
+    def bulk(self, request):
+        """POST creates a batch of lockers; PATCH partially updates them by ``id``."""
+        try:
+            if request.method == 'POST':
+                results = bulk_create_lockers(request.data)
+            else:
+                results = bulk_update_lockers(request.data)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response(
+                {'error': 'A concurrent change conflicted with this batch; retry it'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return self._bulk_response(results)
+
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """Move ``ids`` to ``status`` (optionally only those currently in ``from_status``)."""
+        try:
+            results = bulk_transition_status(
+                request.data.get('ids'),
+                request.data.get('status'),
+                request.data.get('from_status'),
+            )
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        return self._bulk_response(results, failed=('not_found',))
+
+    def _bulk_response(self, results, failed=('error',)):
+        failures = sum(1 for result in results if result['status'] in failed)
+        return Response(
+            {'succeeded': len(results) - failures, 'failed': failures, 'results': results},
+            status=status.HTTP_207_MULTI_STATUS if failures else status.HTTP_200_OK
+        )
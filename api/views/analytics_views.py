@@ -0,0 +1,20 @@
+from rest_framework import permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from ..services.rollups import parse_query, report
+
+
+class ReservationAnalyticsView(APIView):
+    """Reservations, occupancy and revenue per hour or day, read from the rollup tables.
+
+    Filtered by ``from``, ``to``, and either ``location`` or ``locker``.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        try:
+            query = parse_query(request.query_params)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report(**query))
@@ -0,0 +1,172 @@
+"""
+Async implementations of the read-heavy endpoints.
+
+Served under ASGI in place of the DRF views (see ``ASYNC_READ_VIEWS``), so a
+slow query parks a coroutine instead of a worker. Responses match the DRF
+views byte for byte and share their cache entries. The access token is
+checked without a user lookup; as in the DRF views, the user comes from the
+token's claims (locker reads, stats) or the authentication user cache
+(current user, and claims older than ``JWT_CLAIMS_MAX_AGE``), see
+``api.authentication``. Anything these views do not handle - other methods,
+the browsable API, indented JSON, missing or rejected tokens - is passed to
+the DRF view.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from myapp.sharding import sharded
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from ..authentication import CachedJWTAuthentication, ClaimsJWTAuthentication, aaccess_token
+from ..models import Locker
+from ..pagination import LockerCursorPagination
+from ..renderers import FastJSONRenderer
+from ..serializers import LockerRowSerializer, LockerSerializer, requested_fields
+from ..services.cache import aread_through
+from ..services.stats import afleet_stats
+from ..services.versioning import LOCKERS, aget_version
+from .admin_views import AdminLockerViewSet
+from .auth_views import get_current_user
+from .locker_views import LockerViewSet
+from .mixins import filter_lockers, locker_cache_key, not_modified_response, with_validators
+
+ALLOW = 'GET, HEAD, OPTIONS'
+
+
+def _json(data, status=200):
+    response = HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+    response['Vary'] = 'Accept'
+    return response
+
+
+def _error(exc):
+    response = _json({'detail': exc.detail} if not isinstance(exc.detail, (dict, list)) else exc.detail,
+                     status=exc.status_code)
+    if isinstance(exc, exceptions.AuthenticationFailed):
+        response['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+def _handled_by_drf(request):
+    if request.method != 'GET':
+        return True
+    accept = request.headers.get('Accept', '')
+    return 'text/html' in accept or 'indent=' in accept or request.GET.get('format') not in (None, 'json')
+
+
+def sync_fallback(drf_view, allow=ALLOW):
+    """Route requests the async view does not cover to ``drf_view``.
+
+    ``allow`` is the DRF view's ``Allow`` header, repeated on async responses.
+    """
+    drf_view = sync_to_async(drf_view)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if _handled_by_drf(request):
+                return await drf_view(request, *args, **kwargs)
+            token = await aaccess_token(request)
+            if token is None:
+                return await drf_view(request, *args, **kwargs)
+            request.auth = token
+            try:
+                response = await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                response = _error(exc)
+            response['Allow'] = allow
+            return response
+        return wrapper
+    return decorator
+
+
+async def _user(request, authentication=CachedJWTAuthentication):
+    return await authentication().aget_user(request.auth)
+
+
+async def _cached_locker_payload(request, version, view_name, compute):
+    async def computed():
+        return await compute(), True
+    return await aread_through(locker_cache_key(view_name, request, version), computed)
+
+
+def _available_lockers(request):
+    return filter_lockers(
+        sharded(Locker.objects.filter(status='available').order_by('locker_number')),
+        request, LockerSerializer.Meta.fields,
+    )
+
+
+@sync_fallback(LockerViewSet.as_view({'get': 'list'}))
+async def locker_list(request):
+    await _user(request, ClaimsJWTAuthentication)
+    version, updated_at = await aget_version(LOCKERS)
+    response = not_modified_response(request, version, updated_at)
+    if response is not None:
+        response['Vary'] = 'Accept'
+        return with_validators(response, version, updated_at)
+
+    drf_request = Request(request)
+
+    async def page():
+        rows = LockerRowSerializer(fields=requested_fields(drf_request))
+        paginator = LockerCursorPagination()
+        # DRF's cursor pagination evaluates the page itself, synchronously.
+        results = await sync_to_async(paginator.paginate_queryset)(
+            rows.queryset(_available_lockers(drf_request)), drf_request
+        )
+        return {
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': rows.to_representation(results),
+        }
+
+    data = await _cached_locker_payload(request, version, LockerViewSet.__name__, page)
+    return with_validators(_json(data), version, updated_at)
+
+
+@sync_fallback(LockerViewSet.as_view({'get': 'retrieve'}))
+async def locker_detail(request, pk):
+    await _user(request, ClaimsJWTAuthentication)
+    version, updated_at = await aget_version(LOCKERS)
+    response = not_modified_response(request, version, updated_at)
+    if response is not None:
+        response['Vary'] = 'Accept'
+        return with_validators(response, version, updated_at)
+
+    drf_request = Request(request)
+
+    async def detail():
+        rows = LockerRowSerializer(fields=requested_fields(drf_request))
+        row = await rows.queryset(_available_lockers(drf_request).filter(pk=pk)).afirst()
+        return None if row is None else rows.to_representation([row])[0]
+
+    data = await _cached_locker_payload(request, version, LockerViewSet.__name__, detail)
+    if data is None:
+        raise exceptions.NotFound('No Locker matches the given query.')
+    return with_validators(_json(data), version, updated_at)
+
+
+@sync_fallback(AdminLockerViewSet.as_view({'get': 'stats'}))
+async def locker_stats(request):
+    user = await _user(request, ClaimsJWTAuthentication)
+    if not user.is_staff:
+        raise exceptions.PermissionDenied()
+    return _json(await afleet_stats())
+
+
+@sync_fallback(get_current_user, allow=', '.join(get_current_user.cls().allowed_methods))
+async def current_user(request):
+    user = await _user(request)
+    return _json({
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'is_admin': user.is_staff or user.is_superuser,
+        }
+    })
@@ -3,15 +3,40 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth import authenticate
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.db import IntegrityError
+from django.db.models import Q
+from myapp.routers import pin_to_primary
+from ..authentication import tokens_for
+from ..services.revocation import revoke
+from ..services.throttle import HashingBusy, hashing_slot, login_retry_after
 import logging
+import math
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+
+def _too_many_attempts(retry_after):
+    return Response(
+        {'error': 'Too many attempts, please try again later'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(math.ceil(retry_after))}
+    )
+
+
+def _hashing_busy():
+    return Response(
+        {'error': 'Server busy, please try again shortly'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'}
+    )
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @csrf_exempt
@@ -36,35 +61,38 @@ def register_user(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if User.objects.filter(username=username).exists():
-            return Response(
-                {'error': 'Username already exists'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        retry_after = login_retry_after(request)
+        if retry_after:
+            return _too_many_attempts(retry_after)
 
-        if User.objects.filter(email=email).exists():
+        taken = User.objects.filter(Q(username=username) | Q(email=email)).values_list('username', flat=True).first()
+        if taken is not None:
             return Response(
-                {'error': 'Email already exists'}, 
+                {'error': 'Username already exists' if taken == username else 'Email already exists'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         # Create user
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            first_name=first_name,
-            last_name=last_name
-        )
+        with hashing_slot():
+            user = User.objects.create_user(
+                username=username,
+                email=email,
+                password=password,
+                first_name=first_name,
+                last_name=last_name
+            )
+
+        # The new account's first requests must not look for it on a replica.
+        pin_to_primary(user.id)
 
         # Generate tokens
-        refresh = RefreshToken.for_user(user)
+        refresh, access = tokens_for(user)
         
         logger.info(f"New user registered: {username}")
         
         return Response({
             'refresh': str(refresh),
-            'access': str(refresh.access_token),
+            'access': str(access),
             'user': {
                 'id': user.id,
                 'username': user.username,
@@ -75,6 +103,9 @@ def register_user(request):
             }
         }, status=status.HTTP_201_CREATED)
 
+    except HashingBusy:
+        logger.warning("Registration refused: no password hashing slot free")
+        return _hashing_busy()
     except IntegrityError as e:
         logger.error(f"Integrity error during registration: {e}")
         return Response(
@@ -103,7 +134,14 @@ def login_user(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = authenticate(username=username, password=password)
+        # Refused attempts cost no password hash.
+        retry_after = login_retry_after(request, username)
+        if retry_after:
+            logger.warning(f"Login attempt throttled for username: {username}")
+            return _too_many_attempts(retry_after)
+
+        with hashing_slot():
+            user = authenticate(username=username, password=password)
         
         if user is not None:
             if not user.is_active:
@@ -112,13 +150,13 @@ def login_user(request):
                     status=status.HTTP_401_UNAUTHORIZED
                 )
             
-            refresh = RefreshToken.for_user(user)
+            refresh, access = tokens_for(user)
             
             logger.info(f"User logged in: {username}")
             
             return Response({
                 'refresh': str(refresh),
-                'access': str(refresh.access_token),
+                'access': str(access),
                 'user': {
                     'id': user.id,
                     'username': user.username,
@@ -135,6 +173,9 @@ def login_user(request):
                 status=status.HTTP_401_UNAUTHORIZED
             )
             
+    except HashingBusy:
+        logger.warning("Login refused: no password hashing slot free")
+        return _hashing_busy()
     except Exception as e:
         logger.error(f"Login error: {e}")
         return Response(
@@ -145,17 +186,30 @@ def login_user(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_user(request):
+    """Revoke the access token used for this request and, if sent, the ``refresh`` token."""
     try:
-        # With JWT, we can't actually invalidate the token on server side
-        # without additional setup. This is a placeholder for future implementation.
-        # You might want to add token blacklisting here if needed.
-        
+        refresh = None
+        if request.data.get('refresh'):
+            try:
+                refresh = RefreshToken(request.data['refresh'])
+            except TokenError:
+                return Response(
+                    {'error': 'Invalid refresh token'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if refresh.get(jwt_settings.USER_ID_CLAIM) != request.auth.get(jwt_settings.USER_ID_CLAIM):
+                return Response(
+                    {'error': 'Refresh token belongs to another user'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        revoke(request.auth)
+        if refresh is not None:
+            revoke(refresh)
+
         logger.info(f"User logged out: {request.user.username}")
-        
-        return Response({
-            'message': 'Logged out successfully',
-            'note': 'For complete logout, remove tokens from client storage'
-        })
+
+        return Response({'message': 'Logged out successfully'})
     except Exception as e:
         logger.error(f"Logout error: {e}")
         return Response(
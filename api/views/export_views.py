@@ -0,0 +1,47 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from ..services.export import FORMATS, aiter_export, export_queryset, iter_export, parse_filters
+
+
+class JSONErrorsNegotiation(BaseContentNegotiation):
+    """The body format comes from the URL; only error responses are rendered, always as JSON."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ReservationExportView(APIView):
+    """Stream reservation history as CSV or NDJSON, filtered by ``from``, ``to`` and ``status``."""
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [JSONRenderer]
+    content_negotiation_class = JSONErrorsNegotiation
+
+    def get(self, request, export_format):
+        if export_format not in FORMATS:
+            raise Http404
+        try:
+            queryset = export_queryset(**parse_filters(request.query_params))
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        # Under ASGI a synchronous iterator would be collected into a list
+        # before the first byte is sent.
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_export(queryset, export_format)
+        else:
+            content = iter_export(queryset, export_format)
+        response = StreamingHttpResponse(content, content_type=FORMATS[export_format][0])
+        filename = f'reservations-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
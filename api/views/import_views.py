@@ -0,0 +1,47 @@
+import io
+
+from django.conf import settings
+from django.http import Http404
+from rest_framework import permissions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from ..services.throttle import HashingBusy
+from ..services.user_import import FORMATS, import_users, read_rows
+
+
+class UserImportView(APIView):
+    """Create users from a CSV or NDJSON request body; one result per row."""
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [JSONRenderer]
+
+    def post(self, request, import_format):
+        if import_format not in FORMATS:
+            raise Http404
+        try:
+            text = request.body.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return Response({'error': 'The file must be UTF-8'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = list(read_rows(io.StringIO(text, newline=''), import_format))
+        if len(rows) > settings.USER_IMPORT_MAX_ROWS:
+            return Response(
+                {'error': f'At most {settings.USER_IMPORT_MAX_ROWS} users per request; '
+                          f'use manage.py import_users for larger files'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        try:
+            # Hashing takes slots from the same gate as logins and registrations.
+            results = import_users(
+                rows, workers=settings.USER_IMPORT_WORKERS, iterations=settings.USER_IMPORT_ITERATIONS, gated=True,
+            )
+        except HashingBusy:
+            return Response(
+                {'error': 'Server busy, please try again shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'}
+            )
+        failures = sum(1 for result in results if result['status'] == 'error')
+        return Response(
+            {'succeeded': len(results) - failures, 'failed': failures, 'results': results},
+            status=status.HTTP_207_MULTI_STATUS if failures else status.HTTP_200_OK
+        )
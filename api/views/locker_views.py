@@ -1,28 +1,55 @@
-from rest_framework import viewsets, permissions, serializers
+from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from myapp.sharding import sharded
 from api.models import Locker
+from api.pagination import LockerCursorPagination
+from api.serializers import LockerSerializer
+from api.services.reservations import reserve_locker, free_lockers, NOT_FOUND
+from api.utils import parse_window_time
+from .mixins import ClaimsAuthenticationMixin, LockerConditionalGetMixin, LockerFilterMixin, LockerRowListMixin
 
-# Create serializer directly in this file
-class LockerSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Locker
-        fields = ['id', 'locker_number', 'location', 'price_per_hour', 'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
-
-class LockerViewSet(viewsets.ReadOnlyModelViewSet):
+class LockerViewSet(ClaimsAuthenticationMixin, LockerConditionalGetMixin, LockerRowListMixin, LockerFilterMixin,
+                    viewsets.ReadOnlyModelViewSet):
     serializer_class = LockerSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LockerCursorPagination
+    # ``reserve`` needs the user row.
+    claims_actions = ('list', 'retrieve', 'available')
 
     def get_queryset(self):
-        return Locker.objects.filter(status='available').order_by('locker_number')
+        return sharded(Locker.objects.filter(status='available').order_by('locker_number'))
+
+    @action(detail=False, methods=['get'])
+    def available(self, request):
+        """Lockers free for the whole of ``[start, end)``; without a window, free right now."""
+        try:
+            start = parse_window_time(request.query_params.get('start'))
+            end = parse_window_time(request.query_params.get('end'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        if not start and not end:
+            return self.list(request)
+        if not start or not end or end <= start:
+            return Response({'error': 'start and end are both required, with start before end'}, status=400)
+
+        return self.row_response(self.filter_queryset(free_lockers(start, end)))
 
     @action(detail=True, methods=['post'])
     def reserve(self, request, pk=None):
-        locker = self.get_object()
-        if locker.status != 'available':
-            return Response({'error': 'Locker is not available'}, status=400)
-        
-        locker.status = 'occupied'
-        locker.save()
-        return Response({'message': 'Locker reserved successfully'})
\ No newline at end of file
+        duration = request.data.get('duration')
+        try:
+            duration = float(duration) if duration else None
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid duration'}, status=400)
+
+        result = reserve_locker(request.user, pk, duration)
+        if result.outcome == NOT_FOUND:
+            return Response({'error': 'Locker not found'}, status=404)
+        if not result.ok:
+            return Response({'error': 'Locker is not available'}, status=409)
+
+        return Response({
+            'message': 'Locker reserved successfully',
+            'reservation_id': result.reservation.id,
+        })
\ No newline at end of file
@@ -0,0 +1,142 @@
+from decimal import Decimal, InvalidOperation
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from ..authentication import ClaimsJWTAuthentication
+from ..serializers import LockerRowSerializer, requested_fields
+from ..services.cache import payload_key, read_through
+from ..services.versioning import LOCKERS, get_version, etag_for, last_modified_for
+
+
+class ClaimsAuthenticationMixin:
+    """Authenticate ``claims_actions`` from the access token's claims (``api.authentication``).
+
+    Those actions get a ``TokenUser`` and cost no user query; the others keep
+    the default authentication and a full ``User``.
+    """
+    claims_actions = ()
+
+    def get_authenticators(self):
+        # Called while the request is being initialized, before ``self.action`` is set.
+        if self.action_map.get(self.request.method.lower()) in self.claims_actions:
+            return [ClaimsJWTAuthentication()]
+        return super().get_authenticators()
+
+
+class LockerConditionalGetMixin:
+    """ETag / Last-Modified support for list and retrieve, keyed on the locker version.
+
+    The version is read before the queryset is evaluated, so a write racing
+    the request can only make the validator older than the body (forcing a
+    refetch next time), never newer. Full responses are served through the
+    read-through cache under the same version (``api.services.cache``).
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, super().retrieve, *args, **kwargs)
+
+    def _conditional(self, request, handler, *args, **kwargs):
+        version, updated_at = get_version(LOCKERS)
+        response = not_modified_response(request, version, updated_at)
+        if response is None:
+            response = self._read_through(request, version, handler, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return with_validators(response, version, updated_at)
+
+    def _read_through(self, request, version, handler, *args, **kwargs):
+        computed = []
+
+        def compute():
+            response = handler(request, *args, **kwargs)
+            computed.append(response)
+            return response.data, response.status_code == 200
+
+        data = read_through(locker_cache_key(type(self).__name__, request, version), compute)
+        return computed[0] if computed else Response(data)
+
+
+def not_modified_response(request, version, updated_at):
+    """A 304 when the client's validators match ``version``, else None."""
+    return get_conditional_response(
+        request,
+        etag=etag_for(LOCKERS, version),
+        last_modified=int(updated_at.timestamp()) if updated_at else None,
+    )
+
+
+def with_validators(response, version, updated_at):
+    response['ETag'] = etag_for(LOCKERS, version)
+    last_modified = last_modified_for(updated_at)
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def locker_cache_key(view_name, request, version):
+    # Host and scheme are part of the key: pagination links are absolute.
+    return payload_key(
+        LOCKERS, version, view_name, request.is_secure(), request.get_host(), request.get_full_path(),
+    )
+
+
+class LockerFilterMixin:
+    """``location`` / ``min_price`` / ``max_price`` filters and ``fields=`` column trimming.
+
+    Filters narrow the queryset before pagination, so they compose with the
+    keyset cursor. On GET requests ``fields=`` also limits the SELECT list;
+    ``locker_number`` is always loaded because the cursor is built from it.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return filter_lockers(queryset, self.request, self.get_serializer_class().Meta.fields)
+
+
+def filter_lockers(queryset, request, known_fields):
+    """Apply ``LockerFilterMixin``'s query parameters to ``queryset``."""
+    params = request.query_params
+
+    location = params.get('location')
+    if location:
+        queryset = queryset.filter(location=location)
+
+    for param, lookup in (('min_price', 'price_per_hour__gte'), ('max_price', 'price_per_hour__lte')):
+        value = params.get(param)
+        if value:
+            try:
+                queryset = queryset.filter(**{lookup: Decimal(value)})
+            except InvalidOperation:
+                raise ValidationError({param: 'A valid number is required.'})
+
+    if request.method == 'GET':
+        fields = requested_fields(request)
+        if fields:
+            unknown = fields - set(known_fields)
+            if unknown:
+                raise ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+            queryset = queryset.only(*(fields | {'locker_number'}))
+
+    return queryset
+
+
+class LockerRowListMixin:
+    """Serve locker lists from ``values_list`` rows via ``LockerRowSerializer``.
+
+    Output is identical to ``LockerSerializer``'s; no model instances are built.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.row_response(self.filter_queryset(self.get_queryset()))
+
+    def row_response(self, queryset):
+        rows = LockerRowSerializer(fields=requested_fields(self.request))
+        page = self.paginate_queryset(rows.queryset(queryset))
+        if page is None:
+            return Response(rows.to_representation(rows.queryset(queryset)))
+        return self.get_paginated_response(rows.to_representation(page))
@@ -1,11 +1,18 @@
-from rest_framework import viewsets, permissions, status
+from rest_framework import mixins, viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
-from ..models import Reservation, Locker
-from ..serializers import ReservationSerializer
+from myapp.sharding import sharded
+from ..models import ArchivedReservation, Reservation
+from ..pagination import ReservationHistoryPagination
+from ..serializers import ArchivedReservationSerializer, ReservationSerializer
+from ..services.reservations import reserve_locker, book_locker, release_reservation, NOT_FOUND
+from ..utils import parse_window_time
 
-class ReservationViewSet(viewsets.ModelViewSet):
+class ReservationViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                         viewsets.GenericViewSet):
+    # No update or destroy: a reservation only changes through ``release``
+    # (and the sweeper), which keep the locker's status in step with it.
     # ADD THIS LINE - Fix the router error
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
@@ -13,42 +20,77 @@ class ReservationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
+        queryset = sharded(Reservation.objects.select_related('locker'))
         if user.is_staff:
-            return Reservation.objects.all()
-        return Reservation.objects.filter(user=user)
-    
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+            return queryset
+        return queryset.filter(user=user)
     
     def create(self, request, *args, **kwargs):
         try:
             locker_id = request.data.get('locker')
-            reserved_until = request.data.get('reserved_until')
+            duration = request.data.get('duration')
+            duration = float(duration) if duration else None
+            start = parse_window_time(request.data.get('start_time'))
+            end = parse_window_time(request.data.get('end_time'))
             
-            # Check if locker exists and is available
-            try:
-                locker = Locker.objects.get(id=locker_id)
-            except Locker.DoesNotExist:
+            if not locker_id:
+                return Response(
+                    {'error': 'Locker is required'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            if start and start > timezone.now():
+                # Future window: book it without touching the locker's status.
+                if not end or end <= start:
+                    return Response(
+                        {'error': 'end_time must be after start_time'}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                result = book_locker(request.user, locker_id, start, end)
+            else:
+                if end and not duration:
+                    duration = (end - timezone.now()).total_seconds() / 3600
+                    if duration <= 0:
+                        return Response(
+                            {'error': 'end_time must be in the future'}, 
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+                result = reserve_locker(request.user, locker_id, duration)
+            
+            if result.outcome == NOT_FOUND:
                 return Response(
                     {'error': 'Locker not found'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            if locker.status != 'available':
+            if not result.ok:
                 return Response(
                     {'error': 'Locker is not available for reservation'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+                    status=status.HTTP_409_CONFLICT
                 )
             
-            # Update locker status
-            locker.status = 'occupied'
-            locker.save()
-            
-            return super().create(request, *args, **kwargs)
+            serializer = self.get_serializer(result.reservation)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """Archived reservations, newest first; admins may narrow to ``?user=<id>``."""
+        queryset = sharded(ArchivedReservation.objects.select_related('locker'))
+        if not request.user.is_staff:
+            queryset = queryset.filter(user=request.user)
+        elif request.query_params.get('user'):
+            try:
+                queryset = queryset.filter(user_id=int(request.query_params['user']))
+            except ValueError:
+                return Response({'error': 'user must be an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = ReservationHistoryPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(ArchivedReservationSerializer(page, many=True).data)
+    
     @action(detail=True, methods=['put'])
     def release(self, request, pk=None):
         try:
@@ -61,14 +103,11 @@ class ReservationViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Update locker status
-            locker = reservation.locker
-            locker.status = 'available'
-            locker.save()
-            
-            # Update reservation status
-            reservation.status = 'completed'
-            reservation.save()
+            if not release_reservation(reservation):
+                return Response(
+                    {'error': 'Reservation is not active'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             serializer = self.get_serializer(reservation)
             return Response({
@@ -0,0 +1,64 @@
+import json
+
+from django.http import JsonResponse, StreamingHttpResponse
+from ..authentication import aaccess_token
+from ..services.broker import broker
+
+HEARTBEAT_SECONDS = 15
+MAX_POLL_SECONDS = 30
+
+
+def _cursor(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _unauthorized():
+    return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+
+
+async def locker_stream(request):
+    """Server-Sent Events feed of locker status deltas."""
+    if await aaccess_token(request, query_param='token') is None:
+        return _unauthorized()
+
+    await broker.start()
+    since = _cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    if since is None:
+        since = broker.version
+
+    async def events(version):
+        yield f'retry: 3000\nid: {version}\nevent: hello\ndata: {{"version": {version}}}\n\n'
+        while True:
+            changes, current, reset = await broker.wait(version, HEARTBEAT_SECONDS)
+            if reset:
+                yield f'id: {current}\nevent: reset\ndata: {{"version": {current}}}\n\n'
+            elif changes:
+                payload = json.dumps({'version': current, 'changes': changes})
+                yield f'id: {current}\nevent: lockers\ndata: {payload}\n\n'
+            else:
+                yield ': ping\n\n'
+            version = current
+
+    response = StreamingHttpResponse(events(since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def locker_changes(request):
+    """Long-poll for locker status deltas after ``since=<version>``."""
+    if await aaccess_token(request, query_param='token') is None:
+        return _unauthorized()
+
+    await broker.start()
+    since = _cursor(request.GET.get('since'))
+    if since is None:
+        return JsonResponse({'version': broker.version, 'changes': [], 'reset': True})
+
+    timeout = _cursor(request.GET.get('timeout'))
+    timeout = MAX_POLL_SECONDS if timeout is None else min(timeout, MAX_POLL_SECONDS)
+    changes, current, reset = await broker.wait(since, timeout)
+    return JsonResponse({'version': current, 'changes': changes, 'reset': reset})
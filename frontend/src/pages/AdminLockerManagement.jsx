@@ -111,16 +111,23 @@ const AdminLockerManagement = () => {
   const fetchLockers = async () => {
     try {
       setLoading(true);
-      const response = await fetch(`${API_BASE_URL}/api/admin/lockers/`, {
-        headers: getAuthHeaders()
-      });
-
-      if (!response.ok) {
-        throw new Error('Failed to fetch lockers');
+      // The endpoint is cursor-paginated; follow `next` until the last page.
+      const allLockers = [];
+      let url = `${API_BASE_URL}/api/admin/lockers/`;
+      while (url) {
+        const response = await fetch(url, {
+          headers: getAuthHeaders()
+        });
+
+        if (!response.ok) {
+          throw new Error('Failed to fetch lockers');
+        }
+
+        const data = await response.json();
+        allLockers.push(...data.results);
+        url = data.next;
       }
-
-      const data = await response.json();
-      setLockers(data);
+      setLockers(allLockers);
     } catch (err) {
       setError('Failed to load lockers: ' + err.message);
     } finally {
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings, picked up automatically from the working directory.
+
+Each worker records Prometheus metrics into files under
+``PROMETHEUS_MULTIPROC_DIR`` so ``/metrics`` can aggregate every worker
+(see ``myapp.metrics``). The directory is emptied when the master starts and
+a worker's live gauges are dropped when it exits. Workers load the token
+revocation filters (``api.services.revocation``) before taking requests.
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'smartlocker-metrics'))
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    from django.db import DatabaseError, connections
+
+    from api.services.revocation import revocations
+    try:
+        revocations.sync(force=True)
+    except DatabaseError as e:
+        # Not migrated yet, say; the first request will try again.
+        worker.log.warning(f'Could not preload token revocations: {e}')
+    finally:
+        connections.close_all()
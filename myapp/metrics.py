@@ -0,0 +1,101 @@
+"""
+Prometheus metrics.
+
+Metrics are recorded in-process with ``prometheus_client``. When
+``PROMETHEUS_MULTIPROC_DIR`` is set (``gunicorn.conf.py`` sets it for every
+worker) each process writes its values to its own memory-mapped files in
+that directory and ``/metrics`` merges all of them, so any worker can answer
+a scrape with fleet-wide numbers. Recording touches only the calling
+process's files, so workers never contend with each other.
+
+``/metrics`` answers requests carrying ``METRICS_TOKEN`` and staff users
+(admin session or access token). Only with ``DEBUG`` on and no token
+configured is it open to everyone.
+"""
+import hmac
+import os
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    'smartlocker_request_duration_seconds', 'Request latency by view and action.',
+    ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESERVATIONS = Counter(
+    'smartlocker_reservations_total', 'Reservation attempts by kind and outcome.',
+    ['kind', 'outcome'],
+)
+CACHE_REQUESTS = Counter(
+    'smartlocker_cache_requests_total', 'Read-through cache lookups by cache and result (hit/miss).',
+    ['cache', 'result'],
+)
+DB_CONNECTIONS_OPENED = Counter(
+    'smartlocker_db_connections_opened_total', 'New database connections.', ['alias'],
+)
+DB_CONNECTIONS_REUSED = Counter(
+    'smartlocker_db_connections_reused_total',
+    'Requests served on a database connection opened by an earlier request.', ['alias'],
+)
+
+
+def _connection_opened(sender, connection, **kwargs):
+    DB_CONNECTIONS_OPENED.labels(connection.alias).inc()
+
+
+connection_created.connect(_connection_opened, dispatch_uid='smartlocker_db_connections_opened')
+
+
+def view_label(request):
+    """``LockerViewSet.list``, ``LockerViewSet.reserve``, ``login_user``..."""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None)
+    actions = getattr(func, 'actions', None)
+    if cls is not None and actions:
+        return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    if cls is not None and cls.__name__ != 'WrappedAPIView':
+        return cls.__name__
+    return getattr(func, '__name__', match._func_path)
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    from rest_framework.exceptions import APIException
+    from api.authentication import ClaimsJWTAuthentication
+    try:
+        authenticated = ClaimsJWTAuthentication().authenticate(request)
+    except APIException:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+def _allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        if hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return True
+    elif settings.DEBUG:
+        return True
+    return _is_staff(request)
+
+
+def metrics_view(request):
+    if not _allowed(request):
+        return HttpResponseForbidden()
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,331 @@
+"""
+Per-request timing and SQL instrumentation.
+
+Every request is timed end to end, which costs two clock reads. A sampled
+fraction (``REQUEST_TIMING['SAMPLE_RATE']``) additionally records every SQL
+statement through ``connection.execute_wrapper`` (count, time, repeated
+statements) and the time spent in the view and in rendering the response.
+Sampled responses carry a ``Server-Timing`` header; any request slower than
+``SLOW_MS``, or any sampled request that repeats one statement at least
+``DUPLICATE_THRESHOLD`` times (the N+1 shape), is logged as one JSON record
+on the ``myapp.requests`` logger. Repeated statements are logged with their
+``IN (...)`` and ``VALUES`` placeholder lists collapsed and cut at
+``MAX_SQL_LENGTH`` characters, so a bulk write does not produce a huge record.
+
+The recorder is found through a context variable by a wrapper installed
+once on every connection, so queries of async views - which run on
+``sync_to_async`` executor threads with their own connections - are counted
+as well.
+"""
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import routers
+from .metrics import DB_CONNECTIONS_REUSED, REQUEST_LATENCY, view_label
+
+logger = logging.getLogger('myapp.requests')
+
+DEFAULTS = {
+    'SAMPLE_RATE': 1.0,
+    'SLOW_MS': 500,
+    'DUPLICATE_THRESHOLD': 5,
+}
+MAX_SQL_LENGTH = 1000
+_PLACEHOLDERS = re.compile(r'%s(?:, %s)+')
+_ROWS = re.compile(r'(VALUES \([^()]*\))(?:, \([^()]*\))+')
+
+
+def _loggable_sql(sql):
+    """``sql`` with placeholder lists and ``VALUES`` rows collapsed, then truncated."""
+    sql = _ROWS.sub(r'\1, ...', _PLACEHOLDERS.sub('%s, ...', sql))
+    return sql if len(sql) <= MAX_SQL_LENGTH else sql[:MAX_SQL_LENGTH] + '...'
+
+
+class _QueryRecorder:
+    """``execute_wrapper`` that counts and times statements."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+
+_current_sample = ContextVar('request_timing_sample', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample.queries(execute, sql, params, many, context)
+
+
+def _instrument(connection, **kwargs):
+    # First in line: ``connection.execute_wrapper`` pops from the end.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+connection_created.connect(_instrument)
+
+
+class _Sample:
+    def __init__(self):
+        self.queries = _QueryRecorder()
+        self.view_started = None
+        self.view = 0.0
+        self.render_started = None
+        self.render = 0.0
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestTimingMiddleware:
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = {**DEFAULTS, **getattr(settings, 'REQUEST_TIMING', {})}
+        self.sample_rate = float(options['SAMPLE_RATE'])
+        self.slow_ms = float(options['SLOW_MS'])
+        self.duplicate_threshold = int(options['DUPLICATE_THRESHOLD'])
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        sample, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                _current_sample.reset(token)
+        self._finish(request, response, started, sample)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        sample, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                _current_sample.reset(token)
+        self._finish(request, response, started, sample)
+        return response
+
+    def _start(self, request):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None, None
+        # Connections opened before this module was imported.
+        for connection in connections.all(initialized_only=True):
+            _instrument(connection)
+        sample = request._timing_sample = _Sample()
+        return sample, _current_sample.set(sample)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = getattr(request, '_timing_sample', None)
+        if sample is not None:
+            sample.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time the two apart.
+        sample = getattr(request, '_timing_sample', None)
+        if sample is not None:
+            now = time.perf_counter()
+            if sample.view_started is not None:
+                sample.view = now - sample.view_started
+            sample.render_started = now
+            response.add_post_render_callback(lambda r: self._rendered(sample, r))
+        return response
+
+    @staticmethod
+    def _rendered(sample, response):
+        sample.render = time.perf_counter() - sample.render_started
+
+    def _finish(self, request, response, started, sample):
+        finished = time.perf_counter()
+        total_ms = _ms(finished - started)
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else None
+
+        if sample is None:
+            if total_ms >= self.slow_ms:
+                self._log('slow', request, response, view, total_ms, None)
+            return
+
+        if sample.render_started is None and sample.view_started is not None:
+            # Plain HttpResponse: nothing was rendered after the view.
+            sample.view = finished - sample.view_started
+        timings = [
+            f'db;dur={_ms(sample.queries.duration)};desc="{sample.queries.count} queries"',
+            f'view;dur={_ms(sample.view)}',
+            f'render;dur={_ms(sample.render)}',
+            f'total;dur={total_ms}',
+        ]
+        existing = response.get('Server-Timing')
+        response['Server-Timing'] = ', '.join(([existing] if existing else []) + timings)
+
+        duplicates = [
+            {'sql': _loggable_sql(sql), 'count': count}
+            for sql, count in sample.queries.statements.most_common()
+            if count >= self.duplicate_threshold
+        ]
+        if total_ms >= self.slow_ms:
+            self._log('slow', request, response, view, total_ms, sample, duplicates)
+        elif duplicates:
+            self._log('duplicate_queries', request, response, view, total_ms, sample, duplicates)
+
+    def _log(self, reason, request, response, view, total_ms, sample, duplicates=()):
+        record = {
+            'reason': reason,
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': total_ms,
+        }
+        if sample is not None:
+            record.update({
+                'queries': sample.queries.count,
+                'db_ms': _ms(sample.queries.duration),
+                'view_ms': _ms(sample.view),
+                'render_ms': _ms(sample.render),
+                'duplicates': duplicates,
+            })
+        logger.warning(f'Request timing {json.dumps(record)}')
+
+
+class MetricsMiddleware:
+    """Feed request latency and connection reuse into ``myapp.metrics``."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        self._count_reused_connections()
+        response = self.get_response(request)
+        self._observe(request, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        # Connections belong to the thread that runs the request's queries,
+        # not to the event loop.
+        await sync_to_async(self._count_reused_connections)()
+        response = await self.get_response(request)
+        self._observe(request, started)
+        return response
+
+    @staticmethod
+    def _count_reused_connections():
+        # With CONN_MAX_AGE a worker thread keeps its connection between
+        # requests; one that is already open here is being reused.
+        for connection in connections.all(initialized_only=True):
+            if connection.connection is not None:
+                DB_CONNECTIONS_REUSED.labels(connection.alias).inc()
+
+    @staticmethod
+    def _observe(request, started):
+        REQUEST_LATENCY.labels(view_label(request), request.method).observe(time.perf_counter() - started)
+
+
+class ReplicaMiddleware:
+    """Send the request's reads to a replica or the primary (see ``myapp.routers``)."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        user_id = routers.token_user_id(request)
+        token = routers.begin(request, user_id, routers.pinned(user_id))
+        try:
+            return self.get_response(request)
+        finally:
+            state = routers.end(token)
+            if state.wrote:
+                routers.pin_to_primary(state.user_id)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        user_id = routers.token_user_id(request)
+        token = routers.begin(request, user_id, await routers.apinned(user_id))
+        try:
+            return await self.get_response(request)
+        finally:
+            state = routers.end(token)
+            if state.wrote:
+                await routers.apin_to_primary(state.user_id)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """``WhiteNoiseMiddleware`` that can run on the ASGI event loop.
+
+    WhiteNoise's middleware is sync-only, which forces every middleware
+    above it, and the request itself, onto a thread under ASGI. Here
+    non-static requests pass straight through to the async handler and
+    only static files are served from a thread.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
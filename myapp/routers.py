@@ -0,0 +1,149 @@
+"""
+Read replicas with read-your-writes.
+
+``ReplicaMiddleware`` lets a GET, HEAD or OPTIONS request read from one of
+``DATABASE_REPLICAS``, picked at random, unless the requesting user wrote
+something in the last ``REPLICA_STICKY_SECONDS``. Everything else - writes,
+other methods, management commands, reads outside a request - uses the
+primary. The first write in a request switches its remaining reads to the
+primary too, and pins the user to the primary for the sticky window, so
+people see their own reservations and profile changes straight away even
+when the replicas lag.
+
+Users are told apart by the ``user_id`` claim of their bearer token, read
+without verifying it: the choice of database grants nothing, and the view
+still authenticates the token. Pins are kept in the ``REPLICA_PIN_CACHE``
+cache, which must be shared between workers for the window to hold across
+them; the system check ``check_pin_cache`` refuses a per-process one.
+"""
+import math
+import random
+from contextvars import ContextVar
+
+import jwt
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Read from the primary even in read-only requests: a lagging replica would
+# let a just-revoked token through (api.services.revocation).
+PRIMARY_ONLY = {'api.revokedtoken'}
+
+
+class _Routing:
+    """Routing state of one request."""
+
+    def __init__(self, user_id, replica):
+        self.user_id = user_id
+        self.replica = replica
+        self.wrote = False
+
+
+_current = ContextVar('db_routing', default=None)
+
+# Cache backends whose entries each process keeps to itself.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_pin_cache(app_configs=None, **kwargs):
+    """With replicas, pins must be kept where every worker sees them."""
+    if not settings.DATABASE_REPLICAS:
+        return []
+    alias = settings.REPLICA_PIN_CACHE
+    if alias not in settings.CACHES:
+        return [checks.Error(f'REPLICA_PIN_CACHE names {alias!r}, which is not in CACHES.', id='myapp.E002')]
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            f'REPLICA_PIN_CACHE {alias!r} uses {backend.rsplit(".", 1)[-1]}, which is not shared between '
+            'worker processes: a write pin set in one is invisible to the others, so users may not read '
+            'their own writes.',
+            hint='Point REPLICA_PIN_CACHE (or CACHE_BACKEND) at a shared cache such as Redis, Memcached, '
+                 'the database cache or, on one host, the file cache.',
+            id='myapp.E001',
+        )]
+    return []
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send ``user_id``'s reads to the primary for ``REPLICA_STICKY_SECONDS``."""
+    if settings.DATABASE_REPLICAS and user_id is not None:
+        caches[settings.REPLICA_PIN_CACHE].set(_pin_key(user_id), 1, math.ceil(settings.REPLICA_STICKY_SECONDS))
+
+
+async def apin_to_primary(user_id):
+    if settings.DATABASE_REPLICAS and user_id is not None:
+        await caches[settings.REPLICA_PIN_CACHE].aset(
+            _pin_key(user_id), 1, math.ceil(settings.REPLICA_STICKY_SECONDS),
+        )
+
+
+def token_user_id(request):
+    """The user id claimed by the request's bearer token, unverified; None without one."""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        claims = jwt.decode(header[7:], options={'verify_signature': False})
+    except jwt.InvalidTokenError:
+        return None
+    return claims.get(jwt_settings.USER_ID_CLAIM)
+
+
+def pinned(user_id):
+    return user_id is not None and caches[settings.REPLICA_PIN_CACHE].get(_pin_key(user_id)) is not None
+
+
+async def apinned(user_id):
+    return user_id is not None and await caches[settings.REPLICA_PIN_CACHE].aget(_pin_key(user_id)) is not None
+
+
+def begin(request, user_id, pinned):
+    """Start routing ``request``; returns the token for ``end``."""
+    replica = None
+    if request.method in SAFE_METHODS and not pinned:
+        replica = random.choice(settings.DATABASE_REPLICAS)
+    return _current.set(_Routing(user_id, replica))
+
+
+def end(token):
+    """Stop routing the request; returns its state (the caller pins a user who wrote)."""
+    state = _current.get()
+    _current.reset(token)
+    return state
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or state.replica is None or model._meta.label_lower in PRIMARY_ONLY:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+            state.replica = None
+        # Explicitly: Django would otherwise save a row read from a replica back to it.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary's schema.
+        return False if db in settings.DATABASE_REPLICAS else None
@@ -1,7 +1,9 @@
 """
 Django settings for myapp project.
 """
+import json
 import os
+import tempfile
 import dj_database_url
 from pathlib import Path
 from datetime import timedelta
@@ -53,8 +55,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Add this at the top
+    'myapp.middleware.MetricsMiddleware',
+    'myapp.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Moved up for better static file handling
+    'myapp.middleware.StaticFilesMiddleware',  # WhiteNoise; moved up for better static file handling
+    'myapp.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +99,77 @@ DATABASES = {
     )
 }
 
+# SQLite (local runs, benchmarks): take the write lock when a transaction
+# starts, so read-then-write transactions queue on the busy timeout instead
+# of failing with "database is locked" when they upgrade.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+
+# Read replicas (myapp.routers): DATABASE_REPLICA_URLS, comma-separated,
+# become the aliases replica_1, replica_2, ... Read-only requests read from
+# one of them; a user who writes reads from the primary for
+# REPLICA_STICKY_SECONDS, tracked in the REPLICA_PIN_CACHE cache, which must
+# be shared between workers (the system check refuses the default per-process
+# memory cache while replicas are configured). Locally, SQLite files kept in step by
+# `manage.py sync_replicas` can stand in for replicas.
+DATABASE_REPLICAS = []
+for i, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    alias = f'replica_{i}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    # Tests run against the primary's test database.
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['OPTIONS'] = {'timeout': 20, 'init_command': 'PRAGMA query_only = ON'}
+    DATABASE_REPLICAS.append(alias)
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', '10'))
+REPLICA_PIN_CACHE = os.environ.get('REPLICA_PIN_CACHE', 'default')
+
+# Location sharding (myapp.sharding): DATABASE_SHARD_URLS, comma-separated,
+# become the aliases shard_1, shard_2, ... and hold the lockers and their
+# reservations, each location on one shard; users and tokens stay on the
+# primary. Only ever append shards: a shard's position fixes its id range.
+# SHARD_LOCATIONS (a JSON object of location -> alias) pins locations to
+# shards; the others are placed by a hash of their name.
+DATABASE_SHARDS = []
+for i, url in enumerate(filter(None, os.environ.get('DATABASE_SHARD_URLS', '').split(',')), 1):
+    alias = f'shard_{i}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['OPTIONS'] = {'transaction_mode': 'IMMEDIATE', 'timeout': 20}
+        # A test database file per shard (not the in-memory default), so
+        # scatter-gather threads see what the test committed.
+        DATABASES[alias]['TEST'] = {'NAME': f'{DATABASES[alias]["NAME"]}.test'}
+    DATABASE_SHARDS.append(alias)
+SHARD_LOCATIONS = json.loads(os.environ.get('SHARD_LOCATIONS') or '{}')
+SHARD_ID_SPAN = 10 ** 12
+# Threads running per-shard queries in parallel, shared by all requests.
+SHARD_GATHER_THREADS = int(os.environ.get('SHARD_GATHER_THREADS', str(4 * max(len(DATABASE_SHARDS), 1))))
+DATABASE_ROUTERS = ['myapp.sharding.ShardRouter', 'myapp.routers.ReplicaRouter']
+
+
+# Cache: per-process memory by default. Point CACHE_BACKEND/CACHE_LOCATION at
+# a file directory or a shared server (e.g. django.core.cache.backends.redis.RedisCache
+# with redis://host:6379) to share entries between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'smartlocker'),
+    }
+}
+# Seconds a serialized locker payload is kept (entries are also versioned).
+LOCKER_CACHE_TIMEOUT = int(os.environ.get('LOCKER_CACHE_TIMEOUT', '300'))
+
+# Completed/cancelled reservations that ended this many days ago are moved
+# to the archive table by `manage.py archive_reservations`.
+RESERVATION_ARCHIVE_DAYS = int(os.environ.get('RESERVATION_ARCHIVE_DAYS', '90'))
+
+# Reservation rollups (`manage.py rollup_reservations`) read changes stamped
+# at least this long ago, so transactions still in flight are not skipped.
+ROLLUP_SETTLE_SECONDS = float(os.environ.get('ROLLUP_SETTLE_SECONDS', '60'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -113,6 +189,50 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Django's defaults, with PBKDF2 taking its iteration count from
+# PASSWORD_HASH_ITERATIONS (0: Django's own). Stored hashes made with another
+# count are rehashed on the user's next successful login.
+PASSWORD_HASHERS = [
+    'api.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '0'))
+
+# At most this many password hashes (login, registration) run at once on a
+# host, across all worker processes; a request waits up to
+# PASSWORD_HASH_WAIT_SECONDS for a slot, then gets 503 (api.services.throttle).
+# A waiting request holds a sync worker, so WSGI refuses at once; myapp/asgi.py,
+# where it only parks the request's own thread, sets a wait.
+PASSWORD_HASH_SLOTS = int(os.environ.get('PASSWORD_HASH_SLOTS', str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_WAIT_SECONDS = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS', '0'))
+PASSWORD_HASH_LOCK_DIR = os.environ.get(
+    'PASSWORD_HASH_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'smartlocker-hash-slots'),
+)
+
+# Bulk user import (api.services.user_import). Imported passwords are hashed
+# with USER_IMPORT_ITERATIONS PBKDF2 iterations (0: PASSWORD_HASH_ITERATIONS)
+# and brought up to full cost at each user's first login. The endpoint takes
+# USER_IMPORT_MAX_ROWS rows per request (larger files go through
+# manage.py import_users) and hashes them in USER_IMPORT_WORKERS processes.
+USER_IMPORT_ITERATIONS = int(os.environ.get('USER_IMPORT_ITERATIONS', '0'))
+USER_IMPORT_MAX_ROWS = int(os.environ.get('USER_IMPORT_MAX_ROWS', '1000'))
+USER_IMPORT_WORKERS = int(os.environ.get('USER_IMPORT_WORKERS', str(PASSWORD_HASH_SLOTS)))
+
+# Login and registration attempts: token buckets refilled at RATE per second
+# up to BURST, per client IP and per username (api.services.throttle).
+# CACHE names a cache in CACHES to share the buckets between processes;
+# empty keeps them in each process.
+LOGIN_THROTTLE = {
+    'IP_RATE': float(os.environ.get('LOGIN_IP_RATE', '0.2')),
+    'IP_BURST': int(os.environ.get('LOGIN_IP_BURST', '10')),
+    'USERNAME_RATE': float(os.environ.get('LOGIN_USERNAME_RATE', '0.05')),
+    'USERNAME_BURST': int(os.environ.get('LOGIN_USERNAME_BURST', '5')),
+    'CACHE': os.environ.get('LOGIN_THROTTLE_CACHE', ''),
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -146,11 +266,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Proxies in front of the app (Render's load balancer): the client IP
+    # used for throttling is taken this many entries from the end of
+    # X-Forwarded-For, which clients cannot forge. 0 ignores the header.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '1')),
 }
 
 # JWT Settings
@@ -159,6 +287,50 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Stamps fresh user claims into refreshed access tokens.
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.ClaimsTokenRefreshSerializer',
+}
+
+# How long the user claims in an access token are trusted, and how long a
+# process keeps user rows it loaded for authentication (api.authentication).
+# Deactivating or demoting a user takes effect within the larger of the two.
+JWT_CLAIMS_MAX_AGE = int(os.environ.get('JWT_CLAIMS_MAX_AGE', '300'))
+JWT_USER_CACHE_TTL = int(os.environ.get('JWT_USER_CACHE_TTL', '60'))
+
+# How often each process picks up tokens revoked by other processes
+# (api.services.revocation); a logout elsewhere applies within this window.
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.environ.get('TOKEN_REVOCATION_SYNC_SECONDS', '5'))
+
+# Request timing (myapp.middleware.RequestTimingMiddleware)
+REQUEST_TIMING = {
+    # Fraction of requests whose SQL is recorded and reported in Server-Timing.
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', '1.0' if DEBUG else '0.01')),
+    # Requests slower than this are always logged.
+    'SLOW_MS': float(os.environ.get('REQUEST_TIMING_SLOW_MS', '500')),
+    # A statement repeated this often in one request is reported as N+1.
+    'DUPLICATE_THRESHOLD': int(os.environ.get('REQUEST_TIMING_DUPLICATE_THRESHOLD', '5')),
+}
+
+# Serve the read-heavy endpoints from async views (api.views.async_views).
+# myapp/asgi.py turns this on; under WSGI the DRF views are used as before.
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', 'False').lower() == 'true'
+
+# Benchmarks only: sleep this long before every SQL statement (see bench_asgi).
+SIMULATED_DB_LATENCY_MS = float(os.environ.get('SIMULATED_DB_LATENCY_MS', '0'))
+
+# Bearer token for /metrics scrapers (staff users need none). Unset, /metrics
+# is open to everyone only when DEBUG is on.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'myapp.requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
 }
 
 # CORS Settings
@@ -0,0 +1,437 @@
+"""
+Location sharding of lockers and their reservations.
+
+With ``DATABASE_SHARDS`` configured, lockers, reservations (live and
+archived), the per-location status counters and the reservation rollups
+live in one database per shard instead of the primary; users, tokens and everything else stay on the
+primary. A location belongs to the shard ``SHARD_LOCATIONS`` names for it,
+or else to one picked by a stable hash of its name - pin every location
+before appending a shard, or the unpinned ones move.
+
+Each shard hands out ids from its own range of ``SHARD_ID_SPAN`` (see
+``reserve_id_range``), so an id alone names its shard and detail routes cost
+no directory lookup. ``ShardRouter`` places a row by its instance, or by a
+``pk`` or ``location`` hint; a query with none of those stays on the primary.
+Reads that span shards go through ``sharded`` - the same query run on every
+shard in parallel and merged in its ``ORDER BY`` - or ``gather``. A shard
+this thread has a transaction open on is read on that connection instead, so
+the transaction sees its own writes.
+
+Shards have no replicas: their reads are always current, and
+``ReplicaRouter`` only ever sees the primary's models.
+"""
+import heapq
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.query import (
+    FlatValuesListIterable, ModelIterable, NamedValuesListIterable, ValuesIterable, ValuesListIterable,
+)
+
+SHARDED_MODELS = {
+    'api.locker', 'api.reservation', 'api.archivedreservation', 'api.lockerstatuscount',
+    'api.lockerrollup', 'api.locationrollup', 'api.rollupopenreservation',
+}
+# Models placed through their locker rather than a location of their own.
+_BY_LOCKER = {'api.reservation', 'api.archivedreservation', 'api.lockerrollup', 'api.rollupopenreservation'}
+# Models whose ids come from their shard's range (a locker's or a reservation's).
+_SHARD_IDS = {'api.locker', 'api.reservation', 'api.archivedreservation', 'api.rollupopenreservation'}
+STREAM_CHUNKS = 2
+MAX_GET_RESULTS = 21
+
+
+def shard_for_location(location):
+    """The shard that owns ``location``."""
+    shards = settings.DATABASE_SHARDS
+    alias = settings.SHARD_LOCATIONS.get(location)
+    if alias is None:
+        return shards[zlib.crc32(location.encode()) % len(shards)]
+    if alias not in shards:
+        raise ImproperlyConfigured(f'SHARD_LOCATIONS maps {location!r} to unknown shard {alias!r}')
+    return alias
+
+
+def shard_for_id(pk):
+    """The shard whose id range holds ``pk``, or None."""
+    index = (int(pk) - 1) // settings.SHARD_ID_SPAN - 1
+    shards = settings.DATABASE_SHARDS
+    return shards[index] if 0 <= index < len(shards) else None
+
+
+def shard_databases():
+    """Every database holding lockers: the shards, or just the primary."""
+    return list(settings.DATABASE_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def reserve_id_range(using):
+    """Start ``using``'s locker and reservation ids in the shard's own range.
+
+    Run after every migrate (``api.signals``); a sequence already inside the
+    range is left alone.
+    """
+    if using not in settings.DATABASE_SHARDS:
+        return
+    from api.models import Locker, Reservation
+
+    base = (settings.DATABASE_SHARDS.index(using) + 1) * settings.SHARD_ID_SPAN
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in (Locker, Reservation):
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s', [base, table, base])
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                    'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                    [table, base, table],
+                )
+            elif connection.vendor == 'postgresql':
+                quote = connection.ops.quote_name
+                cursor.execute(
+                    f'SELECT setval(s, %s, false) FROM pg_get_serial_sequence(%s, %s) AS s '
+                    f'WHERE NOT EXISTS (SELECT 1 FROM {quote(table)} WHERE {quote("id")} > %s)',
+                    [base + 1, table, model._meta.pk.column, base],
+                )
+            else:
+                raise ImproperlyConfigured(f'Shard {using} is on {connection.vendor}; shards need SQLite or PostgreSQL')
+
+
+class ShardRouter:
+    def _shard(self, model, hints):
+        if not settings.DATABASE_SHARDS:
+            return None
+        label = model._meta.label_lower
+        instance = hints.get('instance')
+        if label not in SHARDED_MODELS:
+            # A user or token reached from a sharded row (reservation.user) is on the primary.
+            if instance is not None and instance._state.db in settings.DATABASE_SHARDS:
+                return DEFAULT_DB_ALIAS
+            return None
+
+        if instance is not None and isinstance(instance, model):
+            if instance._state.db in settings.DATABASE_SHARDS:
+                return instance._state.db
+            if label in _BY_LOCKER:
+                return shard_for_id(instance.locker_id) if instance.locker_id else None
+            return shard_for_location(instance.location)
+        if hints.get('pk') is not None:
+            return shard_for_id(hints['pk'])
+        if hints.get('location') is not None:
+            return shard_for_location(hints['location'])
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        shards = settings.DATABASE_SHARDS
+        db1, db2 = obj1._state.db, obj2._state.db
+        if db1 in shards or db2 in shards:
+            # Rows on one shard relate to each other and to the primary's users.
+            return db1 == db2 or DEFAULT_DB_ALIAS in (db1, db2) or None
+        return None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.SHARD_GATHER_THREADS, thread_name_prefix='shard-gather')
+    return _executor
+
+
+def _in_transaction(alias):
+    return connections[alias].in_atomic_block
+
+
+def _call(func, alias):
+    # Pool threads outlive requests: retire their connections the way a
+    # request boundary would.
+    connections[alias].close_if_unusable_or_obsolete()
+    return func(alias)
+
+
+def gather(func, aliases):
+    """``[func(alias) for alias in aliases]``, the calls running in parallel."""
+    aliases = list(aliases)
+    if len(aliases) < 2:
+        return [func(alias) for alias in aliases]
+    futures = {alias: _pool().submit(_call, func, alias) for alias in aliases if not _in_transaction(alias)}
+    local = {alias: func(alias) for alias in aliases if alias not in futures}
+    return [futures[alias].result() if alias in futures else local[alias] for alias in aliases]
+
+
+def sharded(queryset):
+    """``queryset`` over every shard; unchanged without shards or once it names a database."""
+    if (not settings.DATABASE_SHARDS or queryset._db is not None
+            or queryset.model._meta.label_lower not in SHARDED_MODELS):
+        return queryset
+    return _combine([queryset.using(alias) for alias in settings.DATABASE_SHARDS])
+
+
+def _combine(parts):
+    return parts[0] if len(parts) == 1 else ShardedQuerySet(parts)
+
+
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _put(rows, stop, item):
+    while not stop.is_set():
+        try:
+            rows.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _stream(queryset, chunk_size):
+    """Iterate ``queryset`` on a thread of its own, a few chunks ahead of the reader."""
+    if _in_transaction(queryset.db):
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    rows = queue.Queue(maxsize=STREAM_CHUNKS)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            iterator = queryset.iterator(chunk_size=chunk_size)
+            while chunk := list(islice(iterator, chunk_size)):
+                _put(rows, stop, chunk)
+                if stop.is_set():
+                    return
+            _put(rows, stop, None)
+        except Exception as e:
+            _put(rows, stop, e)
+        finally:
+            connections[queryset.db].close()
+
+    threading.Thread(target=produce, name=f'shard-stream-{queryset.db}', daemon=True).start()
+    try:
+        while (chunk := rows.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+    finally:
+        stop.set()
+
+
+class ShardedQuerySet:
+    """One query over several shards, read back as a single result set.
+
+    Chained calls apply to every shard's queryset. ``filter()`` on an id
+    (``pk``, ``locker_id``, ...) or an exact ``location`` drops the shards that
+    cannot match, returning a plain ``QuerySet`` once one is left. Evaluation
+    runs the shards in parallel and merges their rows by the query's ordering,
+    which must name fields the rows carry; a slice ``[a:b]`` fetches the first
+    ``b`` rows of each shard.
+    """
+
+    def __init__(self, parts):
+        self._parts = parts
+        self.model = parts[0].model
+        self._result_cache = None
+
+    def __repr__(self):
+        return f'<ShardedQuerySet {[part.db for part in self._parts]}>'
+
+    def _apply(self, method, *args, **kwargs):
+        return _combine([getattr(part, method)(*args, **kwargs) for part in self._parts])
+
+    def filter(self, *args, **kwargs):
+        parts = self._narrow(kwargs)
+        if not parts:
+            return self._parts[0].none()
+        return _combine([part.filter(*args, **kwargs) for part in parts])
+
+    def _narrow(self, kwargs):
+        aliases = {part.db for part in self._parts}
+        label = self.model._meta.label_lower
+        id_lookups = (('pk', 'id') if label in _SHARD_IDS else ()) + (('locker', 'locker_id') if label in _BY_LOCKER else ())
+        for lookup in id_lookups:
+            values = [kwargs[lookup]] if lookup in kwargs else kwargs.get(f'{lookup}__in')
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                continue
+            try:
+                aliases &= {shard_for_id(value) for value in values}
+            except (TypeError, ValueError):
+                pass
+        location = kwargs.get('location')
+        if isinstance(location, str) and any(field.name == 'location' for field in self.model._meta.fields):
+            aliases &= {shard_for_location(location)}
+        return [part for part in self._parts if part.db in aliases]
+
+    def using(self, alias):
+        return self._parts[0].using(alias)
+
+    def none(self):
+        return self._parts[0].none()
+
+    @property
+    def ordered(self):
+        return all(part.ordered for part in self._parts)
+
+    def _key(self):
+        """A merge key for this query's rows, or None when it is unordered."""
+        query = self._parts[0].query
+        ordering = query.order_by or (self.model._meta.ordering if query.default_ordering else ())
+        if not ordering:
+            return None
+        part = self._parts[0]
+        iterable = part._iterable_class
+        fields = list(part._fields or ()) or [field.attname for field in self.model._meta.concrete_fields]
+        getters = []
+        for name in ordering:
+            if not isinstance(name, str):
+                raise TypeError(f'Cannot merge shards ordered by {name!r}')
+            descending, name = name.startswith('-'), name.lstrip('-')
+            if '__' in name:
+                raise TypeError(f'Cannot merge shards on {name!r}: order by a field of the rows themselves')
+            if name == 'pk' and name not in fields:
+                name = self.model._meta.pk.attname
+            if iterable in (ModelIterable, NamedValuesListIterable):
+                getter = _attr(name)
+            elif name not in fields:
+                if not query.order_by:
+                    return None  # only the model's default ordering: leave the rows unmerged
+                raise TypeError(f'Cannot merge shards on {name!r}: the rows do not include it')
+            elif iterable is ValuesIterable:
+                getter = _item(name)
+            elif iterable is ValuesListIterable:
+                getter = _item(fields.index(name))
+            elif iterable is FlatValuesListIterable:
+                getter = _identity
+            else:
+                raise TypeError(f'Cannot merge shards of {iterable.__name__} rows')
+            getters.append((getter, descending))
+
+        def key(row):
+            out = []
+            for getter, descending in getters:
+                value = getter(row)
+                value = (value is None, value)
+                out.append(_Descending(value) if descending else value)
+            return out
+        return key
+
+    def _merge(self, streams):
+        key = self._key()
+        return chain(*streams) if key is None else heapq.merge(*streams, key=key)
+
+    def _fetch(self, stop=None):
+        by_alias = {part.db: part if stop is None else part[:stop] for part in self._parts}
+        return list(self._merge(gather(lambda alias: list(by_alias[alias]), by_alias)))
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = self._fetch()
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    async def __aiter__(self):
+        for row in await sync_to_async(self._fetch_all)():
+            yield row
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        return bool(self._fetch_all())
+
+    def __getitem__(self, k):
+        if self._result_cache is not None:
+            return self._result_cache[k]
+        if isinstance(k, int):
+            if k < 0:
+                raise ValueError('Negative indexing is not supported.')
+            return self[k:k + 1][0]
+        if k.step is not None:
+            raise ValueError('Stepped slices are not supported.')
+        return self._fetch(k.stop)[k.start or 0:k.stop]
+
+    def iterator(self, chunk_size=2000):
+        """Stream the merged rows, each shard read on its own thread."""
+        return self._merge([_stream(part, chunk_size) for part in self._parts])
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return sum(gather(lambda alias: self._part(alias).count(), self._aliases()))
+
+    def exists(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return any(gather(lambda alias: self._part(alias).exists(), self._aliases()))
+
+    def first(self):
+        rows = (self if self.ordered else self.order_by('pk'))[:1]
+        return rows[0] if rows else None
+
+    async def afirst(self):
+        return await sync_to_async(self.first)()
+
+    def get(self, *args, **kwargs):
+        clone = self.filter(*args, **kwargs) if args or kwargs else self
+        if not isinstance(clone, ShardedQuerySet):
+            return clone.get()
+        rows = clone._fetch(MAX_GET_RESULTS)
+        if len(rows) == 1:
+            return rows[0]
+        if not rows:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        raise self.model.MultipleObjectsReturned(f'get() returned more than one {self.model._meta.object_name}')
+
+    def _aliases(self):
+        return [part.db for part in self._parts]
+
+    def _part(self, alias):
+        return next(part for part in self._parts if part.db == alias)
+
+
+for _method in (
+    'all', 'exclude', 'order_by', 'reverse', 'distinct', 'only', 'defer', 'select_related',
+    'prefetch_related', 'annotate', 'alias', 'values', 'values_list', 'select_for_update',
+):
+    setattr(
+        ShardedQuerySet, _method,
+        lambda self, *args, _method=_method, **kwargs: self._apply(_method, *args, **kwargs),
+    )
+
+
+def _attr(name):
+    return lambda row: getattr(row, name)
+
+
+def _item(key):
+    return lambda row: row[key]
+
+
+def _identity(row):
+    return row
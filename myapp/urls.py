@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse
 
+from .metrics import metrics_view
+
 def home(request):
     return HttpResponse("""
         <h1>Locker Reservation System</h1>
@@ -16,4 +18,5 @@ urlpatterns = [
     path('', home, name='home'),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file